@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+"""
+Benchmarks do extrator.
+
+    python bench.py regex [--files files_exemplo] [--rounds 1000]
+    python bench.py corpus [--out bench_corpus] [--n 500] [--noise 0.3] [--seed 42]
+    python bench.py suite [--corpus bench_corpus] [--workers 4] [--json r.json] [--baseline r0.json]
+    python bench.py startup [--runs 10] [--json s.json]
+
+A suíte roda sobre um corpus sintético reproduzível (mesmo seed, mesmos PDFs)
+com um GPT falso local, sem rede nem custo.
+"""
+
+import argparse, hashlib, json, logging, os, random, re, resource, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+import cli
+
+console = Console()
+
+# ===== HELPERS =====
+
+def load_texts(files_dir: str) -> List[Tuple[str, str]]:
+    """(label, texto) de cada PDF da pasta; label inferido pelo nome do arquivo"""
+    logger = logging.getLogger("bench")
+    texts = []
+    for pdf in sorted(Path(files_dir).glob("*.pdf")):
+        text = cli.extract_text_from_pdf(str(pdf), logger)
+        if text:
+            texts.append(("carteira_oab" if "oab" in pdf.stem else "tela_sistema", text))
+    return texts
+
+def label_key(label: str) -> str:
+    return "oab" if "oab" in label.lower() else "tela"
+
+def docs_per_sec(fn: Callable[[str, str], object], texts: List[Tuple[str, str]], rounds: int) -> float:
+    for label, text in texts:  # aquecimento
+        fn(label, text)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for label, text in texts:
+            fn(label, text)
+    return rounds * len(texts) / (time.perf_counter() - start)
+
+# ===== REGEX =====
+
+def bench_regex(args):
+    texts = load_texts(args.files)
+    if not texts:
+        console.print(f"[bold red]Nenhum PDF em {args.files}[/bold red]")
+        return
+
+    registry = {
+        label: [(field, p) for field, pats in fields.items() for p in pats]
+        for label, fields in cli.LABEL_PATTERNS.items()
+    }
+
+    # Antes: re.search com a string do padrão, campo a campo
+    def strings(label, text):
+        return {f: re.search(p.pattern, text, p.flags) for f, p in registry[label_key(label)]}
+
+    # Antes, com o cache do `re` disputado (ex: muitos padrões aprendidos)
+    def strings_thrashed(label, text):
+        re.purge()
+        return strings(label, text)
+
+    # Depois: padrões pré-compilados do registro
+    def compiled(label, text):
+        return {f: p.search(text) for f, p in registry[label_key(label)]}
+
+    # Alternativa avaliada: uma única passada com todos os campos em alternação
+    # (lookaheads), verificando os campos ainda pendentes em cada posição candidata
+    combined_re = {
+        label: re.compile("|".join(f"(?=(?:{p.pattern}))" for _, p in pats), re.IGNORECASE)
+        for label, pats in registry.items()
+    }
+
+    def combined(label, text):
+        key = label_key(label)
+        pending = dict(registry[key])
+        found = {}
+        for m in combined_re[key].finditer(text):
+            for f in list(pending):
+                hit = pending[f].match(text, m.start())
+                if hit:
+                    found[f] = hit
+                    del pending[f]
+            if not pending:
+                break
+        return found
+
+    config = cli.Config(log_to_console=False, log_file="/dev/null", gpt_api_key="", text_cache=False)
+    extractor = cli.ExtractorV2(config, cli.setup_logger(config))
+    schemas = {label: {f: "" for f, _ in pats} for label, pats in registry.items()}
+
+    def extract(label, text):
+        return extractor.extract(text, schemas[label_key(label)], label)
+
+    table = Table(title=f"⚡ REGEX — {len(texts)} docs × {args.rounds} rodadas", expand=False)
+    table.add_column("Estratégia", style="cyan")
+    table.add_column("docs/s", style="green", justify="right")
+
+    for name, fn in [
+        ("re.search(str) (antes)", strings),
+        ("re.search(str) + cache frio (antes)", strings_thrashed),
+        ("pré-compilado (depois)", compiled),
+        ("alternação única (lookahead)", combined),
+        ("ExtractorV2.extract (níveis 0-1)", extract),
+    ]:
+        table.add_row(name, f"{docs_per_sec(fn, texts, args.rounds):,.0f}")
+
+    console.print(table)
+
+# ===== CORPUS SINTÉTICO =====
+
+FIRST_NAMES = ["ANA", "JOAO", "MARIA", "PEDRO", "LUCAS", "JULIANA", "CARLOS", "FERNANDA",
+               "RAFAEL", "BEATRIZ", "GABRIEL", "LARISSA", "MARCOS", "PATRICIA", "THIAGO", "CAMILA"]
+LAST_NAMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "LIMA", "PEREIRA", "COSTA", "RODRIGUES",
+              "ALMEIDA", "NASCIMENTO", "ARAUJO", "CARVALHO", "RIBEIRO", "GOMES", "MARTINS"]
+STATES = {"SP": "SÃO PAULO", "PR": "PARANÁ", "RJ": "RIO DE JANEIRO", "MG": "MINAS GERAIS",
+          "GO": "GOIÁS", "BA": "BAHIA", "RS": "RIO GRANDE DO SUL", "PE": "PERNAMBUCO"}
+CITIES = ["Mozarlândia", "Campinas", "Londrina", "Niterói", "Uberlândia", "Anápolis", "Feira de Santana", "Caruaru"]
+CATEGORIES = ["ADVOGADO", "ADVOGADA", "SUPLEMENTAR", "ESTAGIARIO"]
+STREETS = ["AVENIDA PAULISTA", "RUA DAS FLORES", "AVENIDA BRASIL", "RUA XV DE NOVEMBRO", "RODOVIA BR 101"]
+PRODUCTS = ["REFINANCIAMENTO", "CONSIGNADO", "CREDITO PESSOAL", "PORTABILIDADE"]
+SYSTEMS = ["CONSIGNADO", "VEICULOS", "IMOBILIARIO", "CARTAO"]
+OCR_CONFUSIONS = {"O": "0", "0": "O", "l": "1", "I": "l", "S": "5", "B": "8", "e": "c", "ç": "c", "ã": "a", "a": "o"}
+LOREM = ("Lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua").split()
+
+def _date(rng: random.Random) -> str:
+    return f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2015, 2032)}"
+
+def _money(rng: random.Random) -> str:
+    return f"{rng.randint(100, 99_999):,}".replace(",", ".") + f",{rng.randint(0, 99):02d}"
+
+def oab_text(rng: random.Random) -> List[str]:
+    uf = rng.choice(list(STATES))
+    phone = f"({rng.randint(11, 99)}) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}" if rng.random() < 0.6 else ""
+    return [
+        f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "Inscrição", "Seccional", "Subseção",
+        str(rng.randint(10_000, 999_999)), uf,
+        f"CONSELHO SECCIONAL - {STATES[uf]}",
+        rng.choice(CATEGORIES),
+        "Endereço Profissional",
+        f"{rng.choice(STREETS)}, Nº {rng.randint(1, 3000)}, Centro",
+        f"{rng.choice(CITIES).upper()} - {uf}",
+        f"{rng.randint(10_000_000, 99_999_999)}",
+        "Telefone Profissional", phone,
+        f"SITUAÇÃO {'REGULAR' if rng.random() < 0.9 else 'SUSPENSO'}",
+    ]
+
+def tela_operacao_text(rng: random.Random) -> List[str]:
+    return [
+        "Consulta de Cobrança", "Pesquisar por:", "Tipo:", "Sistema:", "Contrato:", "CLIENTE", "CPF",
+        "Operação Selecionada", "Operação", "Nome", "CPF/CNPJ", "Data Base", "Data Vencimento",
+        _date(rng), _date(rng), "Qtd. Parcelas", str(rng.choice([12, 24, 36, 48, 60, 72, 84, 96])),
+        "Produto", rng.choice(PRODUCTS), "VIr. Operação", "Sistema", rng.choice(SYSTEMS), "Vir. Parc.",
+        "Dados Básicos", f"Tipo Operação: {rng.choice(['Renegociação', 'Contratação', 'Refinanciamento'])}",
+        f"Tipo Sistema: {rng.choice(['Consignado', 'Veículos', 'Imobiliário'])}",
+        "Resumo", "Cobradora", "Nenhuma", "Negativado SERASA?", rng.choice(["Sim", "Não"]),
+    ]
+
+def tela_consulta_text(rng: random.Random) -> List[str]:
+    uf = rng.choice(list(STATES))
+    return [
+        "Consulta de Cobrança", "Pesquisar por:", "Tipo:", "Sistema:", "Contrato:", "Todos", "Todos", "V",
+        "Buscar", "CLIENTE", "CPF", "Operação Selecionada", "Sistema", rng.choice(SYSTEMS),
+        "VIr. Parc.", _money(rng),
+        f"Cidade: {rng.choice(CITIES)} U.F .: {uf} CEP: {rng.randint(10_000_000, 99_999_999)}",
+        "Dados para Contato", "Resumo", "Cobradora", "Nenhuma", "Negativado SPC?", rng.choice(["Sim", "Não"]),
+    ]
+
+def tela_saldos_text(rng: random.Random) -> List[str]:
+    total = _money(rng)
+    return [
+        "Consulta de Cobrança", "Detalhamento de saldos por parcelas:", f"Data Referência: {_date(rng)}",
+        "<< Esconder Filtros", "Data Referência:", "Seleção de parcelas:", "Intervalo de parcelas:",
+        "Atualizar", _date(rng), rng.choice(["Vencidas", "A vencer", "Todas"]), "Vcto mais antigo",
+        "Dias atraso Sistema", "Saldo Vencido", "Saldo a Vencer", "Total Geral", _date(rng),
+        f"{rng.randint(0, 900)} {rng.choice(SYSTEMS)}", "0,00", total, total, "Total:", total,
+    ]
+
+# (label, layout, arquivo de exemplo cujo schema o layout segue)
+LAYOUTS = [
+    ("carteira_oab", oab_text, "oab_1.pdf"),
+    ("tela_sistema", tela_operacao_text, "tela_sistema_1.pdf"),
+    ("tela_sistema", tela_consulta_text, "tela_sistema_2.pdf"),
+    ("tela_sistema", tela_saldos_text, "tela_sistema_3.pdf"),
+]
+
+def add_noise(lines: List[str], rng: random.Random) -> Tuple[List[str], List[str]]:
+    """Variante ruidosa: trocas de OCR, linhas perdidas/duplicadas e páginas de anexo"""
+    noisy = []
+    for line in lines:
+        r = rng.random()
+        if r < 0.08:
+            continue  # linha perdida (campo vai para o fallback)
+        line = "".join(OCR_CONFUSIONS[c] if c in OCR_CONFUSIONS and rng.random() < 0.03 else c for c in line)
+        if r > 0.95:
+            line = re.sub(" ", "  ", line)
+        noisy.append(line)
+        if r > 0.97:
+            noisy.append(line)
+    annex = [" ".join(rng.choice(LOREM) for _ in range(14)) for _ in range(rng.randint(0, 60))]
+    return noisy, annex
+
+def write_pdf(path: Path, pages: List[List[str]]):
+    doc = cli.load_fitz().open()
+    for lines in pages:
+        page = doc.new_page()
+        page.insert_text((36, 48), "\n".join(lines), fontsize=10)
+    doc.set_metadata({})  # sem datas/ID: mesmo seed, mesmos bytes
+    doc.save(str(path), no_new_id=True)
+    doc.close()
+
+def generate_corpus(out_dir: str, n: int, noise: float, seed: int, schemas_file: str) -> Path:
+    """PDFs sintéticos + batch.jsonl (label, schema, arquivo); mesmo seed, mesmo corpus"""
+    with open(schemas_file, "r", encoding="utf-8") as f:
+        schemas = {item["pdf_path"]: item["extraction_schema"] for item in json.load(f)}
+
+    rng = random.Random(seed)
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    with open(out / "batch.jsonl", "w", encoding="utf-8") as batch:
+        for i in range(n):
+            label, layout, example = LAYOUTS[i % len(LAYOUTS)]
+            lines = layout(rng)
+            pages = [lines]
+            noisy = rng.random() < noise
+            if noisy:
+                lines, annex = add_noise(lines, rng)
+                pages = [lines] + [annex[j:j + 60] for j in range(0, len(annex), 60)]
+
+            name = f"{label}_{i:05d}{'_ruido' if noisy else ''}.pdf"
+            write_pdf(out / name, pages)
+            batch.write(json.dumps({"label": label, "extraction_schema": schemas[example], "pdf_path": name},
+                                   ensure_ascii=False) + "\n")
+    return out
+
+def bench_corpus(args):
+    start = time.perf_counter()
+    out = generate_corpus(args.out, args.n, args.noise, args.seed, args.schemas)
+    console.print(f"[green]✅ {args.n} PDFs em {out} ({time.perf_counter() - start:.1f}s)[/green]")
+
+# ===== GPT FALSO =====
+
+class FakeGPTServer:
+    """
+    Servidor local compatível com /v1/chat/completions: resposta determinística
+    (hash do campo + prompt), latência fixa e `usage` aproximado. Aponte
+    `Config.gpt_base_url` para `url`; funciona também nos workers.
+    """
+
+    def __init__(self, latency_ms: float = 50.0):
+        self.latency_s = latency_ms / 1000
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                data = json.dumps(server.completion(body)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        # Backlog padrão (5) é menor que --gpt-concurrency: conexões excedentes
+        # esperam a retransmissão do SYN (~1 s) e distorcem o throughput
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler, bind_and_activate=False)
+        self.httpd.request_queue_size = 128
+        self.httpd.server_bind()
+        self.httpd.server_activate()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    @staticmethod
+    def fake_value(field: str, text: str) -> str:
+        h = int(hashlib.sha256(f"{field}\n{text}".encode()).hexdigest()[:8], 16)
+        if "data" in field:
+            return f"{h % 28 + 1:02d}/{h % 12 + 1:02d}/20{h % 30 + 10}"
+        if "valor" in field or "total" in field:
+            return f"{h % 9000 + 100},{h % 100:02d}"
+        return f"VALOR {h % 10_000}"
+
+    def completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency_s)
+
+        prompt = body["messages"][-1]["content"]
+        m = re.search(r"JSON: (\[.*?\])", prompt)
+        fields = json.loads(m.group(1)) if m else []
+        docs = re.split(r"### Documento (\d+)\n", prompt)
+        if len(docs) > 1:  # requisição em lote
+            answer = {docs[i]: {f: self.fake_value(f, docs[i + 1]) for f in fields} for i in range(1, len(docs), 2)}
+        else:
+            answer = {f: self.fake_value(f, prompt) for f in fields}
+
+        return {
+            "id": f"fake-{self.requests}", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(answer, ensure_ascii=False)}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 10 * len(fields),
+                      "total_tokens": len(prompt) // 4 + 10 * len(fields)},
+        }
+
+    def __enter__(self) -> "FakeGPTServer":
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ===== SUÍTE =====
+
+def load_batch(corpus: Path) -> List[Dict]:
+    with open(corpus / "batch.jsonl", "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def run_extract(corpus: Path, items: List[Dict], rounds: int) -> Dict[str, Any]:
+    """ExtractorV2.extract (níveis 0-1) sobre o texto já extraído"""
+    logger = logging.getLogger("bench")
+    docs = []
+    for item in items:
+        text = cli.extract_text_from_pdf(str(corpus / item["pdf_path"]), logger)
+        if text:
+            docs.append((item, text))
+
+    config = cli.Config(log_to_console=False, log_file=os.devnull, gpt_api_key="", text_cache=False)
+    extractor = cli.ExtractorV2(config, cli.setup_logger(config))
+
+    def extract(item, text):
+        extractor.extract(text, item["extraction_schema"], item["label"], use_gpt=False)
+
+    for item, text in docs:  # aquecimento (padrões aprendidos)
+        extract(item, text)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for item, text in docs:
+            extract(item, text)
+    return {"docs_per_sec": rounds * len(docs) / (time.perf_counter() - start)}
+
+def run_batch(corpus: Path, workdir: Path, name: str, **overrides) -> Dict[str, Any]:
+    """process_batch completo (GPT falso), sem caches persistentes para ser reproduzível"""
+    out = workdir / name
+    config = cli.Config(
+        log_to_console=False,
+        log_file=str(workdir / "bench.log"),
+        text_cache=False,
+        gpt_cache=False,
+        pattern_store=False,
+        dedup=False,
+        output_format="jsonl",
+        quiet=True,  # sem painel, progresso e tabelas do process_batch
+        metrics_file=str(workdir / f"{name}.metrics.json"),
+        **overrides,
+    )
+
+    cli.reset_peak_rss()
+    start = time.perf_counter()
+    cli.process_batch(str(corpus / "batch.jsonl"), str(corpus), str(out), config)
+    elapsed = time.perf_counter() - start
+
+    with open(config.metrics_file, "r", encoding="utf-8") as f:
+        metrics = json.load(f)
+    with open(out / "results.jsonl", "r", encoding="utf-8") as f:
+        results = [json.loads(line) for line in f]
+    with_gpt = sum(1 for r in results if {"gpt", "gpt_cache"} & set(r["_sources"].values()))
+
+    stages = metrics["stages"]
+    return {
+        "docs": len(results),
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": len(results) / elapsed,
+        "stages_p50_ms": {k: v["p50_ms"] for k, v in stages.items()},
+        "stages_p95_ms": {k: v["p95_ms"] for k, v in stages.items()},
+        "peak_rss_mb": round(cli.peak_rss_mb() or 0, 1),
+        "workers_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "gpt_fallback_rate": with_gpt / len(results) if results else 0.0,
+        "gpt_requests": metrics["gpt_usage"].get("requests", 0),
+    }
+
+def bench_suite(args):
+    corpus = Path(args.corpus)
+    if not (corpus / "batch.jsonl").exists():
+        console.print(f"[yellow]Corpus não encontrado em {corpus}; gerando {args.n} PDFs (seed {args.seed})[/yellow]")
+        generate_corpus(args.corpus, args.n, args.noise, args.seed, args.schemas)
+
+    items = load_batch(corpus)
+    results: Dict[str, Dict[str, Any]] = {}
+
+    results["extract (níveis 0-1)"] = run_extract(corpus, items, args.rounds)
+
+    with FakeGPTServer(args.gpt_latency_ms) as gpt, tempfile.TemporaryDirectory() as tmp:
+        gpt_config = dict(gpt_api_key="fake", gpt_base_url=gpt.url)
+        scenarios = [
+            ("batch 1 worker", dict(workers=1)),
+            (f"batch {args.workers} workers", dict(workers=args.workers)),
+            (f"batch {args.workers} workers + GPT assíncrono", dict(workers=args.workers, gpt_async=True)),
+            (f"batch {args.workers} workers + GPT em lote", dict(workers=args.workers, gpt_async=True, gpt_batch_size=8)),
+            ("pipeline 1 worker", dict(workers=1, pipeline=True)),
+            (f"pipeline {args.workers} workers", dict(workers=args.workers, pipeline=True)),
+        ]
+        for i, (name, overrides) in enumerate(scenarios):
+            results[name] = run_batch(corpus, Path(tmp), f"run{i}", **gpt_config, **overrides)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    table = Table(title=f"🏁 SUÍTE — {len(items)} PDFs sintéticos ({corpus})", expand=False)
+    table.add_column("Cenário", style="cyan", no_wrap=True)
+    table.add_column("docs/s", style="green", justify="right")
+    if baseline:
+        table.add_column("Δ base", justify="right")
+    for col in ("total p50/p95 ms", "pdf p50", "regex p50", "gpt p50", "RSS MB", "GPT %"):
+        table.add_column(col, justify="right")
+
+    regressions = []
+    for name, r in results.items():
+        row = [name, f"{r['docs_per_sec']:,.0f}"]
+        if baseline:
+            old = baseline.get(name, {}).get("docs_per_sec")
+            delta = (r["docs_per_sec"] / old - 1) if old else None
+            if delta is not None and delta < -args.tolerance:
+                regressions.append(name)
+            row.append("—" if delta is None else f"[{'red' if delta < -args.tolerance else 'green'}]{delta:+.0%}[/]")
+
+        p50, p95 = r.get("stages_p50_ms", {}), r.get("stages_p95_ms", {})
+        if "docs" in r:
+            rss = f"{r['peak_rss_mb']:.0f}" + (f" / {r['workers_peak_rss_mb']:.0f}" if "worker" in name and "1 worker" not in name else "")
+            row += [f"{p50.get('total', 0):.1f} / {p95.get('total', 0):.1f}", f"{p50.get('pdf', 0):.1f}",
+                    f"{p50.get('regex', 0):.2f}", f"{p50.get('gpt', 0):.0f}", rss, f"{r['gpt_fallback_rate']:.0%}"]
+        else:
+            row += ["—"] * 6
+        table.add_row(*row)
+
+    console.print(table)
+    console.print("[dim]RSS: processo principal / maior worker. GPT %: documentos com algum campo vindo do GPT.[/dim]")
+
+    if args.json:
+        report = {
+            "corpus": {"path": str(corpus), "docs": len(items)},
+            "python": sys.version.split()[0],
+            "gpt_latency_ms": args.gpt_latency_ms,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        console.print(f"[dim]Resultados em {args.json}[/dim]")
+
+    if regressions:
+        console.print(f"[bold red]❌ Regressão acima de {args.tolerance:.0%}: {', '.join(regressions)}[/bold red]")
+        sys.exit(1)
+
+# ===== STARTUP =====
+
+# Módulos que o `import cli` não deve carregar (ficam para a etapa que os usa)
+HEAVY_MODULES = ["openai", "pymupdf", "fitz", "rich", "asyncio", "http.server"]
+
+def time_command(cmd: List[str], cwd: str, env: Dict[str, str], runs: int) -> List[float]:
+    subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, check=True)  # aquecimento (.pyc, cache do SO)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)
+
+def bench_startup(args):
+    repo = Path(cli.__file__).resolve().parent
+    py = sys.executable
+    # Sem chave da API nem .env (mede só o caminho regex) e com .pyc habilitado, como numa instalação normal
+    env = {k: v for k, v in os.environ.items()
+           if k not in ("OPENAI_API_KEY", "OPENAI_BASE_URL", "PYTHONDONTWRITEBYTECODE")}
+    env["PYTHONPATH"] = str(repo)
+
+    with open(repo / "batch_exemplo.json", "r", encoding="utf-8") as f:
+        item = json.load(f)[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        batch = Path(tmp) / "batch.json"
+        batch.write_text(json.dumps([item], ensure_ascii=False), encoding="utf-8")
+        one_doc = [str(batch), str((repo / args.files).resolve()), str(Path(tmp) / "out"),
+                   "--no-text-cache", "--no-pattern-store"]
+        scenarios = [
+            ("import cli", [py, "-c", "import cli"]),
+            ("cli.py --help", [py, str(repo / "cli.py"), "--help"]),
+            ("-m cli --help", [py, "-m", "cli", "--help"]),
+            ("1 documento: cli.py", [py, str(repo / "cli.py"), *one_doc]),
+            ("1 documento: -m cli --quiet", [py, "-m", "cli", *one_doc, "--quiet"]),
+        ]
+        results = {}
+        for name, cmd in scenarios:
+            samples = time_command(cmd, tmp, env, args.runs)
+            results[name] = {"p50_ms": round(cli.percentile(samples, 0.5), 1), "min_ms": round(samples[0], 1)}
+
+        probe = f"import cli, sys, json; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+        out = subprocess.run([py, "-c", probe], cwd=tmp, env=env, capture_output=True, text=True, check=True).stdout
+        loaded = json.loads(out.strip().splitlines()[-1])  # o `import fitz` antigo escreve aviso no stdout
+
+    table = Table(title=f"🚀 STARTUP — {args.runs} execuções por cenário", expand=False)
+    table.add_column("Comando", style="cyan")
+    table.add_column("p50 ms", style="green", justify="right")
+    table.add_column("mín ms", justify="right")
+    for name, r in results.items():
+        table.add_row(name, f"{r['p50_ms']:.0f}", f"{r['min_ms']:.0f}")
+    console.print(table)
+    console.print(f"Módulos pesados após `import cli`: {', '.join(loaded) if loaded else '[green]nenhum[/green]'}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results, "heavy_modules_loaded": loaded},
+                      f, ensure_ascii=False, indent=2)
+        console.print(f"[dim]Resultados em {args.json}[/dim]")
+
+# ===== MAIN =====
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do extrator")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("regex", help="micro-benchmark do nível regex (docs/s)")
+    p.add_argument("--files", default="files_exemplo", help="pasta com PDFs de amostra")
+    p.add_argument("--rounds", type=int, default=1000)
+    p.set_defaults(fn=bench_regex)
+
+    def corpus_args(p, out_flag):
+        p.add_argument(out_flag, default="bench_corpus", help="pasta do corpus sintético")
+        p.add_argument("--n", type=int, default=500, help="quantidade de PDFs")
+        p.add_argument("--noise", type=float, default=0.3, help="fração de documentos com ruído de OCR/anexos")
+        p.add_argument("--seed", type=int, default=42)
+        p.add_argument("--schemas", default="batch_exemplo.json", help="batch de onde vêm os schemas por layout")
+
+    p = sub.add_parser("corpus", help="gera o corpus sintético (PDFs + batch.jsonl)")
+    corpus_args(p, "--out")
+    p.set_defaults(fn=bench_corpus)
+
+    p = sub.add_parser("suite", help="suíte completa: extract, batch com 1/N workers e GPT assíncrono/lote")
+    corpus_args(p, "--corpus")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--rounds", type=int, default=20, help="rodadas do micro-benchmark de extract")
+    p.add_argument("--gpt-latency-ms", type=float, default=50.0, help="latência simulada do GPT falso")
+    p.add_argument("--json", default=None, help="salva os resultados (use como baseline depois)")
+    p.add_argument("--baseline", default=None, help="JSON de uma execução anterior para comparar docs/s")
+    p.add_argument("--tolerance", type=float, default=0.2, help="queda de docs/s tolerada antes de falhar (exit 1)")
+    p.set_defaults(fn=bench_suite)
+
+    p = sub.add_parser("startup", help="tempo de inicialização do CLI (processo novo a cada execução)")
+    p.add_argument("--files", default="files_exemplo", help="pasta com o PDF do cenário de 1 documento")
+    p.add_argument("--runs", type=int, default=10)
+    p.add_argument("--json", default=None, help="salva os resultados")
+    p.set_defaults(fn=bench_startup)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+if __name__ == "__main__":
+    main()
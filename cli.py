@@ -1,38 +1,67 @@
 #!/usr/bin/env python3
 
-import os, sys, json, re, time, logging
+import os, sys, json, re, time, math, logging, argparse, threading, hashlib, sqlite3, queue, signal
+import importlib.util
+import unicodedata
 from pathlib import Path
-from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional, Tuple
-from dataclasses import dataclass, asdict, field
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple, Iterable, Iterator, Callable, NamedTuple, Set
+from dataclasses import dataclass, asdict, field, replace
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from collections import deque
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+from itertools import islice
 import traceback
-from dotenv import load_dotenv
 
-# 🎨 RICH IMPORTS (apenas personalização)
-from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
-from rich.logging import RichHandler
-from rich.style import Style
-from rich import print as rprint
+# Rich, PyMuPDF, openai e asyncio só são importados na etapa que os usa:
+# juntos custam ~1s de startup (o openai sozinho ~0,7s), pago mesmo em execuções sem GPT
+HAS_FITZ = any(importlib.util.find_spec(m) is not None for m in ("pymupdf", "fitz"))
+HAS_OPENAI = importlib.util.find_spec("openai") is not None
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
 
-# Inicializar console Rich
-console = Console()
-
-load_dotenv(".env", override=True)
+if os.path.exists(".env"):
+    from dotenv import load_dotenv
+    load_dotenv(".env", override=True)
 
 try:
-    import fitz
-    HAS_FITZ = True
-except:
-    HAS_FITZ = False
+    import fcntl
+except ImportError:
+    fcntl = None
 
-try:
-    from openai import OpenAI
-    HAS_OPENAI = True
-except:
-    HAS_OPENAI = False
+# 🎨 Console Rich, criado no primeiro uso (o modo --quiet nunca importa o Rich)
+_console = None
+
+def get_console():
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+def load_fitz():
+    """PyMuPDF: `pymupdf` nas versões novas (o nome `fitz` imprime aviso de depreciação no stdout)"""
+    try:
+        import pymupdf
+        return pymupdf
+    except ImportError:
+        import fitz
+        return fitz
+
+class NullProgress:
+    """Substituto da barra de progresso do Rich no modo --quiet"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_task(self, *args, **kwargs) -> int:
+        return 0
+
+    def update(self, *args, **kwargs):
+        pass
 
 
 
@@ -43,60 +72,1055 @@ class Config:
     """Config centralizado"""
     gpt_model: str = os.getenv("GPT_MODEL", "gpt-5-mini")
     gpt_api_key: str = os.getenv("OPENAI_API_KEY", "")
+    gpt_base_url: str = os.getenv("OPENAI_BASE_URL", "")
     gpt_timeout: int = 30
     gpt_max_tokens: int = 1500
     gpt_temperature: float = 1.0
-    text_truncate_size: int = 2000
+    text_truncate_size: int = 2000  # gpt_context=head: caracteres do documento no prompt
+    gpt_context: str = "fields"  # fields (janelas relevantes a cada campo nulo) | head (início do texto)
+    gpt_context_tokens: int = 500  # fields: orçamento de tokens do documento no prompt (~4 caracteres/token)
     gpt_threshold: float = 0.3
+    gpt_routing: str = "threshold"  # threshold (regra global de nulos) | confidence (ganho esperado por campo)
+    gpt_token_budget: int = 0  # tokens estimados por batch para o GPT (0 = sem limite)
+    gpt_min_field_gain: float = 0.15  # confidence: ganho esperado mínimo para pedir um campo
+    gpt_min_confidence: float = 0.5  # confidence: abaixo disso um valor de padrão aprendido é reavaliado
+    gpt_min_gain_per_1k_tokens: float = 0.2  # confidence: campos esperados por 1k tokens para valer a chamada
+    gpt_async: bool = False
+    gpt_concurrency: int = 8
+    gpt_rate_limit: float = 0.0  # requisições/s (0 = sem limite)
+    gpt_batch_size: int = 1  # documentos por requisição no modo assíncrono (1 = sem lote)
+    gpt_batch_wait_ms: float = 200.0  # espera máxima para completar um lote
+    gpt_cache: bool = True
+    gpt_cache_path: str = ".cache/gpt_cache.sqlite3"
+    gpt_cache_ttl_hours: float = 24 * 7
+    gpt_cache_max_entries: int = 100_000
     log_level: str = "INFO"
     log_file: str = "extraction.log"
     log_to_console: bool = True
+    log_async: bool = False  # handlers (Rich, arquivo) numa thread própria, via fila
+    log_format: str = "text"  # text | json (arquivo de log em JSON lines)
+    log_sample: int = 0  # 1 linha INFO a cada N documentos ok + linha agregada (0 = 1 até 1.000 docs, senão 100)
+    quiet: bool = False  # saída simples, sem Rich: só avisos/erros no stderr e uma linha de resumo
+    text_cache: bool = True
+    text_cache_dir: str = ".cache/text"
+    text_cache_max_mb: int = 512
+    lazy_pages: bool = True  # para de ler páginas quando o regex preenche o schema
+    dedup: bool = False  # reaproveita a extração de documentos idênticos (ou quase, com dedup_min_similarity < 1)
+    dedup_path: str = ".cache/dedup.json"
+    dedup_min_similarity: float = 1.0  # 1 = só PDFs idênticos (sha256); < 1: Jaccard estimado (MinHash) para "quase idêntico"
+    dedup_max_entries: int = 50_000
+    low_memory: bool = False  # PDFs abertos pelo caminho, texto limitado, workers reciclados, pico de RSS
+    max_text_chars: int = 2_000_000  # texto máximo por documento no modo low_memory
+    worker_max_docs: int = 200  # documentos por processo antes de reciclar (low_memory, --workers > 1)
+    metrics_file: Optional[str] = None  # padrão: <output_dir>.metrics.json
+    metrics_port: int = 0  # > 0 serve /metrics (Prometheus) durante o batch
+    metrics_host: str = "127.0.0.1"  # interface do /metrics (0.0.0.0 expõe na rede)
     batch_size: int = 100
     progress_interval: int = 10
+    workers: int = 1
+    pipeline: bool = False  # etapas sobrepostas: leitura (threads) -> parse -> GPT -> escrita (thread)
+    read_threads: int = 4  # pipeline: threads de stat/prefetch dos PDFs
+    lookahead: int = 64  # pipeline: janela de agendamento (maiores primeiro) e fila da escrita
+    output_format: str = "json"  # json (um arquivo por documento) | jsonl (results.jsonl) | parquet (results/<label>/)
+    typed_output: Optional[str] = None  # parquet | csv: colunas tipadas em <output_dir>/typed/
+    row_group_size: int = 10_000  # documentos por row group (parquet) / entre fsyncs (jsonl) / lote de normalização (typed)
+    resume: bool = False
+    pattern_store: bool = True
+    pattern_store_path: str = ".cache/patterns.json"
+    serve_port: int = 8000  # modo serviço: 0 = sem HTTP (só watcher)
+    serve_host: str = "127.0.0.1"  # interface do HTTP (sem autenticação: 0.0.0.0 expõe na rede)
+    serve_queue_size: int = 256  # documentos aguardando extração antes de recusar (503)
+    serve_timeout_s: float = 120.0  # espera máxima de um POST /extract
+    watch_dir: Optional[str] = None  # pasta observada por batches (.json/.jsonl)
+    watch_interval_s: float = 1.0
+
+class JsonLineFormatter(logging.Formatter):
+    """Uma linha JSON por registro; `extra={"doc": {...}}` vira o campo `doc`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "process": record.process,
+            "msg": record.getMessage(),
+        }
+        doc = getattr(record, "doc", None)
+        if doc is not None:
+            entry["doc"] = doc
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+# Thread que grava os logs no modo log_async (uma por processo)
+_log_listener = None
+_log_exit_pid = None  # processo em que stop_logging já está registrado para a saída
+
+def stop_logging():
+    """
+    Esvazia a fila do log assíncrono e para a thread (no fim do batch/serviço
+    e na saída do processo); o logger volta a usar os handlers diretamente.
+    """
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener and listener.pid == os.getpid():
+        listener.stop()
+        logger = logging.getLogger("extractor")
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        for h in listener.handlers:
+            logger.addHandler(h)
+
+def flush_logging():
+    """Espera a fila do log assíncrono esvaziar (antes de tabelas/resumo irem para o console)"""
+    if _log_listener and _log_listener.pid == os.getpid():
+        _log_listener.stop()
+        _log_listener.start()
 
 def setup_logger(config: Config) -> logging.Logger:
     """Setup logger com Rich handler"""
+    global _log_listener, _log_exit_pid
     logger = logging.getLogger("extractor")
     logger.setLevel(getattr(logging, config.log_level))
 
+    # Evita handlers duplicados (ex: herdados pelo fork dos workers)
+    stop_logging()
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+        h.close()
+    handlers = []
+
+    # --quiet: handler simples no stderr, só avisos e erros
+    if config.log_to_console and config.quiet:
+        sh = logging.StreamHandler(sys.stderr)
+        sh.setLevel(logging.WARNING)
+        sh.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        handlers.append(sh)
+
     # 🎨 Rich handler para console
-    if config.log_to_console:
+    elif config.log_to_console:
+        from rich.logging import RichHandler
         rh = RichHandler(
-            console=console,
+            console=get_console(),
             rich_tracebacks=True,
             show_time=True,
             show_level=True,
             show_path=False
         )
         rh.setLevel(logging.INFO)
-        logger.addHandler(rh)
+        handlers.append(rh)
 
-    # File handler tradicional
+    # File handler tradicional (ou JSON lines)
     fh = logging.FileHandler(config.log_file, encoding="utf-8")
     fh.setLevel(getattr(logging, config.log_level))
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    if config.log_format == "json":
+        fh.setFormatter(JsonLineFormatter())
+    else:
+        fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handlers.append(fh)
+
+    if not config.log_async:
+        for h in handlers:
+            logger.addHandler(h)
+        return logger
+
+    # --log-async: quem loga só enfileira; renderização do Rich e escrita em disco ficam na thread
+    from logging.handlers import QueueHandler, QueueListener
+    import atexit
+    import multiprocessing.util
 
+    log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.pid = os.getpid()
+    _log_listener.start()
+    logger.addHandler(QueueHandler(log_queue))
+    if _log_exit_pid != os.getpid():
+        # Workers do pool saem sem atexit; o Finalize do multiprocessing roda antes do os._exit
+        atexit.register(stop_logging)
+        multiprocessing.util.Finalize(None, stop_logging, exitpriority=100)
+        _log_exit_pid = os.getpid()
     return logger
 
+def openai_client_kwargs(config: Config) -> Dict[str, Any]:
+    kwargs = {"api_key": config.gpt_api_key}
+    # base_url permite apontar para um servidor local (stub/proxy) compatível com a API
+    if config.gpt_base_url:
+        kwargs["base_url"] = config.gpt_base_url
+    return kwargs
+
+# ===== REGEX ENGINE =====
+# Registro de regex pré-compiladas por label. Tudo é compilado uma vez no
+# import: o cache interno do `re` é pequeno e passa a ser disputado quando
+# os padrões aprendidos (global_patterns) entram no jogo.
+
+_I = re.IGNORECASE
+
+OAB_PATTERNS: Dict[str, re.Pattern] = {
+    "categoria_linha": re.compile(r"(SUPLEMENTAR|ADVOGADO|ADVOGADA|ESTAGIÁRIO|ESTAGIARIO|ESTAGIARIA)", _I),
+    "nome": re.compile(r"^[A-ZÇÁÉÍÓÚÂÃÕ'\s]+$"),
+    "inscricao": re.compile(r"Inscri[cç][aã]o[\s\S]{0,50}?(\d{4,6})\s*([A-Z]{2})(?=\s|$)", _I),
+    "subsecao": re.compile(r"(CONSELHO\s+SECCIONAL\s*-\s*[A-ZÇÁÉÍÓÚÂÃÕ ]+)", _I),
+    "categoria": re.compile(r"\b(SUPLEMENTAR|ADVOGADO|ADVOGADA|ESTAGIARIO|ESTAGIÁRIO|ESTAGIARIA)\b", _I),
+    "endereco_profissional": re.compile(r"(AVENIDA|RUA|AV\.|PRAÇA|PCA|RODOVIA)\s+[^\n]{5,120}", _I),
+    "telefone_profissional": re.compile(r"\(?\d{2}\)?[\s-]?\d{4,5}[-\s]?\d{4}"),
+    "situacao": re.compile(r"SITUA(?:C|Ç)[AÃ]O[\s:\n]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+)", _I),
+}
+
+TELA_PATTERNS: Dict[str, List[re.Pattern]] = {
+    field: [re.compile(p, _I) for p in pats] for field, pats in {
+        "data_referencia": [r"(?:Data Referência|Data Reference)[\s:\n]+(\d{2}/\d{2}/\d{4})"],
+        "data_base": [r"(?:Data Base|Data\s+Base)[\s:\n]+(\d{2}/\d{2}/\d{4})"],
+        "data_vencimento": [r"(?:Data Vencimento|Data\s+Vencimento|Vcto[\s:\n]*)[\s:\n]*(\d{2}/\d{2}/\d{4})"],
+        "valor_parcela": [r"(?:Vlr\.?\s*Parc\.?|Valor\s*Parcela|Vlr\.\s*Parc\.)[\s:\n]*([0-9,.]+)"],
+        "quantidade_parcelas": [r"(?:Qtd\.?\s*Parcelas?|Quantidade\s+Parcelas?|Qtde\s+Parc\.?)[\s:\n]*(\d+)"],
+        "total_de_parcelas": [r"Total[\s:\n]*([0-9,.]+)(?!\d)"],
+        "selecao_de_parcelas": [r"(?:Seleção\s+de\s+parcelas|Selecao\s+de\s+parcelas)[\s:\n]*([^\n]+)"],
+        "sistema": [r"(?:Dias\s+atraso\s+)?Sistema\s*[\n\s]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+?)(?:\n|$)"],
+        "produto": [r"(?:Saldo\s+Vencido|Saldo\s+a\s+Vencer)[\s\S]{0,150}?0\s+([A-ZÇÁÉÍÓÚÂÃÕ]+)(?:\n|$)"],
+        "pesquisa_por": [r"(?:Pesquisa\s+Por|Pesquisa\s+por)[\s:\n]*([^\n]+?)(?:\n|$)"],
+        "pesquisa_tipo": [r"(?:Pesquisa\s+Tipo|Tipo\s+de\s+pesquisa|Tipo)[\s:\n]*([^\n]+?)(?:\n|$)"],
+        "cidade": [r"(?:Cidade|Municipio|Município)[\s:\n]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+?)(?:\n|,|$)"],
+    }.items()
+}
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Alternativa de palavras literais como trie (ex: qtd|qtde|quantidade -> q(?:td(?:e)?|uantidade))"""
+    trie: Dict[str, Any] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: Dict[str, Any]) -> str:
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+class KeywordPrefilter:
+    """
+    Âncoras literais dos padrões de campo, achadas numa única passada (regex
+    em trie sobre o texto em minúsculas) com todas as posições, inclusive
+    sobrepostas. Os padrões do campo só são tentados nessas posições
+    (first_anchored_match); campos sem âncora no texto nem rodam.
+    """
+
+    def __init__(self, anchors: Dict[str, Tuple[str, ...]]):
+        self.fields_by_keyword: Dict[str, List[str]] = {}
+        for field, keywords in anchors.items():
+            for kw in keywords:
+                self.fields_by_keyword.setdefault(kw.lower(), []).append(field)
+        alternation = f"(?=({trie_regex(self.fields_by_keyword)}))"
+        self.regex = re.compile(alternation)
+        self.regex_i = re.compile(alternation, _I)
+
+    def scan(self, text: str) -> Dict[str, List[int]]:
+        """campo -> posições (crescentes) das âncoras no texto"""
+        hits: Dict[str, List[int]] = {}
+        # Minúsculas + regex sensível a maiúsculas é ~3x mais rápido que IGNORECASE;
+        # se lower() mudar o tamanho do texto (ex: "İ"), as posições não batem
+        folded = text.lower()
+        matches = self.regex.finditer(folded) if len(folded) == len(text) else self.regex_i.finditer(text)
+        for m in matches:
+            found = m.group(1).lower()
+            # A trie casa a palavra mais longa; as mais curtas (prefixos) valem na mesma posição
+            for k in range(1, len(found) + 1):
+                for field in self.fields_by_keyword.get(found[:k], ()):
+                    positions = hits.setdefault(field, [])
+                    if not positions or positions[-1] != m.start():
+                        positions.append(m.start())
+        return hits
+
+def first_anchored_match(pat: re.Pattern, text: str, positions: List[int]) -> Optional[re.Match]:
+    """
+    Equivale a pat.search(text) quando todo match começa numa âncora do campo:
+    tenta pat.match só nas posições das âncoras, em ordem.
+    """
+    for pos in positions:
+        m = pat.match(text, pos)
+        if m:
+            return m
+    return None
+
+# Palavras com que cada padrão de campo começa (prefixos bastam: "advogad" cobre ADVOGADO/ADVOGADA)
+TELA_ANCHORS: Dict[str, Tuple[str, ...]] = {
+    "data_referencia": ("data",),
+    "data_base": ("data",),
+    "data_vencimento": ("data", "vcto"),
+    "valor_parcela": ("vlr", "valor"),
+    "quantidade_parcelas": ("qtd", "quantidade"),
+    "total_de_parcelas": ("total",),
+    "selecao_de_parcelas": ("seleção", "selecao"),
+    "sistema": ("sistema",),  # o prefixo opcional "Dias atraso" não muda o valor capturado
+    "produto": ("saldo",),
+    "pesquisa_por": ("pesquisa",),
+    "pesquisa_tipo": ("pesquisa", "tipo"),
+    "cidade": ("cidade", "municipio", "município"),
+}
+
+OAB_ANCHORS: Dict[str, Tuple[str, ...]] = {
+    "inscricao": ("inscri",),
+    "subsecao": ("conselho",),
+    "categoria": ("suplementar", "advogad", "estagi"),
+    "endereco_profissional": ("av", "rua", "praça", "pca", "rodovia"),
+    "situacao": ("situa",),
+}
+
+TELA_PREFILTER = KeywordPrefilter(TELA_ANCHORS)
+OAB_PREFILTER = KeywordPrefilter(OAB_ANCHORS)
+
+LABEL_PATTERNS: Dict[str, Dict[str, List[re.Pattern]]] = {
+    "oab": {k: [p] for k, p in OAB_PATTERNS.items()},
+    "tela": TELA_PATTERNS,
+}
+
+# Validação de valores vindos do GPT (_extract_pattern_from_value)
+RE_DATE = re.compile(r"\d{2}/\d{2}/\d{4}")
+RE_CPF = re.compile(r"\d{3}\.\d{3}\.\d{3}-\d{2}")
+RE_CNPJ = re.compile(r"\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}")
+RE_DIGIT = re.compile(r"\d")
+RE_MONEY_CONTEXT = re.compile(r"(?:Valor|Total|Preço|Preco|Custo|Importe|Documento|Montante)[\s:]*", _I)
+RE_UPPER_NAME = re.compile(r"^[A-ZÇÁÉÍÓÚÂÃÕ\s'-]+$")
+RE_UF = re.compile(r"^[A-Z]{2}$")
+RE_MONEY_KEYWORDS = re.compile(trie_regex(["valor", "total", "preço", "preco", "custo", "importe", "montante", "importancia"]), _I)
+RE_LINE = re.compile(r"[^\n]+")
+RE_JSON_OBJECT = re.compile(r"(\{.*?\})", re.DOTALL)
+
+# Caracteres da página anterior reprocessados junto com a seguinte (extract_pages)
+PAGE_OVERLAP = 256
+
 # ===== PATTERN TRACKER =====
 
+# Delta de padrões trocado entre processos/journal/store:
+# campo -> (padrão, ocorrências, hits, misses)
+PatternDelta = Dict[str, Tuple[str, int, int, int]]
+
 class PatternSchema:
     def __init__(self, field: str, pattern: str, sample: str = None):
         self.field = field
         self.pattern = pattern
         self.count = 1
+        self.hits = 0    # reuso no nível 1 que preencheu o campo
+        self.misses = 0  # reuso no nível 1 sem resultado
+        self._regex = None
+
+    @property
+    def regex(self) -> re.Pattern:
+        """Padrão compilado (uma vez por padrão, fora do cache global do `re`)"""
+        if self._regex is None or self._regex.pattern != self.pattern:
+            self._regex = re.compile(self.pattern)
+        return self._regex
 
     def add_sample(self, sample):
         pass
 
+    def stats(self) -> Tuple[int, int, int]:
+        return self.count, self.hits, self.misses
+
     def to_dict(self) -> Dict:
         return {
             "field": self.field,
             "pattern": self.pattern,
-            "occurrences": self.count
+            "occurrences": self.count,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+def add_pattern_delta(target: PatternDelta, delta: PatternDelta):
+    for k, (pattern, *stats) in delta.items():
+        stats = (list(stats) + [0, 0])[:3]  # journals antigos: (padrão, ocorrências)
+        if k in target:
+            target[k] = (target[k][0], *(a + b for a, b in zip(target[k][1:], stats)))
+        else:
+            target[k] = (pattern, *stats)
+
+class PatternStore:
+    """
+    Padrões aprendidos persistidos entre execuções (JSON versionado).
+    save() relê o arquivo e soma apenas o que esta execução acrescentou
+    desde o load(), então execuções concorrentes não se sobrescrevem.
+    """
+    VERSION = 1
+
+    def __init__(self, path: str, logger: logging.Logger):
+        self.path = path
+        self.logger = logger
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {"version": self.VERSION, "patterns": {}}
+        except Exception as e:
+            self.logger.warning(f"⚠️  Store de padrões ilegível ({self.path}): {e}")
+            return None
+
+        if data.get("version") != self.VERSION:
+            self.logger.warning(f"⚠️  Store de padrões com versão {data.get('version')} (esperada {self.VERSION}); ignorado")
+            return None
+        return data
+
+    def load(self) -> PatternDelta:
+        data = self._read() or {"patterns": {}}
+        patterns = {
+            k: (v["pattern"], v.get("occurrences", 0), v.get("hits", 0), v.get("misses", 0))
+            for k, v in data["patterns"].items()
         }
+        if patterns:
+            self.logger.info(f"🧠 {len(patterns)} padrões carregados de {self.path}")
+        return patterns
+
+    def save(self, delta: PatternDelta):
+        if not delta:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            data = self._read()
+            if data is None:
+                return  # não sobrescreve um store que não entendemos
+
+            current = {
+                k: (v["pattern"], v.get("occurrences", 0), v.get("hits", 0), v.get("misses", 0))
+                for k, v in data["patterns"].items()
+            }
+            add_pattern_delta(current, delta)
+
+            data = {
+                "version": self.VERSION,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "patterns": {
+                    k: {"pattern": p, "occurrences": c, "hits": h, "misses": m}
+                    for k, (p, c, h, m) in sorted(current.items())
+                },
+            }
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+
+# ===== GPT CACHE =====
+
+class GPTResponseCache:
+    """
+    Cache local (SQLite) das respostas do GPT. A chave combina modelo, hash do
+    prompt, conjunto de campos pedidos e temperatura; entradas expiram após
+    `ttl_s` e as menos usadas saem quando passa de `max_entries`.
+    """
+
+    def __init__(self, path: str, ttl_s: float, max_entries: int, logger: logging.Logger):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.puts = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, fields TEXT, temperature REAL,"
+            " content TEXT, created REAL, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON responses(last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(request: Dict[str, Any], null_fields: List[str]) -> str:
+        prompt_hash = hashlib.sha256(
+            json.dumps(request["messages"], ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()
+        raw = json.dumps([request["model"], prompt_hash, sorted(null_fields), request["temperature"]])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, request: Dict[str, Any], null_fields: List[str]) -> Optional[str]:
+        key = self.key(request, null_fields)
+        now = time.time()
+        try:
+            with self.lock:
+                row = self.conn.execute("SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if not row:
+                    return None
+                if now - row[1] > self.ttl_s:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.conn.commit()
+                    return None
+                self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+                return row[0]
+        except sqlite3.Error as e:
+            self.logger.debug(f"Cache GPT indisponível: {e}")
+            return None
+
+    def put(self, request: Dict[str, Any], null_fields: List[str], content: Optional[str]):
+        if not content or len(content.strip()) < 5:
+            return
+        key = self.key(request, null_fields)
+        now = time.time()
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, request["model"], json.dumps(sorted(null_fields)), request["temperature"], content, now, now),
+                )
+                self.puts += 1
+                # Evicção em lote (a cada 100 inserções) para não pagar o COUNT sempre
+                if self.puts % 100 == 1:
+                    self._evict(now)
+                self.conn.commit()
+        except sqlite3.Error as e:
+            self.logger.debug(f"Falha ao gravar cache GPT: {e}")
+
+    def _evict(self, now: float):
+        self.conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_s,))
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN"
+                " (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# ===== MÉTRICAS =====
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil por posto mais próximo (lista já ordenada)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 1))  # ceil(n * q)
+    return sorted_values[int(rank) - 1]
+
+class LogHistogram:
+    """
+    Histograma de baldes logarítmicos fixos (cada balde cobre 2% de
+    variação): a memória depende da faixa de valores, não do número de
+    amostras, e os percentis têm erro relativo de ~1%. Contagem, soma,
+    mínimo e máximo são exatos. Valores <= 0 vão para um balde próprio.
+    """
+    GROWTH = 1.02
+    ZERO = -(1 << 30)  # chave do balde de valores <= 0 (ordena antes de todos)
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        key = math.floor(math.log(value, self.GROWTH)) if value > 0 else self.ZERO
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LogHistogram"):
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Percentil por posto mais próximo: centro (geométrico) do balde, limitado a [min, max]"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q))
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                value = 0.0 if key == self.ZERO else self.GROWTH ** (key + 0.5)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+class StageMetrics:
+    """
+    Latência por etapa (ms, um LogHistogram por etapa com uma amostra por
+    documento), tokens do GPT e contagem de fontes; a memória não cresce com
+    o número de documentos. Cada processo tem a sua instância; os workers
+    mandam drain() no resumo do item e o processo principal faz merge().
+    """
+    STAGES = ("pdf", "dedup", "regex", "regex_global", "gpt", "write", "total")
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.doc: Dict[str, float] = {}
+        self.samples: Dict[str, LogHistogram] = {}
+        self.tokens: Dict[str, int] = {}
+        self.sources: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.peak_rss = LogHistogram()  # MB por documento (--low-memory)
+        self.routing: Dict[str, int] = {}  # decisões do GPTRouter ("doc|called", "field|label.campo|asked", ...)
+        self.prompts = LogHistogram()  # caracteres do prompt de cada chamada ao GPT
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Acumula o tempo da etapa no documento atual (fechado por end_doc)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.doc[stage] = self.doc.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+    def end_doc(self):
+        doc, self.doc = self.doc, {}
+        with self.lock:
+            for stage, ms in doc.items():
+                self.samples.setdefault(stage, LogHistogram()).add(ms)
+
+    def observe(self, stage: str, ms: float):
+        with self.lock:
+            self.samples.setdefault(stage, LogHistogram()).add(ms)
+
+    def observe_rss(self, mb: float):
+        with self.lock:
+            self.peak_rss.add(mb)
+
+    def observe_prompt(self, chars: int):
+        with self.lock:
+            self.prompts.add(chars)
+
+    def add_usage(self, usage):
+        """Soma o `resp.usage` de uma chamada ao GPT"""
+        with self.lock:
+            self.tokens["requests"] = self.tokens.get("requests", 0) + 1
+            for kind in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                self.tokens[kind] = self.tokens.get(kind, 0) + (getattr(usage, kind, None) or 0)
+
+    def count_sources(self, sources: Dict[str, Optional[str]]):
+        with self.lock:
+            for source in sources.values():
+                source = source or "null"
+                self.sources[source] = self.sources.get(source, 0) + 1
+
+    def inc(self, name: str, n: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def count_route(self, key: str, n: int = 1):
+        with self.lock:
+            self.routing[key] = self.routing.get(key, 0) + n
+
+    def drain(self) -> Dict[str, Any]:
+        """Tudo o que foi medido desde o último drain (serializável entre processos)"""
+        with self.lock:
+            data = {"samples": self.samples, "tokens": self.tokens, "sources": self.sources,
+                    "counts": self.counts, "peak_rss": self.peak_rss, "routing": self.routing,
+                    "prompts": self.prompts}
+            self.samples, self.tokens, self.sources, self.counts, self.peak_rss = {}, {}, {}, {}, LogHistogram()
+            self.routing, self.prompts = {}, LogHistogram()
+        return data
+
+    def merge(self, data: Dict[str, Any]):
+        with self.lock:
+            for stage, hist in data["samples"].items():
+                self.samples.setdefault(stage, LogHistogram()).merge(hist)
+            self.peak_rss.merge(data["peak_rss"])
+            self.prompts.merge(data["prompts"])
+            for attr in ("tokens", "sources", "counts", "routing"):
+                target = getattr(self, attr)
+                for k, n in data[attr].items():
+                    target[k] = target.get(k, 0) + n
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            stages = {}
+            order = [s for s in self.STAGES if s in self.samples] + sorted(set(self.samples) - set(self.STAGES))
+            for stage in order:
+                hist = self.samples[stage]
+                stages[stage] = {
+                    "count": hist.count,
+                    "sum_ms": round(hist.sum, 3),
+                    "mean_ms": round(hist.sum / hist.count, 3),
+                    "max_ms": round(hist.max, 3),
+                    **{f"p{int(q * 100)}_ms": round(hist.quantile(q), 3) for q in self.QUANTILES},
+                }
+            memory = {}
+            if self.peak_rss.count:
+                hist = self.peak_rss
+                memory["peak_rss_mb"] = {
+                    "count": hist.count,
+                    "max": round(hist.max, 1),
+                    **{f"p{int(q * 100)}": round(hist.quantile(q), 1) for q in self.QUANTILES},
+                }
+            prompts = {}
+            if self.prompts.count:
+                hist = self.prompts
+                prompts = {
+                    "calls": hist.count,
+                    "sum_chars": int(hist.sum),
+                    "mean_chars": round(hist.sum / hist.count, 1),
+                    "max_chars": int(hist.max),
+                    **{f"p{int(q * 100)}_chars": round(hist.quantile(q), 1) for q in self.QUANTILES},
+                    "estimated_tokens": int(hist.sum) // 4,
+                }
+            routing = {}
+            if self.routing:
+                routing = {"documents": {}, "fields": {}, "estimated_tokens": 0}
+                for key, n in sorted(self.routing.items()):
+                    kind, _, rest = key.partition("|")
+                    if kind == "doc":
+                        routing["documents"][rest] = n
+                    elif kind == "field":
+                        name, _, action = rest.rpartition("|")
+                        routing["fields"].setdefault(name, {})[action] = n
+                    else:
+                        routing["estimated_tokens"] += n
+            return {
+                "stages": stages,
+                "memory": memory,
+                "gpt_usage": dict(self.tokens),
+                "gpt_routing": routing,
+                "gpt_prompts": prompts,
+                "sources": dict(sorted(self.sources.items())),
+                "documents": dict(sorted(self.counts.items())),
+            }
+
+    def prometheus(self) -> str:
+        """Relatório no formato texto do Prometheus"""
+        report = self.report()
+        lines = [
+            "# HELP extractor_stage_latency_ms Latência por documento em cada etapa (ms)",
+            "# TYPE extractor_stage_latency_ms summary",
+        ]
+        for stage, s in report["stages"].items():
+            for q in self.QUANTILES:
+                lines.append(f'extractor_stage_latency_ms{{stage="{stage}",quantile="{q}"}} {s[f"p{int(q * 100)}_ms"]}')
+            lines.append(f'extractor_stage_latency_ms_sum{{stage="{stage}"}} {s["sum_ms"]}')
+            lines.append(f'extractor_stage_latency_ms_count{{stage="{stage}"}} {s["count"]}')
+
+        if report["memory"]:
+            rss = report["memory"]["peak_rss_mb"]
+            lines += ["# HELP extractor_doc_peak_rss_mb Pico de RSS por documento (MB)",
+                      "# TYPE extractor_doc_peak_rss_mb summary"]
+            lines += [f'extractor_doc_peak_rss_mb{{quantile="{q}"}} {rss[f"p{int(q * 100)}"]}' for q in self.QUANTILES]
+            lines.append(f'extractor_doc_peak_rss_mb_count {rss["count"]}')
+
+        lines += ["# HELP extractor_gpt_tokens_total Tokens e requisições do GPT",
+                  "# TYPE extractor_gpt_tokens_total counter"]
+        lines += [f'extractor_gpt_tokens_total{{kind="{k}"}} {n}' for k, n in report["gpt_usage"].items()]
+
+        if report["gpt_prompts"]:
+            prompts = report["gpt_prompts"]
+            lines += ["# HELP extractor_gpt_prompt_chars Tamanho do prompt por chamada ao GPT (caracteres)",
+                      "# TYPE extractor_gpt_prompt_chars summary"]
+            lines += [f'extractor_gpt_prompt_chars{{quantile="{q}"}} {prompts[f"p{int(q * 100)}_chars"]}'
+                      for q in self.QUANTILES]
+            lines.append(f'extractor_gpt_prompt_chars_sum {prompts["sum_chars"]}')
+            lines.append(f'extractor_gpt_prompt_chars_count {prompts["calls"]}')
+
+        if report["gpt_routing"]:
+            lines += ["# HELP extractor_gpt_routing_total Decisões do roteamento GPT por documento",
+                      "# TYPE extractor_gpt_routing_total counter"]
+            lines += [f'extractor_gpt_routing_total{{decision="{k}"}} {n}'
+                      for k, n in report["gpt_routing"]["documents"].items()]
+
+        lines += ["# HELP extractor_field_source_total Campos por fonte do valor",
+                  "# TYPE extractor_field_source_total counter"]
+        lines += [f'extractor_field_source_total{{source="{k}"}} {n}' for k, n in report["sources"].items()]
+
+        lines += ["# HELP extractor_documents_total Documentos por status",
+                  "# TYPE extractor_documents_total counter"]
+        lines += [f'extractor_documents_total{{status="{k}"}} {n}' for k, n in report["documents"].items()]
+        return "\n".join(lines) + "\n"
+
+def metrics_path(output_dir: str) -> str:
+    """Métricas ficam ao lado da pasta de saída: output/ -> output.metrics.json"""
+    out = Path(output_dir).resolve()
+    return str(out.parent / f"{out.name}.metrics.json")
+
+def serve_metrics(metrics: StageMetrics, port: int, logger: logging.Logger,
+                  host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+    """Endpoint /metrics (formato Prometheus) numa thread daemon; encerrar com .shutdown()"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 Métricas em http://{host}:{port}/metrics")
+    return server
+
+# ===== ROTEAMENTO GPT =====
+
+class GPTRouter:
+    """
+    Decide, documento a documento, quais campos vão para o GPT.
+
+    threshold (padrão): todos os campos nulos, se forem >= gpt_threshold do schema.
+    confidence: cada campo tem uma confiança (0 se nulo; valores de padrões
+    aprendidos valem pelo histórico hits/misses e pelo `count` do padrão) e um
+    ganho esperado = (1 - confiança) × taxa com que o GPT já preencheu esse
+    campo (prior 1/2). Vão os campos com ganho >= gpt_min_field_gain, e a
+    chamada só sai se o ganho somado por 1k tokens estimados compensar.
+
+    Nos dois modos, gpt_token_budget > 0 limita os tokens estimados do batch.
+    As decisões vão para as métricas (seção "gpt_routing" do relatório).
+    """
+    REGEX_CONFIDENCE = 0.9  # padrões fixos do nível 0
+    PROMPT_OVERHEAD_TOKENS = 50  # instruções + mensagem de sistema
+    TOKENS_PER_FIELD = 12  # resposta estimada por campo
+
+    def __init__(self, extractor: "ExtractorV2", config: Config):
+        self.extractor = extractor
+        self.config = config
+        self.spent_tokens = 0  # estimados, das chamadas já autorizadas
+        self.gpt_stats: Dict[Tuple[str, str], List[int]] = {}  # (label, campo) -> [pedidos, preenchidos]
+
+    def candidates(self, d: Dict[str, Any], schema: Dict[str, str]) -> List[str]:
+        """Campos que o GPT poderia melhorar: nulos e, no modo confidence, valores de baixa confiança"""
+        if self.config.gpt_routing != "confidence":
+            return [f for f in schema if d.get(f) is None]
+        return [f for f in schema if self.confidence(f, d) < self.config.gpt_min_confidence]
+
+    def confidence(self, field: str, d: Dict[str, Any]) -> float:
+        if d.get(field) is None:
+            return 0.0
+        source = d.get("_sources", {}).get(field)
+        if source == "regex_global":
+            ps = self.extractor.global_patterns.get(field)
+            if ps is None:
+                return 0.0
+            reliability = (ps.hits + 1) / (ps.hits + ps.misses + 2)
+            support = ps.count / (ps.count + 2)
+            return reliability * support
+        if source == "regex":
+            return self.REGEX_CONFIDENCE
+        return 1.0  # gpt, gpt_cache, dedup
+
+    def fill_rate(self, label: str, field: str) -> float:
+        asked, filled = self.gpt_stats.get((label, field), (0, 0))
+        return (filled + 1) / (asked + 2)
+
+    def estimate_tokens(self, prompt_chars: int, n_fields: int) -> int:
+        return (self.PROMPT_OVERHEAD_TOKENS + min(prompt_chars, prompt_char_limit(self.config)) // 4
+                + self.TOKENS_PER_FIELD * n_fields)
+
+    def route(self, d: Dict[str, Any], schema: Dict[str, str], label: str, prompt_chars: int,
+              record: bool = True) -> List[str]:
+        """Campos a pedir ao GPT ([] = sem chamada). record=False só consulta (não conta nem reserva orçamento)"""
+        if not self.extractor.gpt_enabled or not schema:
+            return []
+        candidates = self.candidates(d, schema)
+        if not candidates:
+            return []
+
+        gains = {}
+        if self.config.gpt_routing == "confidence":
+            gains = {f: (1 - self.confidence(f, d)) * self.fill_rate(label, f) for f in candidates}
+            fields = [f for f in candidates if gains[f] >= self.config.gpt_min_field_gain]
+        else:
+            fields = candidates if len(candidates) / len(schema) >= self.config.gpt_threshold else []
+
+        tokens = self.estimate_tokens(prompt_chars, len(fields))
+        if not fields:
+            decision = "skipped_low_gain" if gains else "skipped_threshold"
+        elif gains and sum(gains[f] for f in fields) * 1000 / tokens < self.config.gpt_min_gain_per_1k_tokens:
+            decision, fields = "skipped_cost", []
+        elif self.config.gpt_token_budget and self.spent_tokens + tokens > self.config.gpt_token_budget:
+            decision, fields = "skipped_budget", []
+        else:
+            decision = "called"
+
+        if not record:
+            return fields
+
+        metrics = self.extractor.metrics
+        metrics.count_route(f"doc|{decision}")
+        for f in candidates:
+            action = ("verify" if d.get(f) is not None else "asked") if f in fields else "skipped"
+            metrics.count_route(f"field|{label}.{f}|{action}")
+        if fields:
+            self.spent_tokens += tokens
+            metrics.count_route("tokens|estimated", tokens)
+            self.extractor.logger.debug("%s: GPT para %s (~%d tokens)", label, fields, tokens)
+        elif decision != "skipped_threshold":
+            self.extractor.logger.debug("%s: GPT dispensado (%s) para %s", label, decision, candidates)
+        return fields
+
+    def observe(self, label: str, fields: List[str], gpt_result: Dict[str, Any]):
+        """Aprende a taxa de preenchimento do GPT por campo"""
+        for f in fields:
+            stats = self.gpt_stats.setdefault((label, f), [0, 0])
+            stats[0] += 1
+            if gpt_result.get(f) is not None:
+                stats[1] += 1
+                self.extractor.metrics.count_route(f"field|{label}.{f}|filled")
+
+# ===== CONTEXTO GPT =====
+
+# Palavras das descrições do schema que não ajudam a achar o campo no texto
+CONTEXT_STOPWORDS = frozenset("""
+a ao aos as com da das de do dos e em na nas no nos o os ou para pela pelo por qual que se um uma
+campo canto documento esquerdo direito esquerda direita imagem normalmente parte pode ser faz
+""".split())
+
+# Pistas de posição nas descrições ("normalmente no canto inferior esquerdo")
+CONTEXT_POSITION_HINTS = {
+    "inferior": "bottom", "rodape": "bottom", "final": "bottom", "abaixo": "bottom", "baixo": "bottom",
+    "superior": "top", "topo": "top", "cabecalho": "top", "acima": "top", "inicio": "top",
+}
+
+# Forma do valor pelo tipo do campo (field_kind): a linha do valor costuma vir logo após o rótulo
+CONTEXT_VALUE_SHAPES = {
+    "date": re.compile(r"\d{1,2}/\d{1,2}/\d{2,4}"),
+    "money": re.compile(r"\d,\d{2}(?!\d)"),
+    "phone": re.compile(r"\(?\d{2}\)?\s?9?\d{4}-?\d{4}"),
+    "uf": re.compile(r"(?<![A-Za-z])[A-Z]{2}(?![A-Za-z])"),
+    "int": re.compile(r"(?<![\d,.])\d+(?![\d,.])"),
+}
+
+CONTEXT_STEM = 5  # prefixo comparado (parcelas ~ parcela, inscrição ~ inscricao)
+CONTEXT_WINDOWS_PER_FIELD = 2
+CONTEXT_GAP = "[...]"  # entre trechos não contíguos
+
+def fold_text(s: str) -> str:
+    """Minúsculas sem acento (comparação de termos)"""
+    return unicodedata.normalize("NFKD", s.lower()).encode("ascii", "ignore").decode()
+
+def prompt_char_limit(config: Config) -> int:
+    """Caracteres de documento por prompt: orçamento do seletor (fields) ou o corte fixo (head)"""
+    if config.gpt_context == "fields":
+        return config.gpt_context_tokens * 4
+    return config.text_truncate_size
+
+def prompt_chars(request: Dict[str, Any]) -> int:
+    return sum(len(m["content"]) for m in request["messages"])
+
+class FieldContext:
+    """Termos de um campo: nome e âncoras do regex (fortes), descrição (fracos) e pista de posição"""
+
+    def __init__(self, field: str, description: str = "", common: Set[str] = frozenset()):
+        self.field = field
+        anchors = TELA_ANCHORS.get(field, ()) + OAB_ANCHORS.get(field, ())
+        self.strong = {t[:CONTEXT_STEM] for t in fold_text(" ".join((field.replace("_", " "),) + anchors)).split()
+                       if len(t) >= 2 and t not in CONTEXT_STOPWORDS}
+        words = RE_WORD.findall(fold_text(description or ""))
+        self.weak = {w[:CONTEXT_STEM] for w in words
+                     if len(w) >= 4 and w not in CONTEXT_STOPWORDS and w not in CONTEXT_POSITION_HINTS}
+        self.weak -= self.strong | common
+        self.position = next((CONTEXT_POSITION_HINTS[w] for w in words if w in CONTEXT_POSITION_HINTS), None)
+        self.shape = CONTEXT_VALUE_SHAPES.get(field_kind(field))
+
+    def score(self, stems: Set[str]) -> int:
+        return 3 * len(stems & self.strong) + min(len(stems & self.weak), 2)
+
+def select_gpt_context(pages: List[str], fields: List[str], descriptions: Dict[str, str], budget: int) -> str:
+    """
+    Janelas de linhas mais relevantes para cada campo pendente, até `budget`
+    caracteres, na ordem do documento (trechos separados por "[...]").
+
+    Cada linha pontua pelos termos do campo (nome/âncoras valem 3, descrição 1);
+    a janela (linha anterior + 2 seguintes) ganha +1 se tiver um valor com a
+    forma do tipo do campo e +1 se estiver no terço da página indicado pela
+    descrição ("inferior", "superior"). Termos presentes em mais da metade das
+    descrições do schema ("operação selecionada") não contam. As melhores
+    janelas de cada campo entram em rodízio entre os campos; o orçamento que
+    sobrar estende os trechos para baixo, onde costuma estar o valor do rótulo.
+    Sem nenhum termo no texto, fica o início.
+    """
+    text = "\n".join(pages)
+    if len(text) <= budget:
+        return text
+
+    lines: List[str] = []
+    position: List[Optional[str]] = []  # terço da página de cada linha
+    for page in pages:
+        page_lines = page.split("\n")
+        n = len(page_lines)
+        lines.extend(page_lines)
+        position.extend("top" if i < n / 3 else "bottom" if i >= 2 * n / 3 else None for i in range(n))
+    stems = [{w[:CONTEXT_STEM] for w in RE_WORD.findall(fold_text(line))} for line in lines]
+
+    df: Dict[str, int] = {}
+    for desc in descriptions.values():
+        for stem in {w[:CONTEXT_STEM] for w in RE_WORD.findall(fold_text(desc or ""))}:
+            df[stem] = df.get(stem, 0) + 1
+    common = {stem for stem, n in df.items() if len(descriptions) >= 3 and n > len(descriptions) / 2}
+
+    ranked: List[List[Tuple[int, int]]] = []  # por campo: (início, fim) das janelas, melhor primeiro
+    for field in fields:
+        ctx = FieldContext(field, descriptions.get(field, ""), common)
+        windows = []
+        for i, line_stems in enumerate(stems):
+            score = ctx.score(line_stems)
+            if not score:
+                continue
+            start, end = max(0, i - 1), min(len(lines), i + 3)
+            if ctx.shape and any(ctx.shape.search(lines[j]) for j in range(i, end)):
+                score += 1
+            if ctx.position and position[i] == ctx.position:
+                score += 1
+            windows.append((-score, i, start, end))
+        windows.sort()
+        if windows:
+            ranked.append([(start, end) for _, _, start, end in windows[:CONTEXT_WINDOWS_PER_FIELD]])
+
+    if not ranked:
+        return text[:budget]
+
+    selected: Set[int] = set()
+    size = 0
+    for rank in range(CONTEXT_WINDOWS_PER_FIELD):
+        for windows in ranked:
+            if rank >= len(windows):
+                continue
+            start, end = windows[rank]
+            new = [j for j in range(start, end) if j not in selected]
+            cost = sum(len(lines[j]) + 1 for j in new) + len(CONTEXT_GAP) + 1
+            if size + cost > budget:
+                continue
+            selected.update(new)
+            size += cost
+
+    if not selected:
+        return text[:budget]
+
+    grew = True
+    while grew:
+        grew = False
+        for j in [j for j in sorted(selected) if j + 1 < len(lines) and j + 1 not in selected]:
+            if size + len(lines[j + 1]) + 1 <= budget:
+                selected.add(j + 1)
+                size += len(lines[j + 1]) + 1
+                grew = True
+
+    parts, prev = [], None
+    for j in sorted(selected):
+        if prev is not None and j != prev + 1:
+            parts.append(CONTEXT_GAP)
+        parts.append(lines[j])
+        prev = j
+    return "\n".join(parts)
 
 # ===== EXTRACTOR =====
 
@@ -107,32 +1131,55 @@ class ExtractorV2:
         self.global_patterns = {}
         self.label_schemas = {}
         self.current_pdf_path = ""
-        self.gpt_client = None
+        self.gpt_enabled = HAS_OPENAI and bool(config.gpt_api_key)
+        self._gpt_client = None
+        self.gpt_cache = None
+        self.metrics = StageMetrics()
+        self.router = GPTRouter(self, config)
+
+        if self.gpt_enabled and config.gpt_cache:
+            try:
+                self.gpt_cache = GPTResponseCache(
+                    config.gpt_cache_path,
+                    config.gpt_cache_ttl_hours * 3600,
+                    config.gpt_cache_max_entries,
+                    logger,
+                )
+            except sqlite3.Error as e:
+                self.logger.warning(f"⚠️  Cache GPT desativado: {e}")
 
-        if HAS_OPENAI and config.gpt_api_key:
+    @property
+    def gpt_client(self):
+        """Cliente OpenAI criado no primeiro fallback (execuções só com regex não importam o openai)"""
+        if self._gpt_client is None and self.gpt_enabled:
             try:
-                self.gpt_client = OpenAI(api_key=config.gpt_api_key)
-                self.logger.info(f"🤖 OpenAI inicializado com {config.gpt_model}")
+                from openai import OpenAI
+                self._gpt_client = OpenAI(**openai_client_kwargs(self.config))
+                self.logger.info(f"🤖 OpenAI inicializado com {self.config.gpt_model}")
             except Exception as e:
                 self.logger.error(f"❌ Erro ao inicializar OpenAI: {e}")
+                self.gpt_enabled = False
+        return self._gpt_client
 
     def _extract_oab(self, text, schema):
-        lines = [l.strip() for l in text.split("\n") if l.strip()]
+        # Linhas sob demanda: o nome costuma estar no topo, sem dividir o texto todo
+        lines = (l for l in (m.group().strip() for m in RE_LINE.finditer(text)) if l)
         d = {f: None for f in schema}
         patterns_used = {}
+        anchors = OAB_PREFILTER.scan(text)
 
         if "nome" in d:
             for line in lines:
-                if re.fullmatch(r"(SUPLEMENTAR|ADVOGADO|ADVOGADA|ESTAGIÁRIO|ESTAGIARIO|ESTAGIARIA)", line, re.IGNORECASE):
+                if OAB_PATTERNS["categoria_linha"].fullmatch(line):
                     continue
-                if re.match(r"^[A-ZÇÁÉÍÓÚÂÃÕ'\s]+$", line) and len(line.split()) >= 2 and len(line) > 5:
+                if OAB_PATTERNS["nome"].match(line) and len(line.split()) >= 2 and len(line) > 5:
                     if "INSCRI" not in line:
                         d["nome"] = line.strip()
                         patterns_used["nome"] = r"^[A-ZÇÁÉÍÓÚÂÃÕ'\s]+$"
                         break
 
         if "inscricao" in d or "seccional" in d:
-            m = re.search(r"Inscri[cç][aã]o[\s\S]{0,50}?(\d{4,6})\s*([A-Z]{2})(?=\s|$)", text, re.IGNORECASE)
+            m = first_anchored_match(OAB_PATTERNS["inscricao"], text, anchors.get("inscricao", []))
             if m:
                 if "inscricao" in d:
                     d["inscricao"] = m.group(1)
@@ -142,31 +1189,31 @@ class ExtractorV2:
                     patterns_used["seccional"] = r"Inscri[cç][aã]o[\s\S]{0,50}?(\d{4,6})\s*([A-Z]{2})"
 
         if "subsecao" in d:
-            m = re.search(r"(CONSELHO\s+SECCIONAL\s*-\s*[A-ZÇÁÉÍÓÚÂÃÕ ]+)", text, re.IGNORECASE)
+            m = first_anchored_match(OAB_PATTERNS["subsecao"], text, anchors.get("subsecao", []))
             if m:
                 d["subsecao"] = m.group(1).strip()
                 patterns_used["subsecao"] = r"CONSELHO\s+SECCIONAL\s*-\s*[A-ZÇÁÉÍÓÚÂÃÕ ]+"
 
         if "categoria" in d:
-            m = re.search(r"\b(SUPLEMENTAR|ADVOGADO|ADVOGADA|ESTAGIARIO|ESTAGIÁRIO|ESTAGIARIA)\b", text, re.IGNORECASE)
+            m = first_anchored_match(OAB_PATTERNS["categoria"], text, anchors.get("categoria", []))
             if m:
                 d["categoria"] = m.group(1).strip().title()
                 patterns_used["categoria"] = r"(SUPLEMENTAR|ADVOGADO|ADVOGADA|ESTAGIARIO|ESTAGIÁRIO|ESTAGIARIA)"
 
         if "endereco_profissional" in d:
-            m = re.search(r"(AVENIDA|RUA|AV\.|PRAÇA|PCA|RODOVIA)\s+[^\n]{5,120}", text, re.IGNORECASE)
+            m = first_anchored_match(OAB_PATTERNS["endereco_profissional"], text, anchors.get("endereco_profissional", []))
             if m:
                 d["endereco_profissional"] = m.group(0).strip()
                 patterns_used["endereco_profissional"] = r"(AVENIDA|RUA|AV\.|PRAÇA|PCA|RODOVIA)\s+[^\n]{5,120}"
 
         if "telefone_profissional" in d:
-            m = re.search(r"\(?\d{2}\)?[\s-]?\d{4,5}[-\s]?\d{4}", text)
+            m = OAB_PATTERNS["telefone_profissional"].search(text)
             if m:
                 d["telefone_profissional"] = m.group(0)
                 patterns_used["telefone_profissional"] = r"\(?\d{2}\)?[\s-]?\d{4,5}[-\s]?\d{4}"
 
         if "situacao" in d:
-            m = re.search(r"SITUA(?:C|Ç)[AÃ]O[\s:\n]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+)", text, re.IGNORECASE)
+            m = first_anchored_match(OAB_PATTERNS["situacao"], text, anchors.get("situacao", []))
             if m:
                 d["situacao"] = m.group(1).strip()
                 patterns_used["situacao"] = r"SITUA(?:C|Ç)[AÃ]O[\s:\n]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+)"
@@ -176,29 +1223,16 @@ class ExtractorV2:
     def _extract_tela(self, text, schema):
         d = {}
         patterns_used = {}
-        self.logger.debug(f"_extract_tela: tentando extrair campos: {list(schema.keys())}")
-
-        patterns = {
-            "data_referencia": [r"(?:Data Referência|Data Reference)[\s:\n]+(\d{2}/\d{2}/\d{4})"],
-            "data_base": [r"(?:Data Base|Data\s+Base)[\s:\n]+(\d{2}/\d{2}/\d{4})"],
-            "data_vencimento": [r"(?:Data Vencimento|Data\s+Vencimento|Vcto[\s:\n]*)[\s:\n]*(\d{2}/\d{2}/\d{4})"],
-            "valor_parcela": [r"(?:Vlr\.?\s*Parc\.?|Valor\s*Parcela|Vlr\.\s*Parc\.)[\s:\n]*([0-9,.]+)"],
-            "quantidade_parcelas": [r"(?:Qtd\.?\s*Parcelas?|Quantidade\s+Parcelas?|Qtde\s+Parc\.?)[\s:\n]*(\d+)"],
-            "total_de_parcelas": [r"Total[\s:\n]*([0-9,.]+)(?!\d)"],
-            "selecao_de_parcelas": [r"(?:Seleção\s+de\s+parcelas|Selecao\s+de\s+parcelas)[\s:\n]*([^\n]+)"],
-            "sistema": [r"(?:Dias\s+atraso\s+)?Sistema\s*[\n\s]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+?)(?:\n|$)"],
-            "produto": [r"(?:Saldo\s+Vencido|Saldo\s+a\s+Vencer)[\s\S]{0,150}?0\s+([A-ZÇÁÉÍÓÚÂÃÕ]+)(?:\n|$)"],
-            "pesquisa_por": [r"(?:Pesquisa\s+Por|Pesquisa\s+por)[\s:\n]*([^\n]+?)(?:\n|$)"],
-            "pesquisa_tipo": [r"(?:Pesquisa\s+Tipo|Tipo\s+de\s+pesquisa|Tipo)[\s:\n]*([^\n]+?)(?:\n|$)"],
-            "cidade": [r"(?:Cidade|Municipio|Município)[\s:\n]*([A-ZÇÁÉÍÓÚÂÃÕ\s]+?)(?:\n|,|$)"],
-        }
+        self.logger.debug("_extract_tela: tentando extrair campos: %s", list(schema))
+        anchors = TELA_PREFILTER.scan(text)
 
-        for field, pats in patterns.items():
+        for field, pats in TELA_PATTERNS.items():
             if schema and field not in schema:
                 continue
 
-            for pat in pats:
-                m = re.search(pat, text, re.IGNORECASE)
+            positions = anchors.get(field, [])
+            for pat in pats if positions else ():
+                m = first_anchored_match(pat, text, positions)
                 if m:
                     value = m.group(1).strip() if m.lastindex else m.group(0).strip()
 
@@ -208,12 +1242,12 @@ class ExtractorV2:
                         continue
 
                     d[field] = value
-                    patterns_used[field] = pat
-                    self.logger.debug(f" ✓ {field}: {value[:30]}")
+                    patterns_used[field] = pat.pattern
+                    self.logger.debug(" ✓ %s: %.30s", field, value)
                     break
 
-            if field not in d and field in (schema if schema else patterns.keys()):
-                self.logger.debug(f" ✗ {field}: não encontrado")
+            if field not in d and field in (schema if schema else TELA_PATTERNS.keys()):
+                self.logger.debug(" ✗ %s: não encontrado", field)
 
         return d, patterns_used
 
@@ -228,7 +1262,7 @@ class ExtractorV2:
         value_str = str(value).strip()
 
         # Detecta datas (padrão já comprovado)
-        if "data" in field_lower and re.match(r"\d{2}/\d{2}/\d{4}", value_str):
+        if "data" in field_lower and RE_DATE.match(value_str):
             return r"\d{2}/\d{2}/\d{4}"
 
         # 🔥 APRENDIZADO DINÂMICO DE VALORES MONETÁRIOS COM CONTEXTO
@@ -236,12 +1270,12 @@ class ExtractorV2:
         if "valor" in field_lower or "parcela" in field_lower or "preco" in field_lower:
 
             # 1️⃣ REJEITAR: CPF, CNPJ, códigos bancários
-            if re.fullmatch(r"\d{3}\.\d{3}\.\d{3}-\d{2}", value_str):
-                self.logger.debug(f"❌ Rejeitado CPF/CNPJ format: {value_str}")
+            if RE_CPF.fullmatch(value_str):
+                self.logger.debug("❌ Rejeitado CPF/CNPJ format: %s", value_str)
                 return None
 
-            if re.fullmatch(r"\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}", value_str):
-                self.logger.debug(f"❌ Rejeitado CNPJ format: {value_str}")
+            if RE_CNPJ.fullmatch(value_str):
+                self.logger.debug("❌ Rejeitado CNPJ format: %s", value_str)
                 return None
 
             # 2️⃣ VALIDAR: Campo monetário deve ter contexto claro
@@ -249,27 +1283,19 @@ class ExtractorV2:
             has_comma = "," in value_str
             has_dot = "." in value_str
 
-            # 3️⃣ BUSCAR CONTEXTO NO TEXTO
-            text_lower = text.lower() if text else ""
-            context_keywords = [
-                "valor", "total", "preço", "preco", "custo",
-                "importe", "montante", "importancia", "importancia"
-            ]
-
-            has_monetary_context = any(
-                kw in text_lower for kw in context_keywords
-            ) or has_currency
+            # 3️⃣ BUSCAR CONTEXTO NO TEXTO (sem copiar o texto em minúsculas)
+            has_monetary_context = bool(text and RE_MONEY_KEYWORDS.search(text)) or has_currency
 
             # 4️⃣ DESCARTAR números muito curtos SEM contexto monetário explícito
-            digit_count = len(re.findall(r"\d", value_str))
+            digit_count = len(RE_DIGIT.findall(value_str))
 
             if digit_count < 3 and not has_currency:
-                self.logger.debug(f"❌ Número curto sem símbolo monetário: {value_str}")
+                self.logger.debug("❌ Número curto sem símbolo monetário: %s", value_str)
                 return None
 
             # 5️⃣ VALIDAR número não é apenas código de banco/agência
             if digit_count >= 3 and digit_count <= 5 and not has_currency and "." not in value_str:
-                self.logger.debug(f"⚠️ Suspeita de código bancário: {value_str}")
+                self.logger.debug("⚠️ Suspeita de código bancário: %s", value_str)
                 return None
 
             # 6️⃣ CONSTRUIR PADRÃO MONETÁRIO
@@ -278,13 +1304,11 @@ class ExtractorV2:
             if has_currency:
                 pattern_parts.append(r"(?:R\$|USD|EUR|\$)?\s*")
             else:
-                context_pattern = r"(?:Valor|Total|Preço|Preco|Custo|Importe|Documento|Montante)[\s:]*"
-
-                if re.search(context_pattern, text, re.IGNORECASE):
-                    pattern_parts.append(context_pattern)
+                if RE_MONEY_CONTEXT.search(text):
+                    pattern_parts.append(RE_MONEY_CONTEXT.pattern)
                     pattern_parts.append(r"(?:R\$)?\s*")
                 else:
-                    self.logger.debug(f"❌ Número sem contexto monetário no texto: {value_str}")
+                    self.logger.debug("❌ Número sem contexto monetário no texto: %s", value_str)
                     return None
 
             pattern_parts.append(r"\d{1,3}(?:[\.,]\d{3})*")
@@ -294,7 +1318,7 @@ class ExtractorV2:
 
             pattern = "".join(pattern_parts)
 
-            self.logger.debug(f"✅ Padrão monetário criado: {pattern}")
+            self.logger.debug("✅ Padrão monetário criado: %s", pattern)
             return pattern
 
         # Campos numéricos genéricos
@@ -311,239 +1335,2687 @@ class ExtractorV2:
             return r"\(?\d{2}\)?\s?-?\d{4,5}[-\s]?\d{4}"
 
         if "nome" in field_lower or "descricao" in field_lower:
-            if re.match(r"^[A-ZÇÁÉÍÓÚÂÃÕ\s'-]+$", value_str):
+            if RE_UPPER_NAME.match(value_str):
                 return r"^[A-ZÇÁÉÍÓÚÂÃÕ\s'-]+$"
 
         if "estado" in field_lower or "uf" in field_lower:
-            if re.match(r"^[A-Z]{2}$", value_str):
+            if RE_UF.match(value_str):
                 return r"[A-Z]{2}"
 
         return None
 
-    def _fill_with_gpt(self, label: str, text: str, null_fields: List[str]) -> Tuple[Dict, Dict]:
-        if not self.gpt_client or not null_fields:
-            return {}, {}
-
-        truncated = text[:self.config.text_truncate_size]
+    def _gpt_request(self, null_fields: List[str], text: str) -> Dict[str, Any]:
+        """Parâmetros do chat.completions (compartilhado entre cliente síncrono e assíncrono)"""
+        truncated = text[:prompt_char_limit(self.config)]
 
         prompt = f"Extraia estes campos em JSON: {json.dumps(null_fields)}\n\nTexto:\n{truncated}\n\nPS:valor que não existe recebe null, NÃO INVENTE VALORES"
 
-        try:
-            resp = self.gpt_client.chat.completions.create(
-                model=self.config.gpt_model,
-                messages=[
-                    {"role": "system", "content": "RESPONDA APENAS COM JSON VÁLIDO."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=self.config.gpt_temperature,
-                max_completion_tokens=self.config.gpt_max_tokens,
-                timeout=self.config.gpt_timeout,
-            )
+        return dict(
+            model=self.config.gpt_model,
+            messages=[
+                {"role": "system", "content": "RESPONDA APENAS COM JSON VÁLIDO."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=self.config.gpt_temperature,
+            max_completion_tokens=self.config.gpt_max_tokens,
+            timeout=self.config.gpt_timeout,
+        )
 
-            content = resp.choices[0].message.content
+    def _gpt_batch_request(self, null_fields: List[str], texts: List[str]) -> Dict[str, Any]:
+        """Vários documentos (mesmo label e campos) numa requisição; resposta com um objeto por documento"""
+        limit = prompt_char_limit(self.config)
+        docs = "\n\n".join(f"### Documento {i}\n{text[:limit]}" for i, text in enumerate(texts, 1))
+        ids = ", ".join(f'"{i}": {{...}}' for i in range(1, len(texts) + 1))
+
+        prompt = (
+            f"Extraia estes campos em JSON: {json.dumps(null_fields)} de cada documento abaixo.\n"
+            f"Responda com um único objeto, uma chave por documento: {{{ids}}}\n\n"
+            f"{docs}\n\nPS:valor que não existe recebe null, NÃO INVENTE VALORES"
+        )
+
+        return dict(
+            model=self.config.gpt_model,
+            messages=[
+                {"role": "system", "content": "RESPONDA APENAS COM JSON VÁLIDO."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=self.config.gpt_temperature,
+            max_completion_tokens=self.config.gpt_max_tokens * len(texts),
+            timeout=self.config.gpt_timeout,
+        )
+
+    @staticmethod
+    def _split_gpt_batch(content: Optional[str], n: int) -> List[Optional[str]]:
+        """Conteúdo (JSON) de cada documento da resposta em lote; None onde não deu para interpretar"""
+        try:
+            data = json.loads(content or "")
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            return [None] * n
 
-            if not content or len(content.strip()) < 5:
-                return {}, {}
+        docs = [data.get(str(i)) for i in range(1, n + 1)]
+        return [json.dumps(d, ensure_ascii=False) if isinstance(d, dict) else None for d in docs]
 
+    @staticmethod
+    def _is_gpt_object(content: Optional[str]) -> bool:
+        """Resposta que _parse_gpt_content consegue ler como objeto JSON; só essas entram no cache do GPT"""
+        if not content or len(content.strip()) < 5:
+            return False
+        try:
+            return isinstance(json.loads(content), dict)
+        except json.JSONDecodeError:
+            m = RE_JSON_OBJECT.search(content)
             try:
-                data = json.loads(content)
-                for k, v in data.items():
-                    if v is not None and k in null_fields:
-                        pattern = self._extract_pattern_from_value(k, v, text)
-                        if pattern:
-                            if k not in self.global_patterns:
+                return bool(m) and isinstance(json.loads(m.group(1)), dict)
+            except json.JSONDecodeError:
+                return False
+
+    def _parse_gpt_content(self, content: Optional[str], text: str, null_fields: List[str]) -> Dict:
+        """Interpreta a resposta do GPT e aprende padrões dos valores retornados"""
+        if not content or len(content.strip()) < 5:
+            return {}
+
+        try:
+            data = json.loads(content)
+            if not isinstance(data, dict):
+                return {}  # JSON válido mas não é um objeto (ex: lista)
+            for k, v in data.items():
+                if v is not None and k in null_fields:
+                    pattern = self._extract_pattern_from_value(k, v, text)
+                    if pattern:
+                        if k not in self.global_patterns:
+                            self.global_patterns[k] = PatternSchema(k, pattern, v)
+                            self.logger.debug("Padrão aprendido para '%s': %.50s", k, pattern)
+                        else:
+                            self.global_patterns[k].add_sample(v)
+                            self.global_patterns[k].count += 1
+
+            return data
+
+        except json.JSONDecodeError:
+            m = RE_JSON_OBJECT.search(content)
+            if m:
+                try:
+                    data = json.loads(m.group(1))
+                    if not isinstance(data, dict):
+                        return {}
+                    for k, v in data.items():
+                        if v is not None and k in null_fields:
+                            pattern = self._extract_pattern_from_value(k, v, text)
+                            if pattern and k not in self.global_patterns:
                                 self.global_patterns[k] = PatternSchema(k, pattern, v)
-                                self.logger.debug(f"Padrão aprendido para '{k}': {pattern[:50]}")
-                            else:
-                                self.global_patterns[k].add_sample(v)
-                                self.global_patterns[k].count += 1
+                    return data
+                except:
+                    pass
 
-                return data, {}
+        return {}
 
-            except json.JSONDecodeError:
-                m = re.search(r"(\{.*?\})", content, re.DOTALL)
-                if m:
-                    try:
-                        data = json.loads(m.group(1))
-                        for k, v in data.items():
-                            if v is not None and k in null_fields:
-                                pattern = self._extract_pattern_from_value(k, v, text)
-                                if pattern and k not in self.global_patterns:
-                                    self.global_patterns[k] = PatternSchema(k, pattern, v)
-                        return data, {}
-                    except:
-                        pass
+    def _fill_with_gpt(self, label: str, text: str, null_fields: List[str],
+                       prompt_text: Optional[str] = None) -> Tuple[Dict, Dict]:
+        """`text` serve de contexto para aprender padrões; `prompt_text` (padrão: text) vai para o GPT"""
+        if not self.gpt_enabled or not null_fields:
+            return {}, {}
+
+        request = self._gpt_request(null_fields, text if prompt_text is None else prompt_text)
 
+        if self.gpt_cache:
+            content = self.gpt_cache.get(request, null_fields)
+            # Entradas antigas que não são objeto JSON não valem como acerto: refaz a chamada
+            if self._is_gpt_object(content):
+                try:
+                    return self._parse_gpt_content(content, text, null_fields), {"cached": True}
+                except Exception as e:
+                    self.logger.warning(f"Erro GPT (cache): {type(e).__name__}: {str(e)[:100]}")
+                    return {}, {"error": True}
+
+        client = self.gpt_client
+        if client is None:
             return {}, {}
 
+        self.observe_prompt(request, null_fields)
+        try:
+            resp = client.chat.completions.create(**request)
+            content = resp.choices[0].message.content
+            self.metrics.add_usage(resp.usage)
+            if self.gpt_cache and self._is_gpt_object(content):
+                self.gpt_cache.put(request, null_fields, content)
+            return self._parse_gpt_content(content, text, null_fields), {}
+
         except Exception as e:
             self.logger.warning(f"Erro GPT: {type(e).__name__}: {str(e)[:100]}")
-            return {}, {}
+            return {}, {"error": True}
 
-    def extract(self, text: str, schema: Dict[str, str], label: str) -> Dict[str, Any]:
-        text = text or ""
-        d = {f: None for f in schema}
-        sources = {f: None for f in schema}
+    def apply_gpt(self, d: Dict[str, Any], gpt_result: Dict, source: str = "gpt", fields: Iterable[str] = ()):
+        """Preenche os nulos; campos pedidos em `fields` (reavaliação) são substituídos pelo valor do GPT"""
+        fields = set(fields)
+        for k, v in gpt_result.items():
+            if v is not None and k in d and (d[k] is None or k in fields):
+                d[k] = v
+                d["_sources"][k] = source
 
-        # 1. Regex
+    def _extract_label(self, text: str, schema: Dict[str, str], label: str) -> Tuple[Dict, Dict]:
         if "oab" in label.lower():
-            regex_result, patterns_used = self._extract_oab(text, schema)
+            return self._extract_oab(text, schema)
         elif "tela" in label.lower():
-            regex_result, patterns_used = self._extract_tela(text, schema)
-        else:
-            regex_result = {}
-            patterns_used = {}
+            return self._extract_tela(text, schema)
+        return {}, {}
 
-        for k, v in regex_result.items():
-            if k in d and v is not None:
-                d[k] = v
-                sources[k] = "regex"
+    def observe_prompt(self, request: Dict[str, Any], null_fields: List[str]):
+        """Tamanho do prompt de cada chamada enviada ao GPT (seção "gpt_prompts" das métricas)"""
+        chars = prompt_chars(request)
+        self.metrics.observe_prompt(chars)
+        self.logger.debug("GPT: prompt de %d caracteres (~%d tokens) para %d campos", chars, chars // 4, len(null_fields))
 
-            if k in patterns_used:
-                if k not in self.global_patterns:
-                    self.global_patterns[k] = PatternSchema(k, patterns_used[k], v)
-                else:
-                    self.global_patterns[k].add_sample(v)
-                    self.global_patterns[k].count += 1
+    def gpt_prompt_text(self, pages: List[str], null_fields: List[str],
+                        descriptions: Optional[Dict[str, str]] = None) -> str:
+        """
+        Texto do documento que vai para o GPT. fields: janelas de linhas relevantes
+        a cada campo (select_gpt_context, descrições do schema); head: só as páginas
+        que citam algum termo dos campos pendentes (fallback: primeira página).
+        """
+        if self.config.gpt_context == "fields":
+            return select_gpt_context(pages, null_fields, descriptions or {}, prompt_char_limit(self.config))
 
-        # 2. ✅ PADRÕES GLOBAIS (reutilizar ANTES de IA!)
-        for field in [f for f in d if d[f] is None]:
-            if field in self.global_patterns:
-                pattern = self.global_patterns[field].pattern
-                m = re.search(pattern, text)
-                if m:
-                    value = m.group(1) if m.lastindex else m.group(0)
-                    if value and len(str(value).strip()) > 1:
-                        d[field] = value
-                        sources[field] = "regex_global"
-                        self.global_patterns[field].count += 1
+        if len(pages) <= 1:
+            return "\n".join(pages)
+
+        terms = {t for f in null_fields for t in f.split("_") if len(t) >= 4}
+        if not terms:
+            return pages[0]
+        rx = re.compile("|".join(re.escape(t) for t in sorted(terms)), re.IGNORECASE)
+        picked = [p for p in pages if rx.search(p)]
+        return "\n".join(picked or pages[:1])
 
-        # 3. GPT - Apenas se >=30% nulos
-        null_fields = [f for f, v in d.items() if v is None]
-        null_pct = len(null_fields) / len(schema) if schema else 0
+    def extract(self, text: str, schema: Dict[str, str], label: str, use_gpt: bool = True) -> Dict[str, Any]:
+        """
+        Níveis 0-2. Com use_gpt=False o nível 2 fica para o chamador
+        (ver GPTRouter / AsyncGPTStage).
+        """
+        return self.extract_pages([text or ""], schema, label, use_gpt)[0]
+
+    def extract_pages(self, pages: Iterable[str], schema: Dict[str, str], label: str,
+                      use_gpt: bool = True) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Como extract(), mas consumindo o PDF página a página: o regex roda em
+        cada página nova só para os campos ainda nulos e a leitura para assim
+        que o schema está completo. Devolve (resultado, páginas lidas).
+        """
+        d = {f: None for f in schema}
+        sources = {f: None for f in schema}
+        read = []
+        tail = ""
+
+        # 1. Regex
+        pages = iter(pages)
+        while True:
+            with self.metrics.timer("pdf"):
+                page = next(pages, None)
+            if page is None:
+                break
+            read.append(page)
 
-        if null_fields and null_pct >= self.config.gpt_threshold and self.gpt_client:
-            self.logger.debug(f"{label}: {null_pct:.0%} nulos → IA acionada")
-            gpt_result, _ = self._fill_with_gpt(label, text, null_fields)
+            # Final da página anterior entra junto, para padrões que cruzam a divisa
+            with self.metrics.timer("regex"):
+                chunk = f"{tail}\n{page}" if tail else page
+                missing = {f: schema[f] for f in schema if d[f] is None}
+                regex_result, patterns_used = self._extract_label(chunk, missing, label)
 
-            for k, v in gpt_result.items():
-                if v is not None and k in d and d[k] is None:
+            for k, v in regex_result.items():
+                if k in d and v is not None:
                     d[k] = v
-                    sources[k] = "gpt"
+                    sources[k] = "regex"
 
-        d["_sources"] = sources
-        return d
+                if k in patterns_used:
+                    if k not in self.global_patterns:
+                        self.global_patterns[k] = PatternSchema(k, patterns_used[k], v)
+                    else:
+                        self.global_patterns[k].add_sample(v)
+                        self.global_patterns[k].count += 1
 
-# ===== PDF UTILS =====
+            if all(v is not None for v in d.values()):
+                break
 
-def extract_text_from_pdf(path: str, logger: logging.Logger) -> Optional[str]:
-    if not HAS_FITZ:
-        logger.error("PyMuPDF não disponível")
-        return None
+            # Corta na quebra de linha para não gerar uma linha parcial (ex: nome na OAB)
+            tail = page[-PAGE_OVERLAP:]
+            if len(page) > PAGE_OVERLAP and "\n" in tail:
+                tail = tail[tail.index("\n") + 1:]
 
-    try:
-        doc = fitz.open(path)
-        txt = "\n".join(p.get_text("text") for p in doc)
-        doc.close()
-        return txt
-    except Exception as e:
-        logger.error(f"Erro ao ler {path}: {str(e)[:100]}")
-        return None
+        text = "\n".join(read)
 
-# ===== MAIN =====
+        # 2. ✅ PADRÕES GLOBAIS (reutilizar ANTES de IA!)
+        with self.metrics.timer("regex_global"):
+            for field in [f for f in d if d[f] is None]:
+                if field in self.global_patterns:
+                    ps = self.global_patterns[field]
+                    m = ps.regex.search(text)
+                    value = (m.group(1) if m.lastindex else m.group(0)) if m else None
+                    if value and len(str(value).strip()) > 1:
+                        d[field] = value
+                        sources[field] = "regex_global"
+                        ps.count += 1
+                        ps.hits += 1
+                    else:
+                        ps.misses += 1
 
-def process_batch(batch_file: str, files_dir: str, output_dir: str, config: Config):
-    logger = setup_logger(config)
-    os.makedirs(output_dir, exist_ok=True)
+        d["_sources"] = sources
 
-    # 🎨 Panel com título
-    console.print(Panel(
-        "[bold cyan]🚀 EXTRAÇÃO EM BATCH[/bold cyan]",
-        expand=False,
-        border_style="cyan"
-    ))
+        # 3. GPT - campos escolhidos pelo roteamento (padrão: todos os nulos, se >= 30%)
+        if use_gpt and text and self.gpt_enabled:
+            # Roteia pelo tamanho do texto (estimate_tokens limita ao que cabe no prompt);
+            # o contexto só é montado para os campos que vão mesmo ao GPT
+            fields = self.router.route(d, schema, label, len(text))
+            if fields:
+                prompt_text = self.gpt_prompt_text(read, fields, schema)
+                with self.metrics.timer("gpt"):
+                    gpt_result, meta = self._fill_with_gpt(label, text, fields, prompt_text)
+                self.apply_gpt(d, gpt_result, "gpt_cache" if meta.get("cached") else "gpt", fields)
+                if not meta.get("error"):
+                    self.router.observe(label, fields, gpt_result)
 
-    try:
-        with open(batch_file, "r", encoding="utf-8") as f:
-            batch = json.load(f)
-    except Exception as e:
-        console.print(f"[bold red]❌ Erro ao ler batch.json: {e}[/bold red]")
-        return
+        return d, read
 
-    extractor = ExtractorV2(config, logger)
-    total_files = len(batch)
-    successful = 0
-    failed = 0
+    def pattern_counts(self) -> Dict[str, Tuple[int, int, int]]:
+        return {k: p.stats() for k, p in self.global_patterns.items()}
 
-    logger.info(f"Total de arquivos: {total_files}")
+    def pattern_delta(self, before: Dict[str, Tuple[int, int, int]]) -> PatternDelta:
+        """Padrões novos/reforçados desde o snapshot `before` (enviado pelos workers)"""
+        delta = {}
+        for k, p in self.global_patterns.items():
+            diff = tuple(a - b for a, b in zip(p.stats(), before.get(k, (0, 0, 0))))
+            if any(diff):
+                delta[k] = (p.pattern, *diff)
+        return delta
 
-    start_time = time.time()
+    def merge_patterns(self, delta: PatternDelta):
+        for k, (pattern, *stats) in delta.items():
+            count, hits, misses = (list(stats) + [0, 0])[:3]
+            if k not in self.global_patterns:
+                self.global_patterns[k] = PatternSchema(k, pattern)
+                self.global_patterns[k].count = 0
+            ps = self.global_patterns[k]
+            ps.count += count
+            ps.hits += hits
+            ps.misses += misses
 
-    # 🎨 Progress bar com Rich
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-        console=console
-    ) as progress:
-        task = progress.add_task(f"Processando {total_files} arquivos...", total=total_files)
+# ===== GPT ASSÍNCRONO =====
 
-        for idx, item in enumerate(batch, 1):
-            file_start = time.time()
-            fname = Path(item["pdf_path"]).name
+class AsyncGPTStage:
+    """
+    Fallback GPT fora do loop principal: um event loop numa thread dedicada
+    dispara as chamadas com AsyncOpenAI, limitadas por `gpt_concurrency`
+    requisições simultâneas e `gpt_rate_limit` requisições/s.
+    Com `gpt_batch_size` > 1, documentos com o mesmo label e campos nulos
+    são agrupados (até `gpt_batch_wait_ms` de espera) numa única requisição;
+    o que não vier na resposta em lote é refeito documento a documento.
+    Devolve apenas o conteúdo bruto; o parse (e o aprendizado de padrões)
+    fica com a thread principal.
+    """
 
-            try:
-                pdf_path = os.path.join(files_dir, item["pdf_path"])
-                text = extract_text_from_pdf(pdf_path, logger)
+    def __init__(self, extractor: ExtractorV2, config: Config, logger: logging.Logger):
+        import asyncio
+        from openai import AsyncOpenAI
 
-                if not text:
-                    logger.warning(f"❌ Falha leitura: {fname}")
-                    failed += 1
-                    progress.update(task, advance=1)
-                    continue
+        self.extractor = extractor
+        self.config = config
+        self.logger = logger
+        self.client = AsyncOpenAI(**openai_client_kwargs(config))
+        self.semaphore = asyncio.Semaphore(max(1, config.gpt_concurrency))
+        self.rate_lock = asyncio.Lock()
+        self.next_slot = 0.0
 
-                extractor.current_pdf_path = pdf_path
-                result = extractor.extract(text, item["extraction_schema"], item["label"])
+        # Lotes em formação (só acessados pela thread do event loop)
+        self.groups: Dict[Tuple[str, Tuple[str, ...]], List[Tuple[Dict, List[str], str, Future]]] = {}
+        self.timers: Dict[Tuple[str, Tuple[str, ...]], "asyncio.TimerHandle"] = {}
+        self.batches = 0
+        self.batched_docs = 0
+        self.fallbacks = 0
 
-                fields_only = {k: result.get(k) for k in item["extraction_schema"].keys()}
-                filled = sum(1 for v in fields_only.values() if v is not None)
-                total = len(item["extraction_schema"])
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="gpt-async", daemon=True)
+        self.thread.start()
+        self.logger.info(f"🤖 GPT assíncrono: até {config.gpt_concurrency} requisições simultâneas")
+        if config.gpt_batch_size > 1:
+            self.logger.info(f"📦 GPT em lote: até {config.gpt_batch_size} documentos por requisição")
 
-                output = {**fields_only}
-                output["_metadata"] = {
-                    "label": item["label"],
-                    "pdf_path": item["pdf_path"],
-                    "filled_fields": filled,
-                    "total_fields": total,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                }
+    def submit(self, label: str, null_fields: List[str], text: str) -> Future:
+        """Future com (conteúdo, veio_do_cache)"""
+        request = self.extractor._gpt_request(null_fields, text)
 
-                output["_sources"] = result.get("_sources", {})
+        cache = self.extractor.gpt_cache
+        if cache:
+            content = cache.get(request, null_fields)
+            if self.extractor._is_gpt_object(content):
+                fut = Future()
+                fut.set_result((content, True))
+                return fut
 
-                out_path = os.path.join(output_dir, Path(pdf_path).stem + "_output.json")
-                with open(out_path, "w", encoding="utf-8") as f:
-                    json.dump(output, f, ensure_ascii=False, indent=2)
+        if self.config.gpt_batch_size <= 1:
+            import asyncio
+            return asyncio.run_coroutine_threadsafe(self._call(request, null_fields), self.loop)
 
-                duration_ms = (time.time() - file_start) * 1000
+        fut = Future()
+        key = (label, tuple(null_fields))
+        self.loop.call_soon_threadsafe(self._enqueue, key, (request, null_fields, text, fut))
+        return fut
 
-                # 🎨 Log colorido
-                if filled == total:
-                    logger.info(f"✅ {fname}: {filled}/{total} ({duration_ms:.0f}ms)")
-                else:
-                    logger.info(f"⚠️  {fname}: {filled}/{total} ({duration_ms:.0f}ms)")
+    def flush(self):
+        """Dispara os lotes incompletos sem esperar `gpt_batch_wait_ms` (fim do batch)"""
+        self.loop.call_soon_threadsafe(lambda: [self._flush(key) for key in list(self.groups)])
 
-                successful += 1
-                progress.update(task, advance=1)
+    def _enqueue(self, key, job):
+        group = self.groups.setdefault(key, [])
+        group.append(job)
+        if len(group) >= self.config.gpt_batch_size:
+            self._flush(key)
+        elif len(group) == 1:
+            self.timers[key] = self.loop.call_later(self.config.gpt_batch_wait_ms / 1000, self._flush, key)
 
+    def _flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        jobs = self.groups.pop(key, [])
+        if len(jobs) == 1:
+            self.loop.create_task(self._single(jobs[0]))
+        elif jobs:
+            self.loop.create_task(self._batch(jobs))
+
+    async def _single(self, job):
+        request, null_fields, _, fut = job
+        try:
+            fut.set_result(await self._call(request, null_fields))
+        except Exception as e:
+            fut.set_exception(e)
+
+    async def _batch(self, jobs):
+        """Lote inteiro; se algo falhar no meio (ex: parse da resposta), o que ficou sem resposta é refeito um a um"""
+        try:
+            await self._batch_call(jobs)
+        except Exception as e:
+            pending = [job for job in jobs if not job[3].done()]
+            self.logger.warning(f"GPT em lote: {type(e).__name__}: {str(e)[:100]}; "
+                                f"{len(pending)} documentos refeitos individualmente")
+            self.fallbacks += len(pending)
+            import asyncio
+            await asyncio.gather(*(self._single(job) for job in pending))
+
+    async def _batch_call(self, jobs):
+        null_fields = jobs[0][1]
+        request = self.extractor._gpt_batch_request(null_fields, [text for _, _, text, _ in jobs])
+        contents = self.extractor._split_gpt_batch(await self._complete(request, null_fields), len(jobs))
+        self.batches += 1
+
+        retry = []
+        for job, content in zip(jobs, contents):
+            if content is None:
+                retry.append(job)
+                continue
+            single_request, fields, _, fut = job
+            if self.extractor.gpt_cache:
+                self.extractor.gpt_cache.put(single_request, fields, content)
+            fut.set_result((content, False))
+
+        self.batched_docs += len(jobs) - len(retry)
+        if retry:
+            self.fallbacks += len(retry)
+            self.logger.debug(f"GPT em lote: {len(retry)}/{len(jobs)} documentos refeitos individualmente")
+            import asyncio
+            await asyncio.gather(*(self._single(job) for job in retry))
+
+    async def _throttle(self):
+        if self.config.gpt_rate_limit <= 0:
+            return
+        async with self.rate_lock:
+            now = self.loop.time()
+            if self.next_slot > now:
+                import asyncio
+                await asyncio.sleep(self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + 1.0 / self.config.gpt_rate_limit
+
+    async def _complete(self, request: Dict[str, Any], null_fields: List[str]) -> Optional[str]:
+        async with self.semaphore:
+            self.extractor.observe_prompt(request, null_fields)
+            await self._throttle()
+            start = time.perf_counter()
+            try:
+                resp = await self.client.chat.completions.create(**request)
+                self.extractor.metrics.add_usage(resp.usage)
+                return resp.choices[0].message.content
             except Exception as e:
-                logger.error(f"❌ Erro em {fname}: {str(e)[:100]}")
-                logger.debug(traceback.format_exc())
+                self.logger.warning(f"Erro GPT: {type(e).__name__}: {str(e)[:100]}")
+                return None
+            finally:
+                self.extractor.metrics.observe("gpt", (time.perf_counter() - start) * 1000)
+
+    async def _call(self, request: Dict[str, Any], null_fields: List[str]) -> Tuple[Optional[str], bool]:
+        content = await self._complete(request, null_fields)
+        if self.extractor.gpt_cache and self.extractor._is_gpt_object(content):
+            self.extractor.gpt_cache.put(request, null_fields, content)
+        return content, False
+
+    def close(self):
+        if self.batches:
+            self.logger.info(f"📦 GPT em lote: {self.batched_docs} documentos em {self.batches} requisições "
+                             f"({self.fallbacks} refeitos individualmente)")
+        import asyncio
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+# ===== TEXT CACHE =====
+
+class TextCache:
+    """
+    Cache em disco do texto extraído, endereçado pelo conteúdo do PDF
+    (sha256 dos bytes + versão do PyMuPDF). Cada entrada guarda a lista de
+    páginas em JSON; o mtime marca o último uso para a evicção LRU por tamanho.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir: str, max_bytes: int, logger: logging.Logger):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logger
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(e.stat().st_size for e in os.scandir(cache_dir) if e.name.endswith(".json"))
+
+    def key(self, content_sha256: str) -> str:
+        fitz = load_fitz()
+        raw = f"{content_sha256}|fitz={fitz.VersionBind}|v={self.FORMAT_VERSION}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key: str) -> Optional[List[str]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                pages = json.load(f)
+            os.utime(path)  # LRU: marca como usado agora
+            return pages
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.debug(f"Cache de texto inválido {key[:12]}: {e}")
+            return None
+
+    def iter_pages(self, key: str) -> Optional[Iterator[str]]:
+        """Como get(), mas lendo uma página por vez do arquivo (a lista inteira nunca fica na memória)"""
+        path = self._path(key)
+        try:
+            f = open(path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return iter_json_strings(f)
+
+    def put(self, key: str, pages: List[str]):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(pages, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            self.logger.debug(f"Falha ao gravar cache de texto: {e}")
+            return
+        self._added(path)
+
+    def writer(self, key: str) -> "TextCacheWriter":
+        return TextCacheWriter(self, key)
+
+    def _added(self, path: str):
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for e in os.scandir(self.cache_dir):
+            if e.name.endswith(".json"):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+
+        total = sum(size for _, size, _ in entries)
+        # Remove as menos usadas até ficar em ~90% do limite (evita evicção a cada put)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self.total_bytes = total
+
+class TextCacheWriter:
+    """
+    Entrada do TextCache gravada página a página, no mesmo formato do put();
+    só passa a valer com close(commit=True). Falhas de escrita só desligam o
+    cache deste documento.
+    """
+
+    def __init__(self, cache: TextCache, key: str):
+        self.cache = cache
+        self.path = cache._path(key)
+        self.tmp = f"{self.path}.{os.getpid()}.tmp"
+        self.pages = 0
+        try:
+            self.f = open(self.tmp, "w", encoding="utf-8")
+            self.f.write("[")
+        except OSError as e:
+            cache.logger.debug(f"Falha ao gravar cache de texto: {e}")
+            self.f = None
+
+    def add(self, page: str):
+        if self.f is None:
+            return
+        try:
+            self.f.write((", " if self.pages else "") + json.dumps(page, ensure_ascii=False))
+            self.pages += 1
+        except OSError as e:
+            self.cache.logger.debug(f"Falha ao gravar cache de texto: {e}")
+            self.close(commit=False)
+
+    def close(self, commit: bool):
+        if self.f is None:
+            return
+        f, self.f = self.f, None
+        try:
+            f.write("]")
+            f.close()
+            if commit:
+                os.replace(self.tmp, self.path)
+                self.cache._added(self.path)
+                return
+        except OSError as e:
+            self.cache.logger.debug(f"Falha ao gravar cache de texto: {e}")
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+def iter_json_strings(f, chunk_size: int = 1 << 16) -> Iterator[str]:
+    """Strings de uma lista JSON (`["a", "b"]`) lidas do arquivo aos poucos; fecha o arquivo no fim"""
+    decoder = json.JSONDecoder()
+    with f:
+        buf, pos, eof = "", 0, False
+        started = False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,[":
+                if buf[pos] == "[":
+                    started = True
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]" and started:
+                return
+            if pos < len(buf) and started:
+                try:
+                    page, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    if not isinstance(page, str):
+                        raise ValueError("cache de texto: esperado lista de strings")
+                    yield page
+                    pos = end
+                    continue
+            elif eof:
+                raise ValueError("cache de texto: lista JSON incompleta")
+            # Precisa de mais texto (página maior que o que já foi lido)
+            more = f.read(max(chunk_size, len(buf) - pos))
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+
+def make_text_cache(config: Config, logger: logging.Logger) -> Optional[TextCache]:
+    if not config.text_cache or not HAS_FITZ:
+        return None
+    return TextCache(config.text_cache_dir, config.text_cache_max_mb * 1024 * 1024, logger)
+
+# ===== DEDUP =====
+
+RE_WORD = re.compile(r"\w+")
+
+MINHASH_PRIME = (1 << 61) - 1
+# (a, b) de cada permutação, fixos entre execuções (o índice é persistido)
+MINHASH_PARAMS = [
+    tuple(int.from_bytes(hashlib.sha256(f"minhash:{i}:{j}".encode()).digest()[:8], "big") % MINHASH_PRIME or 1
+          for j in range(2))
+    for i in range(32)
+]
+
+class DocFingerprint(NamedTuple):
+    sha256: str  # texto normalizado (palavras em minúsculas) ou, sem minhash, o arquivo PDF
+    minhash: List[int]
+
+def minhash(tokens: List[str], shingle: int = 3) -> List[int]:
+    """Assinatura MinHash (32 permutações) dos shingles de `shingle` palavras"""
+    hashes = {
+        int.from_bytes(hashlib.blake2b(" ".join(tokens[i:i + shingle]).encode(), digest_size=8).digest(), "big")
+        for i in range(max(1, len(tokens) - shingle + 1))
+    }
+    return [min(((a * h + b) % MINHASH_PRIME) & 0xFFFFFFFF for h in hashes) for a, b in MINHASH_PARAMS]
+
+class DedupIndex:
+    """
+    Documentos já extraídos, por label + campos do schema. Com min_similarity
+    >= 1 (padrão) só vale o PDF idêntico: a chave é o sha256 do arquivo, já
+    calculado na leitura, e nenhuma página extra é lida. Abaixo de 1, um
+    documento novo reaproveita os valores de outro com o mesmo texto
+    normalizado, ou com similaridade de Jaccard estimada (MinHash) >=
+    `min_similarity`, desde que todos os valores anteriores apareçam no texto
+    novo; isso exige o documento inteiro. Candidatos vêm de LSH: 8 faixas de 4
+    valores da assinatura usadas como buckets.
+    Persistido como PatternStore (JSON versionado, merge no save).
+    """
+    VERSION = 1
+    BANDS = 8
+    MAX_TOKENS = 100_000
+
+    def __init__(self, path: str, min_similarity: float, max_entries: int, logger: logging.Logger):
+        self.path = path
+        self.min_similarity = min_similarity
+        self.max_entries = max_entries
+        self.logger = logger
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.buckets: Dict[Tuple[str, int, Tuple[int, ...]], List[str]] = {}
+        self.added: Dict[str, Dict[str, Any]] = {}  # novos desde o load (vão para o save)
+
+    @property
+    def exact_only(self) -> bool:
+        return self.min_similarity >= 1
+    @staticmethod
+    def scope(label: str, schema: Dict[str, str]) -> str:
+        return hashlib.sha256(json.dumps([label, sorted(schema)]).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def fingerprint(pages: Iterable[str]) -> DocFingerprint:
+        """
+        sha256 das palavras (minúsculas) do documento, página a página;
+        MinHash só das primeiras MAX_TOKENS palavras (documentos enormes)
+        """
+        h = hashlib.sha256()
+        head = []
+        for page in pages:
+            tokens = RE_WORD.findall(page)
+            if not tokens:
+                continue
+            h.update(((" " if head else "") + " ".join(tokens).lower()).encode())
+            if len(head) < DedupIndex.MAX_TOKENS:
+                head.extend(t.lower() for t in tokens[:DedupIndex.MAX_TOKENS - len(head)])
+        return DocFingerprint(h.hexdigest(), minhash(head))
+
+    def _bands(self, signature: List[int]) -> List[Tuple[int, ...]]:
+        rows = len(signature) // self.BANDS
+        return [tuple(signature[i * rows:(i + 1) * rows]) for i in range(self.BANDS)]
+
+    def lookup(self, scope: str, fp: DocFingerprint, text: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """(entrada, similaridade) do documento equivalente, ou None"""
+        exact = self.entries.get(f"{scope}:{fp.sha256}")
+        if exact:
+            return exact, 1.0
+        if not fp.minhash:
+            return None  # chave = sha256 do PDF: só o idêntico vale
+
+        best, best_similarity = None, self.min_similarity
+        for i, band in enumerate(self._bands(fp.minhash)):
+            for key in self.buckets.get((scope, i, band), []):
+                entry = self.entries[key]
+                similarity = sum(x == y for x, y in zip(entry["minhash"], fp.minhash)) / len(fp.minhash)
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+
+        # Quase idêntico só vale se os valores anteriores estão no texto novo
+        if best and all(str(v) in text for v in best["values"].values() if v is not None):
+            return best, best_similarity
+        return None
+
+    def add(self, scope: str, fp: DocFingerprint, result: Dict[str, Any], schema: Dict[str, str],
+            pdf_path: str, gpt: bool) -> Dict[str, Any]:
+        """`gpt`: o GPT estava disponível (nulos do resultado não são só falta de fallback)"""
+        entry = {"scope": scope, "sha256": fp.sha256, "minhash": fp.minhash, "pdf_path": pdf_path,
+                 "gpt": gpt, "values": {f: result.get(f) for f in schema}}
+        self.merge([entry])
+        return entry
+
+    def merge(self, entries: List[Dict[str, Any]], loaded: bool = False):
+        for entry in entries:
+            key = f"{entry['scope']}:{entry['sha256']}"
+            old = self.entries.get(key)
+            if old and (old.get("gpt") or not entry.get("gpt")):
+                continue
+            self.entries[key] = entry
+            if not old and entry["minhash"]:
+                for i, band in enumerate(self._bands(entry["minhash"])):
+                    self.buckets.setdefault((entry["scope"], i, band), []).append(key)
+            if not loaded:
+                self.added[key] = entry
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {"version": self.VERSION, "entries": []}
+        except Exception as e:
+            self.logger.warning(f"⚠️  Índice de duplicados ilegível ({self.path}): {e}")
+            return None
+
+        if data.get("version") != self.VERSION:
+            self.logger.warning(f"⚠️  Índice de duplicados com versão {data.get('version')} (esperada {self.VERSION}); ignorado")
+            return None
+        return data
+
+    def load(self) -> "DedupIndex":
+        data = self._read() or {"entries": []}
+        self.merge(data["entries"], loaded=True)
+        if self.entries:
+            self.logger.info(f"🪞 {len(self.entries)} documentos no índice de duplicados")
+        return self
+
+    def save(self):
+        if not self.added:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            data = self._read()
+            if data is None:
+                return  # não sobrescreve um índice que não entendemos
+
+            current = {f"{e['scope']}:{e['sha256']}": e for e in data["entries"]}
+            current.update(self.added)
+            entries = list(current.values())[-self.max_entries:]
+
+            data = {
+                "version": self.VERSION,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "entries": entries,
+            }
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        self.added = {}
+
+def make_dedup_index(config: Config, logger: logging.Logger) -> Optional[DedupIndex]:
+    if not config.dedup:
+        return None
+    return DedupIndex(config.dedup_path, config.dedup_min_similarity, config.dedup_max_entries, logger).load()
+
+# ===== PDF UTILS =====
+
+class PdfText(NamedTuple):
+    pages: Optional[Iterable[str]]
+    cache_hit: bool = False
+    sha256: Optional[str] = None
+    page_count: int = 0
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _iter_doc_pages(doc, cache: Optional[TextCache], key: Optional[str], low_memory: bool = False) -> Iterator[str]:
+    """
+    Páginas sob demanda, gravadas no cache à medida que são lidas
+    (TextCacheWriter); a entrada só vale se todas as páginas forem lidas,
+    mesmo que o consumidor pare na última (sem esgotar o gerador).
+    """
+    entry = cache.writer(key) if cache else None
+    try:
+        for i in range(doc.page_count):
+            text = doc.load_page(i).get_text("text")
+            if entry:
+                entry.add(text)
+            yield text
+    finally:
+        if entry:
+            entry.close(commit=entry.pages == doc.page_count)
+        doc.close()
+        if low_memory:
+            load_fitz().TOOLS.store_shrink(100)  # devolve o cache interno do MuPDF
+
+def validate_item(item: Any) -> Optional[str]:
+    """Motivo pelo qual o item do batch é inválido, ou None"""
+    if not isinstance(item, dict):
+        return "item não é um objeto"
+    if not isinstance(item.get("label"), str):
+        return "label ausente ou não é texto"
+    if not isinstance(item.get("pdf_path"), str):
+        return "pdf_path ausente ou não é texto"
+    if not isinstance(item.get("extraction_schema"), dict):
+        return "extraction_schema ausente ou não é um objeto"
+    return None
+
+def resolve_pdf_path(files_dir: str, pdf_path: str) -> Optional[str]:
+    """Caminho real do PDF, ou None se `pdf_path` sair de files_dir (absoluto, ../, symlink)"""
+    base = os.path.realpath(files_dir)
+    path = os.path.realpath(os.path.join(base, pdf_path))
+    return path if os.path.commonpath([base, path]) == base else None
+
+def read_pdf_pages(path: str, logger: logging.Logger, cache: Optional[TextCache] = None,
+                   lazy: bool = False, low_memory: bool = False, sha: Optional[str] = None) -> PdfText:
+    """
+    Texto de cada página do PDF (ou do cache), com o sha256 do arquivo.
+    Com lazy=True, `pages` é um gerador que extrai cada página só quando
+    pedida (feche-o com .close() se parar antes do fim). Com low_memory, o
+    PDF é aberto pelo caminho (sem carregar o arquivo inteiro na memória) e
+    as páginas são sempre um gerador, também num acerto do cache: nenhuma
+    lista com o documento inteiro, para o PageBudget limitar o que é lido.
+    `sha`: hash do arquivo já calculado pelo chamador (não é refeito).
+    """
+    if not HAS_FITZ:
+        logger.error("PyMuPDF não disponível")
+        return PdfText(None)
+
+    fitz = load_fitz()
+    lazy = lazy or low_memory
+    try:
+        if low_memory:
+            data = None
+            sha = sha or file_sha256(path)
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+            sha = sha or hashlib.sha256(data).hexdigest()
+
+        key = cache.key(sha) if cache else None
+        if cache and low_memory:
+            pages = cache.iter_pages(key)
+            if pages is not None:
+                with fitz.open(path) as doc:
+                    return PdfText(pages, True, sha, doc.page_count)
+        elif cache:
+            pages = cache.get(key)
+            if pages is not None:
+                return PdfText(pages, True, sha, len(pages))
+
+        doc = fitz.open(path) if data is None else fitz.open(stream=data, filetype="pdf")
+        if lazy:
+            return PdfText(_iter_doc_pages(doc, cache, key, low_memory), False, sha, doc.page_count)
+
+        try:
+            pages = [doc.load_page(i).get_text("text") for i in range(doc.page_count)]
+        finally:
+            doc.close()
+
+        if cache:
+            cache.put(key, pages)
+        return PdfText(pages, False, sha, len(pages))
+    except Exception as e:
+        logger.error(f"Erro ao ler {path}: {str(e)[:100]}")
+        return PdfText(None)
+
+class PageBudget:
+    """Páginas até somar `max_chars` caracteres; o excedente é descartado (truncated=True)"""
+
+    def __init__(self, pages: Iterable[str], max_chars: int):
+        self.pages = pages
+        self.max_chars = max_chars
+        self.used = 0
+        self.truncated = False
+
+    def __iter__(self) -> Iterator[str]:
+        for page in self.pages:
+            left = self.max_chars - self.used
+            if left <= 0:
+                self.truncated = True
+                return
+            if len(page) > left:
+                page = page[:left]
+                self.truncated = True
+            self.used += len(page)
+            yield page
+            if self.truncated:
+                return
+
+def reset_peak_rss() -> bool:
+    """Zera o pico de RSS do processo (Linux: /proc/self/clear_refs)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb() -> Optional[float]:
+    """Pico de RSS desde o último reset_peak_rss() (VmHWM), em MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def extract_text_from_pdf(path: str, logger: logging.Logger, cache: Optional[TextCache] = None) -> Optional[str]:
+    pages = read_pdf_pages(path, logger, cache).pages
+    return "\n".join(pages) if pages is not None else None
+
+# ===== BATCH I/O =====
+
+def open_batch(batch_file: str) -> Tuple[int, Iterator[Dict]]:
+    """
+    Abre o batch e devolve (total, itens). `.jsonl` é lido linha a linha
+    (memória constante); `.json` continua sendo uma lista carregada inteira.
+    Linhas inválidas viram itens com `_error` e contam como falha.
+    """
+    if not batch_file.endswith(".jsonl"):
+        with open(batch_file, "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        if not isinstance(batch, list):
+            raise ValueError("o batch .json deve ser uma lista de itens")
+        return len(batch), iter(batch)
+
+    with open(batch_file, "r", encoding="utf-8") as f:
+        total = sum(1 for line in f if line.strip())
+
+    def items():
+        with open(batch_file, "r", encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield {"pdf_path": f"linha {n}", "label": "", "extraction_schema": {}, "_error": f"JSON inválido: {e}"}
+
+    return total, items()
+
+def iter_chunks(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+class RecyclingPool:
+    """
+    ProcessPoolExecutor trocado por um novo a cada `max_docs` documentos por
+    worker: o pool antigo para de receber chunks e seus processos saem quando
+    terminam o que já têm. (max_tasks_per_child trava no Python 3.11 quando
+    há submissões depois que um worker saiu.)
+    """
+
+    def __init__(self, workers: int, max_docs: int, initializer: Callable, initargs: Callable[[], tuple]):
+        self.workers = workers
+        self.max_docs = max_docs
+        self.initializer = initializer
+        self.initargs = initargs  # chamado a cada pool novo (ex: padrões aprendidos até agora)
+        self.pools: List["ProcessPoolExecutor"] = []
+        self.submitted = 0
+
+    def submit(self, fn: Callable, chunk: List[Dict]) -> Future:
+        if not self.pools or (self.max_docs and self.submitted >= self.workers * self.max_docs):
+            from concurrent.futures import ProcessPoolExecutor  # multiprocessing só com --workers > 1
+            if self.pools:
+                self.pools[-1].shutdown(wait=False)
+            self.pools.append(ProcessPoolExecutor(
+                max_workers=self.workers, initializer=self.initializer, initargs=self.initargs(),
+            ))
+            self.submitted = 0
+        self.submitted += len(chunk)
+        return self.pools[-1].submit(fn, chunk)
+
+    def shutdown(self, cancel_futures: bool = False):
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=cancel_futures)
+
+def bounded_map(pool: RecyclingPool, fn: Callable, chunks: Iterable[List[Dict]], window: int) -> Iterator[Dict]:
+    """Como pool.map, mas com no máximo `window` chunks submetidos por vez (não consome o batch inteiro)"""
+    submitted = deque()
+    for chunk in chunks:
+        submitted.append(pool.submit(fn, chunk))
+        if len(submitted) >= window:
+            yield from submitted.popleft().result()
+    while submitted:
+        yield from submitted.popleft().result()
+
+# ===== CHECKPOINT =====
+
+def journal_path(output_dir: str) -> str:
+    """Journal fica ao lado da pasta de saída: output/ -> output.journal.jsonl"""
+    out = Path(output_dir).resolve()
+    return str(out.parent / f"{out.name}.journal.jsonl")
+
+class CheckpointJournal:
+    """
+    Journal append-only dos itens concluídos: uma linha por item com pdf_path,
+    sha256 do PDF e os padrões aprendidos naquele item. Com resume=True, o
+    journal existente é lido (done + padrões acumulados) e novas linhas são
+    acrescentadas; sem resume, começa vazio.
+    """
+
+    def __init__(self, path: str, resume: bool, logger: logging.Logger):
+        self.path = path
+        self.logger = logger
+        self.done: Dict[str, str] = {}
+        self.patterns: PatternDelta = {}
+
+        if resume:
+            if os.path.exists(path):
+                self._load()
+            else:
+                logger.warning(f"⚠️  Journal não encontrado ({path}); começando do início")
+
+        # Line-buffered: cada item concluído vai para o disco na hora
+        self.f = open(path, "a" if resume else "w", encoding="utf-8", buffering=1)
+        if self.f.tell() > 0 and not self._ends_with_newline():
+            self.f.write("\n")  # isola a linha truncada pelo crash
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # última linha truncada por um crash
+                if rec.get("_store_saved"):
+                    # Tudo acima já está no store de padrões
+                    self.patterns = {}
+                    continue
+                self.done[rec["pdf_path"]] = rec["sha256"]
+                add_pattern_delta(self.patterns, {k: tuple(v) for k, v in rec.get("patterns", {}).items()})
+
+        self.logger.info(f"♻️  Retomando: {len(self.done)} itens já concluídos em {self.path}")
+
+    def record(self, summary: Dict[str, Any]):
+        rec = {"pdf_path": summary["pdf_path"], "sha256": summary["sha256"], "patterns": summary["patterns"]}
+        self.f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def mark_store_saved(self):
+        self.f.write(json.dumps({"_store_saved": True}) + "\n")
+
+    def close(self):
+        self.f.close()
+
+# ===== SAÍDAS =====
+# Destinos das saídas do batch (--output-format). O JSON por arquivo é gravado
+# no próprio processo que extraiu; os demais recebem as saídas no processo
+# principal, na ordem do batch.
+
+def write_json_output(output: Dict[str, Any], output_dir: str):
+    out_path = os.path.join(output_dir, Path(output["_metadata"]["pdf_path"]).stem + "_output.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+
+class OutputSink(ABC):
+    """
+    Destino das saídas: write() por documento, close() no fim do batch.
+    O journal só marca um item como concluído quando a saída dele aparece
+    em written(), isto é, quando já está no disco (não só num buffer).
+    """
+    in_worker = False  # True: cada processo grava as próprias saídas (nada volta no resumo)
+
+    def __init__(self):
+        self.durable: deque = deque()  # pdf_paths gravados (a escrita pode rodar noutra thread)
+
+    @abstractmethod
+    def write(self, output: Dict[str, Any]):
+        """Recebe a saída de um documento (pode ficar num buffer até o próximo fsync)"""
+
+    def written(self) -> List[str]:
+        """pdf_paths cujas saídas foram para o disco desde a última chamada"""
+        paths = []
+        while self.durable:
+            paths.append(self.durable.popleft())
+        return paths
+
+    def close(self):
+        pass
+
+class JsonFileSink(OutputSink):
+    """Um <pdf>_output.json indentado por documento"""
+    in_worker = True
+
+    def __init__(self, output_dir: str):
+        super().__init__()
+        self.output_dir = output_dir
+
+    def write(self, output: Dict[str, Any]):
+        write_json_output(output, self.output_dir)
+        self.durable.append(output["_metadata"]["pdf_path"])
+
+class JsonlSink(OutputSink):
+    """
+    Saída única (uma linha JSON compacta por documento), com escrita bufferizada.
+    A cada `sync_every` documentos (e no close) o arquivo recebe flush + fsync e
+    só então os documentos vão para written(). Como o journal: com resume
+    acrescenta ao arquivo, sem resume começa vazio.
+    """
+
+    def __init__(self, path: str, resume: bool = False, done: Iterable[str] = (),
+                 sync_every: int = 10_000, buffer_size: int = 1 << 20):
+        super().__init__()
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self.pending: List[str] = []
+        if resume and os.path.exists(path):
+            self._keep_only(set(done))
+        self.f = open(path, "a" if resume else "w", encoding="utf-8", buffering=buffer_size)
+
+    def _keep_only(self, done: Set[str]):
+        """Descarta linhas de itens fora do journal (gravadas antes de um crash; serão refeitas)"""
+        tmp = self.path + ".tmp"
+        dropped = 0
+        with open(self.path, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+            for line in src:
+                try:
+                    keep = json.loads(line)["_metadata"]["pdf_path"] in done
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    keep = False  # linha truncada
+                if keep:
+                    dst.write(line)
+                else:
+                    dropped += 1
+        if dropped:
+            os.replace(tmp, self.path)
+        else:
+            os.remove(tmp)
+
+    def write(self, output: Dict[str, Any]):
+        self.f.write(json.dumps(output, ensure_ascii=False, separators=(",", ":")))
+        self.f.write("\n")
+        self.pending.append(output["_metadata"]["pdf_path"])
+        if len(self.pending) >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.durable.extend(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+RE_PART_FILE = re.compile(r"part-(\d+)\.")
+
+class LabelPartFiles:
+    """
+    Arquivos <root>/<label>/part-NNNNN.<ext>, cada um completo: gravado num
+    .part-NNNNN.<ext>.tmp oculto, com fsync e renomeado (nunca fica um part
+    pela metade). Uma execução nova apaga os parts anteriores do label; com
+    resume, os novos são acrescentados e, como no JsonlSink, os parts
+    existentes perdem as linhas de itens fora do journal (`done`, na coluna
+    `path_column`), gravadas antes de um crash e que serão refeitas.
+    """
+
+    def __init__(self, root: str, resume: bool, done: Iterable[str] = (), path_column: str = "pdf_path"):
+        self.root = root
+        self.resume = resume
+        self.started: set = set()
+        if resume and os.path.isdir(root):
+            done = set(done)
+            for label_dir in os.scandir(root):
+                if label_dir.is_dir():
+                    for p in sorted(os.listdir(label_dir.path)):
+                        if p.startswith("part-"):
+                            self._keep_only(os.path.join(label_dir.path, p), done, path_column)
+
+    @staticmethod
+    def _tmp_path(path: str) -> str:
+        return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+
+    def _keep_only(self, path: str, done: Set[str], path_column: str):
+        try:
+            if path.endswith(".parquet"):
+                import pyarrow as pa
+                import pyarrow.compute as pc
+                import pyarrow.parquet as pq
+                table = pq.read_table(path)
+                mask = pc.is_in(table[path_column], value_set=pa.array(sorted(done), pa.string()))
+                kept = table.filter(mask)
+                if kept.num_rows == table.num_rows:
+                    return
+                write = lambda tmp: pq.write_table(kept, tmp)
+            else:
+                import csv
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    rows = list(csv.reader(f))
+                kept = rows[:1] + [r for r in rows[1:] if r and r[rows[0].index(path_column)] in done]
+                if len(kept) == len(rows):
+                    return
+
+                def write(tmp: str):
+                    with open(tmp, "w", encoding="utf-8", newline="") as f:
+                        csv.writer(f).writerows(kept)
+        except Exception:
+            # Part ilegível (ex: aberto por uma versão antiga quando o processo morreu): fica de lado, oculto
+            os.replace(path, os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.corrupt"))
+            return
+        self._replace(path, write)
+
+    def _replace(self, path: str, write: Callable[[str], None]):
+        tmp = self._tmp_path(path)
+        write(tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def next_path(self, label: str, ext: str) -> str:
+        label_dir = os.path.join(self.root, re.sub(r"[^\w.-]", "_", label))
+        os.makedirs(label_dir, exist_ok=True)
+        if label not in self.started:
+            for p in os.listdir(label_dir):
+                if (p.startswith(".part-") and p.endswith(".tmp")) or (p.startswith("part-") and not self.resume):
+                    os.remove(os.path.join(label_dir, p))
+            self.started.add(label)
+        numbers = [int(m.group(1)) for m in map(RE_PART_FILE.match, os.listdir(label_dir)) if m]
+        return os.path.join(label_dir, f"part-{max(numbers, default=-1) + 1:05d}.{ext}")
+
+    def write_part(self, label: str, ext: str, write: Callable[[str], None]) -> str:
+        """`write(tmp)` grava o conteúdo; o part só aparece com o nome final depois do fsync"""
+        path = self.next_path(label, ext)
+        self._replace(path, write)
+        return path
+
+def arrow_type(name: str):
+    import pyarrow as pa
+    return {"string": pa.string(), "int32": pa.int32(), "int64": pa.int64(), "float64": pa.float64(),
+            "date32": pa.date32(), "decimal": pa.decimal128(18, 2),
+            "timestamp": pa.timestamp("us", tz="UTC")}[name]
+
+# _metadata achatado em colunas _metadata.<chave>; chaves fora da lista vão em _metadata.extra (JSON)
+METADATA_COLUMNS: Dict[str, str] = {
+    "label": "string",
+    "pdf_path": "string",
+    "filled_fields": "int32",
+    "total_fields": "int32",
+    "timestamp": "timestamp",
+    "text_cache": "string",
+    "pages_read": "int32",
+    "page_count": "int32",
+    "dedup.of": "string",
+    "dedup.similarity": "float64",
+    "truncated_chars": "int64",
+    "peak_rss_mb": "float64",
+}
+
+def flatten_metadata(meta: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    flat = {}
+    for k, v in meta.items():
+        if isinstance(v, dict):
+            flat.update(flatten_metadata(v, f"{prefix}{k}."))
+        else:
+            flat[prefix + k] = v
+    return flat
+
+class ParquetSink(OutputSink):
+    """
+    Saídas em results/<label>/part-NNNNN.parquet: a cada `rows_per_group`
+    documentos do label (e no close) um part completo, com um row group
+    (LabelPartFiles.write_part); só então os documentos vão para written().
+    Uma linha por documento: os campos (texto, como no JSON),
+    _metadata.* e _sources.<campo> achatados em colunas.
+    """
+
+    def __init__(self, output_dir: str, rows_per_group: int, resume: bool, done: Iterable[str] = ()):
+        super().__init__()
+        self.files = LabelPartFiles(os.path.join(output_dir, "results"), resume, done, "_metadata.pdf_path")
+        self.rows_per_group = max(1, rows_per_group)
+        self.rows: Dict[str, List[Dict[str, Any]]] = {}
+
+    def write(self, output: Dict[str, Any]):
+        label = output["_metadata"]["label"]
+        rows = self.rows.setdefault(label, [])
+        rows.append(output)
+        if len(rows) >= self.rows_per_group:
+            self.flush(label)
+
+    def flush(self, label: str):
+        import pyarrow as pa
+
+        rows = self.rows.pop(label, None)
+        if not rows:
+            return
+
+        fields = tuple(dict.fromkeys(k for out in rows for k in out if not k.startswith("_")))
+        columns: Dict[str, List[Any]] = {f: [] for f in fields}
+        columns.update({f"_metadata.{k}": [] for k in METADATA_COLUMNS})
+        columns["_metadata.extra"] = []
+        columns.update({f"_sources.{f}": [] for f in fields})
+
+        for out in rows:
+            for f in fields:
+                v = out.get(f)
+                columns[f].append(v if v is None or isinstance(v, str) else json.dumps(v, ensure_ascii=False))
+            meta = flatten_metadata(out["_metadata"])
+            if meta.get("timestamp"):
+                meta["timestamp"] = datetime.fromisoformat(meta["timestamp"])
+            for k in METADATA_COLUMNS:
+                columns[f"_metadata.{k}"].append(meta.pop(k, None))
+            columns["_metadata.extra"].append(json.dumps(meta, ensure_ascii=False) if meta else None)
+            sources = out.get("_sources") or {}
+            for f in fields:
+                columns[f"_sources.{f}"].append(sources.get(f))
+
+        types = {name: "string" for name in columns}
+        types.update({f"_metadata.{k}": t for k, t in METADATA_COLUMNS.items()})
+        schema = pa.schema([(name, arrow_type(types[name])) for name in columns])
+        table = pa.Table.from_pydict(columns, schema=schema)
+
+        # Um part só é legível depois de fechado (rodapé do Parquet): nunca fica um aberto
+        import pyarrow.parquet as pq
+        self.files.write_part(label, "parquet", lambda tmp: pq.write_table(table, tmp, row_group_size=len(rows)))
+        self.durable.extend(out["_metadata"]["pdf_path"] for out in rows)
+
+    def close(self):
+        for label in list(self.rows):
+            self.flush(label)
+
+def make_output_sink(config: Config, output_dir: str, done: Iterable[str] = ()) -> OutputSink:
+    """`done`: itens já no journal (com resume, o resto de uma execução interrompida é descartado)"""
+    if config.output_format == "jsonl":
+        return JsonlSink(os.path.join(output_dir, "results.jsonl"), config.resume, done,
+                         sync_every=config.row_group_size)
+    if config.output_format == "parquet":
+        return ParquetSink(output_dir, config.row_group_size, config.resume, done)
+    return JsonFileSink(output_dir)
+
+# ===== COLUNAS TIPADAS =====
+# Pós-processamento do batch: os valores saem no JSON como o regex/GPT
+# devolveram; aqui são validados e normalizados coluna a coluna (cada valor
+# distinto é interpretado uma vez por lote) e gravados como colunas tipadas
+# em typed/<label>/ (Parquet com pyarrow, CSV normalizado sem ele).
+
+UFS = {
+    "AC": "ACRE", "AL": "ALAGOAS", "AP": "AMAPA", "AM": "AMAZONAS", "BA": "BAHIA", "CE": "CEARA",
+    "DF": "DISTRITO FEDERAL", "ES": "ESPIRITO SANTO", "GO": "GOIAS", "MA": "MARANHAO",
+    "MT": "MATO GROSSO", "MS": "MATO GROSSO DO SUL", "MG": "MINAS GERAIS", "PA": "PARA",
+    "PB": "PARAIBA", "PR": "PARANA", "PE": "PERNAMBUCO", "PI": "PIAUI", "RJ": "RIO DE JANEIRO",
+    "RN": "RIO GRANDE DO NORTE", "RS": "RIO GRANDE DO SUL", "RO": "RONDONIA", "RR": "RORAIMA",
+    "SC": "SANTA CATARINA", "SP": "SAO PAULO", "SE": "SERGIPE", "TO": "TOCANTINS",
+}
+UF_BY_NAME = {name: uf for uf, name in UFS.items()}
+
+RE_DATE_BR = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})")
+RE_DATE_ISO = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:[T ].*)?")
+RE_MONEY_BR = re.compile(r"-?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d{1,2})?")  # 1.234,56 | 1234,5 | 1.234
+RE_MONEY_DOT = re.compile(r"-?(?:\d{1,3}(?:,\d{3})+|\d+)\.\d{1,2}")  # 1,234.56 | 12.50
+RE_CURRENCY = re.compile(r"R\$|BRL|\s")
+RE_NON_DIGIT = re.compile(r"\D")
+RE_ASCII_DIGITS = re.compile(r"\d+", re.ASCII)
+CENTS = Decimal("0.01")
+
+def parse_date(value: str) -> Optional[date]:
+    m = RE_DATE_BR.fullmatch(value)
+    if m:
+        d, mo, y = (int(g) for g in m.groups())
+        if len(m.group(3)) == 2:
+            y += 2000 if y < 70 else 1900
+    else:
+        m = RE_DATE_ISO.fullmatch(value)
+        if not m:
+            return None
+        y, mo, d = (int(g) for g in m.groups())
+    if not 1900 <= y <= 2100:
+        return None
+    try:
+        return date(y, mo, d)
+    except ValueError:
+        return None
+
+def parse_brl(value: str) -> Optional[Decimal]:
+    """Valor em reais -> Decimal com 2 casas (CPF/CNPJ e códigos não passam)"""
+    s = RE_CURRENCY.sub("", value)
+    if RE_MONEY_BR.fullmatch(s):
+        s = s.replace(".", "").replace(",", ".")
+    elif RE_MONEY_DOT.fullmatch(s):
+        s = s.replace(",", "")
+    else:
+        return None
+    amount = Decimal(s).quantize(CENTS)
+    return amount if abs(amount) < Decimal(10) ** 16 else None
+
+def parse_phone(value: str) -> Optional[str]:
+    """Telefone com DDD -> +55DDNNNNNNNN (celular com 9 dígitos começa em 9)"""
+    digits = RE_NON_DIGIT.sub("", value)
+    if len(digits) in (12, 13) and digits.startswith("55"):
+        digits = digits[2:]
+    if len(digits) not in (10, 11) or "0" in digits[:2]:
+        return None
+    if len(digits) == 11 and digits[2] != "9":
+        return None
+    return "+55" + digits
+
+def parse_uf(value: str) -> Optional[str]:
+    s = unicodedata.normalize("NFKD", value.upper()).encode("ascii", "ignore").decode()
+    s = " ".join(s.split())
+    if s in UFS:
+        return s
+    return UF_BY_NAME.get(s)
+
+def parse_int(value: str) -> Optional[int]:
+    # isdigit() aceita "²" e outros dígitos Unicode que int() recusa
+    return int(value) if RE_ASCII_DIGITS.fullmatch(value) else None
+
+# tipo -> (parser, tipo Arrow)
+FIELD_KINDS: Dict[str, Tuple[Callable[[str], Any], str]] = {
+    "date": (parse_date, "date32"),
+    "money": (parse_brl, "decimal"),
+    "phone": (parse_phone, "string"),
+    "uf": (parse_uf, "string"),
+    "int": (parse_int, "int64"),
+}
+
+def field_kind(field: str) -> Optional[str]:
+    """Tipo do campo pelo nome (mesmas pistas de _extract_pattern_from_value); None = texto livre"""
+    tokens = set(field.lower().split("_"))
+    if tokens & {"quantidade", "qtd", "qtde"}:
+        return "int"
+    if "data" in tokens:
+        return "date"
+    if tokens & {"telefone", "celular", "fone"}:
+        return "phone"
+    if tokens & {"uf", "estado", "seccional"}:
+        return "uf"
+    if tokens & {"valor", "preco", "saldo", "total"}:
+        return "money"
+    return None
+
+def normalize_column(kind: Optional[str], values: List[Any]) -> Tuple[List[Any], List[str]]:
+    """
+    Normaliza uma coluna inteira: (valores tipados, valores brutos inválidos).
+    Cada valor distinto é interpretado uma vez (datas, UFs e valores repetem muito).
+    """
+    if kind is None:
+        return [None if v is None else str(v).strip() for v in values], []
+
+    parse = FIELD_KINDS[kind][0]
+    parsed: Dict[str, Any] = {}
+    out = []
+    invalid = []
+    for v in values:
+        if v is None:
+            out.append(None)
+            continue
+        raw = str(v).strip()
+        try:
+            typed = parsed[raw]
+        except KeyError:
+            typed = parsed[raw] = parse(raw) if raw else None
+            if typed is None:
+                invalid.append(raw)
+        out.append(typed)
+    return out, invalid
+
+class TypedColumnWriter:
+    """
+    Acumula as linhas do batch por label e, a cada `rows_per_group` linhas,
+    normaliza o lote coluna a coluna e grava um part completo em
+    typed/<label>/part-NNNNN.parquet (ou .csv sem pyarrow). Como nos
+    OutputSink, os pdf_paths gravados aparecem em written() para o journal.
+    """
+
+    def __init__(self, output_dir: str, fmt: str, rows_per_group: int, resume: bool, logger: logging.Logger,
+                 done: Iterable[str] = ()):
+        if fmt == "parquet" and not HAS_PYARROW:
+            logger.warning("⚠️  pyarrow não instalado; colunas tipadas em CSV")
+            fmt = "csv"
+        self.fmt = fmt
+        self.dir = os.path.join(output_dir, "typed")
+        self.files = LabelPartFiles(self.dir, resume, done)
+        self.rows_per_group = max(1, rows_per_group)
+        self.logger = logger
+        self.rows: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        self.durable: deque = deque()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self.normalize_s = 0.0
+
+    def add(self, label: str, pdf_path: str, values: Dict[str, Any]):
+        rows = self.rows.setdefault(label, [])
+        rows.append((pdf_path, values))
+        if len(rows) >= self.rows_per_group:
+            self.flush(label)
+
+    def flush(self, label: str):
+        rows = self.rows.pop(label, None)
+        if not rows:
+            return
+
+        t0 = time.perf_counter()
+        fields = tuple(dict.fromkeys(f for _, values in rows for f in values))
+        columns: Dict[str, List[Any]] = {"pdf_path": [p for p, _ in rows]}
+        for f in fields:
+            kind = field_kind(f)
+            columns[f], invalid = normalize_column(kind, [values.get(f) for _, values in rows])
+            stats = self.stats.setdefault(f"{label}.{f}", {"kind": kind or "text", "valid": 0, "invalid": 0})
+            stats["valid"] += sum(1 for v in columns[f] if v is not None)
+            stats["invalid"] += len(invalid)
+            for raw in invalid[:3]:
+                self.logger.debug("🧾 %s.%s: valor inválido para %s: %r", label, f, kind, raw)
+        self.normalize_s += time.perf_counter() - t0
+
+        if self.fmt == "parquet":
+            self._write_parquet(label, fields, columns)
+        else:
+            self._write_csv(label, fields, columns)
+        self.durable.extend(columns["pdf_path"])
+
+    def _write_parquet(self, label: str, fields: Tuple[str, ...], columns: Dict[str, List[Any]]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([("pdf_path", pa.string())] + [
+            (f, arrow_type(FIELD_KINDS[kind][1] if kind else "string")) for f, kind in ((f, field_kind(f)) for f in fields)
+        ])
+        table = pa.Table.from_pydict(columns, schema=schema)
+        self.files.write_part(label, "parquet",
+                              lambda tmp: pq.write_table(table, tmp, row_group_size=len(columns["pdf_path"])))
+
+    def _write_csv(self, label: str, fields: Tuple[str, ...], columns: Dict[str, List[Any]]):
+        import csv
+
+        def write(path: str):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(("pdf_path",) + fields)
+                writer.writerows(zip(*(["" if v is None else v for v in col] for col in columns.values())))
+
+        self.files.write_part(label, "csv", write)
+
+    def written(self) -> List[str]:
+        """pdf_paths cujas linhas tipadas foram para o disco desde a última chamada"""
+        paths = []
+        while self.durable:
+            paths.append(self.durable.popleft())
+        return paths
+
+    def close(self):
+        for label in list(self.rows):
+            self.flush(label)
+
+    def report(self) -> Dict[str, Any]:
+        return {"format": self.fmt, "dir": self.dir, "normalize_s": round(self.normalize_s, 3),
+                "fields": dict(sorted(self.stats.items()))}
+
+# ===== BATCH ITEM =====
+
+@dataclass
+class ItemContext:
+    """Dependências do processamento de um item (uma instância por processo)"""
+    extractor: ExtractorV2
+    logger: logging.Logger
+    files_dir: str
+    output_dir: str
+    defer_gpt: bool = False
+    text_cache: Optional[TextCache] = None
+    collect_output: bool = False  # saída volta no resumo (gravada pelo OutputSink do processo principal)
+    resume_index: Optional[Dict[str, str]] = None  # pdf_path -> sha256 já concluídos
+    lazy_pages: bool = True  # lê páginas sob demanda e para quando o schema fecha
+    dedup: Optional[DedupIndex] = None
+    low_memory: bool = False  # abre PDFs pelo caminho, limita o texto e mede o pico de RSS
+    max_text_chars: int = 0  # 0 = sem limite
+    typed_rows: bool = False  # valores voltam no resumo para as colunas tipadas (processo principal)
+
+def build_item_output(item: Dict, result: Dict[str, Any], extra_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    fields_only = {k: result.get(k) for k in item["extraction_schema"].keys()}
+    filled = sum(1 for v in fields_only.values() if v is not None)
+    total = len(item["extraction_schema"])
+
+    output = {**fields_only}
+    output["_metadata"] = {
+        "label": item["label"],
+        "pdf_path": item["pdf_path"],
+        "filled_fields": filled,
+        "total_fields": total,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        **(extra_metadata or {}),
+    }
+
+    output["_sources"] = result.get("_sources", {})
+    return output
+
+def emit_item_output(ctx: ItemContext, item: Dict, result: Dict[str, Any], summary: Dict[str, Any]):
+    output = build_item_output(item, result, summary["metadata"])
+    if ctx.collect_output:
+        summary["output"] = output
+    else:
+        with ctx.extractor.metrics.timer("write"):
+            write_json_output(output, ctx.output_dir)
+    if ctx.typed_rows:
+        summary["typed"] = (item["label"], {k: output[k] for k in item["extraction_schema"]})
+    ctx.extractor.metrics.count_sources(output["_sources"])
+
+    meta = output["_metadata"]
+    summary.update(ok=True, filled=meta["filled_fields"], total=meta["total_fields"])
+
+def record_peak_rss(extractor: ExtractorV2, summary: Dict[str, Any]):
+    rss = peak_rss_mb()
+    if rss is not None:
+        summary["metadata"]["peak_rss_mb"] = round(rss, 1)
+        extractor.metrics.observe_rss(rss)
+
+def process_item(ctx: ItemContext, item: Dict) -> Dict[str, Any]:
+    """
+    Processa um item do batch e devolve um resumo (serializável entre processos).
+    Com ctx.defer_gpt, itens que precisam de GPT voltam com `pending`
+    (texto + resultado parcial) e a saída só é escrita em finish_gpt_item.
+    """
+    extractor = ctx.extractor
+    file_start = time.time()
+    before = extractor.pattern_counts()
+    summary = {
+        "pdf_path": "",
+        "fname": "",
+        "ok": False,
+        "error": None,
+        "filled": 0,
+        "total": 0,
+        "duration_ms": 0.0,
+        "patterns": {},
+        "metadata": {},
+        "output": None,
+        "typed": None,
+        "pending": None,
+        "sha256": None,
+        "skipped": False,
+        "metrics": {},
+        "dedup": [],
+    }
+
+    try:
+        invalid = validate_item(item)
+        if invalid:
+            summary["pdf_path"] = str(item.get("pdf_path", "")) if isinstance(item, dict) else ""
+            summary["fname"] = Path(summary["pdf_path"]).name or "(item inválido)"
+            summary["error"] = invalid
+            return summary
+        summary["pdf_path"] = item["pdf_path"]
+        summary["fname"] = Path(item["pdf_path"]).name
+        summary["total"] = len(item["extraction_schema"])
+        if item.get("_error"):
+            summary["error"] = item["_error"]
+            return summary
+
+        pdf_path = resolve_pdf_path(ctx.files_dir, item["pdf_path"])
+        if pdf_path is None:
+            summary["error"] = "pdf_path fora de files_dir"
+            return summary
+
+        # --resume: pula itens já concluídos cujo conteúdo não mudou (só hasheia os que estão no journal)
+        sha = None
+        if ctx.resume_index and item["pdf_path"] in ctx.resume_index:
+            sha = file_sha256(pdf_path)
+            if ctx.resume_index[item["pdf_path"]] == sha:
+                summary["skipped"] = True
+                return summary
+
+        track_rss = ctx.low_memory and reset_peak_rss()
+        with extractor.metrics.timer("pdf"):
+            pdf = read_pdf_pages(pdf_path, ctx.logger, ctx.text_cache, lazy=ctx.lazy_pages,
+                                 low_memory=ctx.low_memory, sha=sha)
+        summary["sha256"] = pdf.sha256
+
+        if ctx.text_cache:
+            summary["metadata"]["text_cache"] = "hit" if pdf.cache_hit else "miss"
+
+        if pdf.pages is None:
+            summary["error"] = "read"
+            return summary
+
+        schema = item["extraction_schema"]
+        pages = pdf.pages
+        budget = None
+        if ctx.max_text_chars:
+            pages = budget = PageBudget(pages, ctx.max_text_chars)
+
+        fingerprint = None
+        if ctx.dedup:
+            scope = DedupIndex.scope(item["label"], schema)
+            if ctx.dedup.exact_only:
+                # PDF idêntico: a chave é o sha256 do arquivo, sem ler página nenhuma
+                full_text = ""
+                fingerprint = DocFingerprint(pdf.sha256, [])
+                with extractor.metrics.timer("dedup"):
+                    match = ctx.dedup.lookup(scope, fingerprint, full_text)
+            else:
+                # Quase idênticos: a impressão digital precisa do documento inteiro
+                with extractor.metrics.timer("pdf"):
+                    pages = list(pages)
+                with extractor.metrics.timer("dedup"):
+                    full_text = "\n".join(pages)
+                    fingerprint = ctx.dedup.fingerprint(pages)
+                    match = ctx.dedup.lookup(scope, fingerprint, full_text) if full_text else None
+
+            if match:
+                entry, similarity = match
+                result = {f: entry["values"].get(f) for f in schema}
+                # Resultado de uma execução sem GPT não impede o fallback agora
+                if entry.get("gpt") or not extractor.router.route(result, schema, item["label"], len(full_text), record=False):
+                    result["_sources"] = {f: "dedup" if v is not None else None for f, v in result.items()}
+                    summary["metadata"]["dedup"] = {"of": entry["pdf_path"], "similarity": round(similarity, 3)}
+                    if track_rss:
+                        record_peak_rss(extractor, summary)
+                    if hasattr(pdf.pages, "close"):
+                        pdf.pages.close()
+                    emit_item_output(ctx, item, result, summary)
+                    return summary
+
+        extractor.current_pdf_path = pdf_path
+        try:
+            result, read = extractor.extract_pages(pages, schema, item["label"], use_gpt=not ctx.defer_gpt)
+        finally:
+            if hasattr(pdf.pages, "close"):
+                pdf.pages.close()
+
+        text = "\n".join(read)
+        if not text:
+            summary["error"] = "read"
+            return summary
+
+        if ctx.lazy_pages:
+            summary["metadata"]["pages_read"] = len(read)
+            summary["metadata"]["page_count"] = pdf.page_count
+        if budget and budget.truncated:
+            summary["metadata"]["truncated_chars"] = ctx.max_text_chars
+        if track_rss:
+            record_peak_rss(extractor, summary)
+
+        # Com o GPT adiado, quem decide (GPTRouter) é o processo que recebe as respostas
+        candidates = extractor.router.candidates(result, schema) if ctx.defer_gpt and extractor.gpt_enabled else []
+        if candidates:
+            summary["pending"] = {"item": item, "pages": read, "result": result, "fields": candidates,
+                                  "prompt_text": "", "fingerprint": fingerprint}
+            return summary
+
+        emit_item_output(ctx, item, result, summary)
+        if fingerprint:
+            summary["dedup"].append(ctx.dedup.add(scope, fingerprint, result, schema, item["pdf_path"],
+                                                  extractor.gpt_enabled))
+
+    except Exception as e:
+        summary["error"] = str(e)[:100]
+        ctx.logger.debug(traceback.format_exc())
+
+    finally:
+        summary["duration_ms"] = (time.time() - file_start) * 1000
+        summary["patterns"] = extractor.pattern_delta(before)
+        extractor.metrics.end_doc()
+        summary["metrics"] = extractor.metrics.drain()
+
+    return summary
+
+def route_pending(extractor: ExtractorV2, summary: Dict[str, Any]) -> List[str]:
+    """
+    Roteamento de um item com GPT adiado; [] = finalizar sem GPT (finish_gpt_item
+    com response=None). O contexto do prompt é montado só para os campos roteados.
+    """
+    pending = summary["pending"]
+    item = pending["item"]
+    pages = pending["pages"]
+    schema = item["extraction_schema"]
+    text_chars = sum(len(p) for p in pages) + max(0, len(pages) - 1)
+    fields = extractor.router.route(pending["result"], schema, item["label"], text_chars)
+    if fields:
+        pending["prompt_text"] = extractor.gpt_prompt_text(pages, fields, schema)
+    pending["fields"] = fields
+    pending["submitted_at"] = time.time()
+    return fields
+
+def finish_gpt_item(ctx: ItemContext, summary: Dict[str, Any],
+                    response: Optional[Tuple[Optional[str], bool]]) -> Dict[str, Any]:
+    """Aplica a resposta do GPT assíncrono (None: roteamento dispensou o GPT) a um item pendente e escreve a saída"""
+    pending = summary.pop("pending")
+    item = pending["item"]
+    before = ctx.extractor.pattern_counts()
+    if response is not None:
+        # Falha ao aplicar a resposta do GPT: o documento sai só com o resultado do regex
+        try:
+            content, cached = response
+            gpt_result = ctx.extractor._parse_gpt_content(content, "\n".join(pending["pages"]), pending["fields"])
+            ctx.extractor.apply_gpt(pending["result"], gpt_result, "gpt_cache" if cached else "gpt", pending["fields"])
+            if content is not None:
+                ctx.extractor.router.observe(item["label"], pending["fields"], gpt_result)
+        except Exception as e:
+            ctx.logger.warning(f"Resposta do GPT ignorada em {summary['fname']}: {type(e).__name__}: {str(e)[:100]}")
+            ctx.logger.debug(traceback.format_exc())
+    try:
+        emit_item_output(ctx, item, pending["result"], summary)
+        if ctx.dedup and pending["fingerprint"]:
+            schema = item["extraction_schema"]
+            ctx.dedup.add(DedupIndex.scope(item["label"], schema), DocFingerprint(*pending["fingerprint"]),
+                          pending["result"], schema, item["pdf_path"], True)
+    except Exception as e:
+        summary["error"] = str(e)[:100]
+        ctx.logger.debug(traceback.format_exc())
+
+    # Padrões aprendidos com a resposta também entram no resumo (journal)
+    add_pattern_delta(summary["patterns"], ctx.extractor.pattern_delta(before))
+    ctx.extractor.metrics.end_doc()
+
+    summary["duration_ms"] += (time.time() - pending["submitted_at"]) * 1000
+    return summary
+
+def log_item_summary(logger: logging.Logger, summary: Dict[str, Any], level: int = logging.INFO):
+    """Linha por documento; `level` vale para os concluídos (falhas são sempre WARNING/ERROR)"""
+    fname = summary["fname"]
+    doc = {"pdf": summary["pdf_path"], "ok": summary["ok"], "filled": summary["filled"],
+           "total": summary["total"], "ms": round(summary["duration_ms"], 1), "error": summary["error"]}
+    if summary["skipped"]:
+        logger.debug("⏭️  %s: já concluído (journal)", fname, extra={"doc": doc})
+    elif summary["error"] == "read":
+        logger.warning("❌ Falha leitura: %s", fname, extra={"doc": doc})
+    elif summary["error"]:
+        logger.error("❌ Erro em %s: %s", fname, summary["error"], extra={"doc": doc})
+    # 🎨 Log colorido
+    elif logger.isEnabledFor(level):
+        mark = "✅" if summary["filled"] == summary["total"] else "⚠️ "
+        logger.log(level, "%s %s: %d/%d (%.0fms)", mark, fname, summary["filled"], summary["total"],
+                   summary["duration_ms"], extra={"doc": doc})
+
+class ItemLogSampler:
+    """
+    Log por documento em batches grandes: só 1 a cada `every` documentos
+    concluídos sai em INFO (os demais em DEBUG), e a cada `every` documentos
+    sai uma linha agregada. Falhas são sempre logadas.
+    """
+
+    def __init__(self, logger: logging.Logger, every: int, total: int):
+        self.logger = logger
+        self.every = every if every > 0 else (1 if total <= 1000 else 100)
+        self.total = total
+        self.seen = 0
+        self.ok = 0
+        self.failed = 0
+        self.start = time.time()
+
+    def log(self, summary: Dict[str, Any]):
+        self.seen += 1
+        if summary["ok"]:
+            self.ok += 1
+        elif not summary["skipped"]:
+            self.failed += 1
+        sampled = self.every == 1 or self.seen % self.every == 1
+        log_item_summary(self.logger, summary, logging.INFO if sampled else logging.DEBUG)
+
+        if self.every > 1 and (self.seen % self.every == 0 or self.seen == self.total):
+            elapsed = time.time() - self.start
+            self.logger.info("📊 %d/%d documentos: %d ok, %d falhas (%.1f docs/s)", self.seen, self.total,
+                             self.ok, self.failed, self.seen / elapsed if elapsed else 0.0)
+
+# ===== PIPELINE =====
+# --pipeline: etapas sobrepostas com filas limitadas entre elas
+#   leitura (threads: stat + prefetch no page cache, maiores primeiro)
+#   -> parse + regex (processo principal ou --workers processos)
+#   -> GPT (AsyncGPTStage, --gpt-concurrency)
+#   -> escrita (thread do OutputSink)
+# O throughput passa a ser o da etapa mais lenta, não a soma delas.
+
+def prefetch_file(path: str):
+    """Traz o PDF para o page cache do SO antes do parse (sem copiá-lo para o processo quando há fadvise)"""
+    try:
+        with open(path, "rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                buf = bytearray(1 << 20)
+                while f.readinto(buf):
+                    pass
+    except OSError:
+        pass
+
+def item_file(files_dir: str, item: Dict) -> Tuple[Optional[str], int]:
+    """
+    (caminho, tamanho) do PDF do item, confinado a files_dir como no parse;
+    (None, 0) para item inválido, com erro, fora de files_dir ou sem arquivo
+    (a falha fica para process_item, só daquele item).
+    """
+    if validate_item(item) or item.get("_error"):
+        return None, 0
+    path = resolve_pdf_path(files_dir, item["pdf_path"])
+    if path is None:
+        return None, 0
+    try:
+        return path, os.stat(path).st_size
+    except OSError:
+        return None, 0
+
+def schedule_largest_first(items: Iterable[Dict], files_dir: str, lookahead: int, read_pool) -> Iterator[Dict]:
+    """
+    Etapa de leitura: a cada janela de `lookahead` itens, tamanhos via stat no
+    pool de leitura, maiores primeiro (sem retardatários grandes no fim do
+    batch) e prefetch dos arquivos. A janela seguinte é preparada antes de a
+    atual ser entregue, para o prefetch correr enquanto ela é processada.
+    """
+    def prepare(window: List[Dict]) -> List[Dict]:
+        files = list(read_pool.map(lambda item: item_file(files_dir, item), window))
+        ordered = sorted(zip(files, window), key=lambda p: p[0][1], reverse=True)
+        for (path, _), _ in ordered:
+            if path:
+                read_pool.submit(prefetch_file, path)
+        return [item for _, item in ordered]
+
+    windows = iter_chunks(items, lookahead)
+    current = prepare(next(windows, []))
+    for window in windows:
+        upcoming = prepare(window)
+        yield from current
+        current = upcoming
+    yield from current
+
+class SinkThread(OutputSink):
+    """Etapa de escrita: o OutputSink roda numa thread, atrás de uma fila de até `maxsize` saídas"""
+
+    def __init__(self, sink: OutputSink, maxsize: int):
+        super().__init__()
+        self.durable = sink.durable
+        self.sink = sink
+        self.queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, name="write", daemon=True)
+        self.thread.start()
+
+    def write(self, output: Dict[str, Any]):
+        if self.error:
+            raise self.error
+        self.queue.put(output)
+
+    def _run(self):
+        while True:
+            output = self.queue.get()
+            if output is None:
+                return
+            if self.error:
+                continue  # só esvazia a fila; o erro sobe no próximo write/close
+            try:
+                self.sink.write(output)
+            except BaseException as e:
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.sink.close()
+        if self.error:
+            raise self.error
+
+# ===== WORKERS =====
+
+# Contexto de cada processo do pool: um extractor próprio por worker
+_worker_ctx: Optional[ItemContext] = None
+
+def _init_worker(config: Config, files_dir: str, output_dir: str, defer_gpt: bool, collect_output: bool,
+                 resume_index: Dict[str, str], patterns: PatternDelta):
+    global _worker_ctx
+    # Workers só escrevem no arquivo de log; o console fica com o processo principal
+    logger = setup_logger(replace(config, log_to_console=False))
+    if config.gpt_token_budget and not defer_gpt:
+        # GPT síncrono nos workers: cada processo decide com a sua fatia do orçamento
+        config = replace(config, gpt_token_budget=max(1, config.gpt_token_budget // config.workers))
+    extractor = ExtractorV2(config, logger)
+    extractor.merge_patterns(patterns)
+    _worker_ctx = ItemContext(
+        extractor=extractor,
+        logger=logger,
+        files_dir=files_dir,
+        output_dir=output_dir,
+        defer_gpt=defer_gpt,
+        text_cache=make_text_cache(config, logger),
+        collect_output=collect_output,
+        resume_index=resume_index,
+        lazy_pages=config.lazy_pages,
+        dedup=make_dedup_index(config, logger),
+        low_memory=config.low_memory,
+        max_text_chars=config.max_text_chars if config.low_memory else 0,
+        typed_rows=bool(config.typed_output),
+    )
+
+def _worker_process_chunk(items: List[Dict]) -> List[Dict[str, Any]]:
+    return [process_item(_worker_ctx, item) for item in items]
+
+# ===== SERVIÇO =====
+
+class ExtractionService:
+    """
+    Modo residente: um ExtractorV2 aquecido (padrões do store, cliente OpenAI,
+    caches abertos) atende documentos de uma fila limitada. Uma única thread
+    extrai (o extractor não é thread-safe); com --async-gpt o fallback fica em
+    voo e a thread segue para o próximo documento. Fila cheia = backpressure:
+    o HTTP responde 503 e o watcher espera vaga.
+    """
+
+    SAVE_EVERY = 100  # documentos entre gravações do store de padrões/dedup
+
+    def __init__(self, config: Config, files_dir: str, output_dir: str, logger: logging.Logger):
+        self.config = config
+        self.logger = logger
+        self.extractor = ExtractorV2(config, logger)
+        self.metrics = StageMetrics()
+
+        self.store = PatternStore(config.pattern_store_path, logger) if config.pattern_store else None
+        if self.store:
+            self.extractor.merge_patterns(self.store.load())
+        self.store_baseline = self.extractor.pattern_counts()
+
+        self.gpt_stage = AsyncGPTStage(self.extractor, config, logger) if config.gpt_async and self.extractor.gpt_enabled else None
+        self.ctx = ItemContext(self.extractor, logger, files_dir, output_dir,
+                               defer_gpt=self.gpt_stage is not None,
+                               text_cache=make_text_cache(config, logger),
+                               collect_output=True,
+                               lazy_pages=config.lazy_pages,
+                               dedup=make_dedup_index(config, logger),
+                               low_memory=config.low_memory,
+                               max_text_chars=config.max_text_chars if config.low_memory else 0)
+        self.max_in_flight = max(1, config.gpt_concurrency) * max(1, config.gpt_batch_size) * 4
+
+        self.queue: "queue.Queue[Tuple[Dict, Future]]" = queue.Queue(maxsize=max(1, config.serve_queue_size))
+        self.put_lock = threading.Lock()
+        self.completions: "queue.SimpleQueue[Tuple[Dict[str, Any], Future, Future]]" = queue.SimpleQueue()
+        self.in_flight = 0
+        self.processed = 0
+        self.rejected = 0
+        self.started_at = time.time()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="extractor", daemon=True)
+        self.thread.start()
+
+    def submit(self, items: List[Dict]) -> List[Future]:
+        """Enfileira tudo ou nada; queue.Full se não houver vaga para o pedido inteiro"""
+        if len(items) > self.queue.maxsize:
+            raise ValueError(f"pedido com {len(items)} documentos; fila comporta {self.queue.maxsize}")
+        if self.stopping.is_set():
+            raise queue.Full
+        futures = [Future() for _ in items]
+        with self.put_lock:
+            if self.queue.maxsize - self.queue.qsize() < len(items):
+                self.rejected += 1
+                raise queue.Full
+            for item, fut in zip(items, futures):
+                self.queue.put_nowait((item, fut))
+        return futures
+
+    def submit_wait(self, item: Dict, poll_s: float = 0.05) -> Optional[Future]:
+        """Enfileira esperando vaga (watcher); None se o serviço estiver parando"""
+        while not self.stopping.is_set():
+            try:
+                return self.submit([item])[0]
+            except queue.Full:
+                time.sleep(poll_s)
+        return None
+
+    def _run(self):
+        while not (self.stopping.is_set() and self.queue.empty() and not self.in_flight):
+            # Respostas do GPT: parse e aprendizado de padrões nesta thread
+            while True:
+                try:
+                    self._finish_gpt(*self.completions.get_nowait())
+                except queue.Empty:
+                    break
+            if self.in_flight >= self.max_in_flight:
+                self._finish_gpt(*self.completions.get())
+                continue
+
+            try:
+                item, fut = self.queue.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if not fut.set_running_or_notify_cancel():
+                continue
+
+            # Um item com problema falha só o próprio future; a thread segue com a fila
+            try:
+                self._process(item, fut)
+            except Exception as e:
+                self._fail(fut, e)
+
+    def _process(self, item: Dict, fut: Future):
+        summary = process_item(self.ctx, item)
+        if summary["pending"]:
+            fields = route_pending(self.extractor, summary)
+            if not fields:
+                self._done(finish_gpt_item(self.ctx, summary, None), fut)
+                return
+            gpt_fut = self.gpt_stage.submit(item["label"], fields, summary["pending"]["prompt_text"])
+            gpt_fut.add_done_callback(lambda f, s=summary, j=fut: self.completions.put((s, j, f)))
+            self.in_flight += 1
+        else:
+            self._done(summary, fut)
+
+    def _finish_gpt(self, summary: Dict[str, Any], fut: Future, gpt_fut: Future):
+        self.in_flight -= 1
+        try:
+            try:
+                response = gpt_fut.result()
+            except Exception as e:
+                summary.pop("pending")
+                summary["error"] = str(e)[:100]
+            else:
+                summary = finish_gpt_item(self.ctx, summary, response)
+            self._done(summary, fut)
+        except Exception as e:
+            self._fail(fut, e)
+
+    def _fail(self, fut: Future, error: Exception):
+        self.logger.error(f"❌ Erro no serviço: {type(error).__name__}: {str(error)[:100]}")
+        self.logger.debug(traceback.format_exc())
+        self.metrics.inc("failed")
+        if not fut.done():
+            fut.set_exception(error)
+
+    def _done(self, summary: Dict[str, Any], fut: Future):
+        self.metrics.merge(summary.pop("metrics"))
+        self.metrics.merge(self.extractor.metrics.drain())
+        log_item_summary(self.logger, summary)
+        if summary["ok"]:
+            self.metrics.inc("ok")
+            self.metrics.observe("total", summary["duration_ms"])
+        else:
+            self.metrics.inc("failed")
+
+        self.processed += 1
+        if self.processed % self.SAVE_EVERY == 0:
+            self.save()
+        fut.set_result(summary)
+
+    def save(self):
+        if self.store:
+            self.store.save(self.extractor.pattern_delta(self.store_baseline))
+            self.store_baseline = self.extractor.pattern_counts()
+        if self.ctx.dedup:
+            self.ctx.dedup.save()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "status": "stopping" if self.stopping.is_set() else "ok",
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "gpt_in_flight": self.in_flight,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "patterns": len(self.extractor.global_patterns),
+        }
+
+    def close(self, timeout: Optional[float] = None):
+        """Para de aceitar pedidos, termina a fila e grava store, dedup e métricas"""
+        self.stopping.set()
+        if self.gpt_stage:
+            self.gpt_stage.flush()
+        self.thread.join(timeout)
+        if self.gpt_stage:
+            self.gpt_stage.close()
+        self.save()
+
+        report = {"mode": "serve", "uptime_s": round(time.time() - self.started_at, 3),
+                  "processed": self.processed, "rejected": self.rejected, **self.metrics.report()}
+        metrics_file = self.config.metrics_file or metrics_path(self.ctx.output_dir)
+        with open(metrics_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.logger.info(f"Métricas: {metrics_file}")
+
+def item_response(item: Dict, fut: Future) -> Dict[str, Any]:
+    if fut.exception():
+        return {"_metadata": {"pdf_path": item["pdf_path"], "error": str(fut.exception())[:100]}}
+    summary = fut.result()
+    if summary["ok"]:
+        return summary["output"]
+    return {"_metadata": {"pdf_path": summary["pdf_path"], "error": summary["error"],
+                          "duration_ms": round(summary["duration_ms"], 1)}}
+
+def serve_http(service: ExtractionService, port: int, logger: logging.Logger,
+               host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+    """
+    POST /extract  item do batch ({label, extraction_schema, pdf_path}) ou lista de itens;
+                   pdf_path relativo a files_dir (fora dela: 400)
+    GET  /health   estado da fila
+    GET  /metrics  formato Prometheus
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    timeout = service.config.serve_timeout_s
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Any, content_type: str = "application/json",
+                  headers: Optional[Dict[str, str]] = None):
+            data = (body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/health":
+                self._send(200, service.status())
+            elif path == "/metrics":
+                self._send(200, service.metrics.prometheus(), "text/plain; version=0.0.4")
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/extract":
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            except Exception as e:
+                self._send(400, {"error": f"JSON inválido: {e}"})
+                return
+
+            items = body if isinstance(body, list) else [body]
+            if not items:
+                self._send(400, {"error": "pedido vazio"})
+                return
+            invalid = [validate_item(i) for i in items]
+            if any(invalid):
+                self._send(400, {"error": "esperado item (ou lista) com label e pdf_path (texto) e "
+                                          "extraction_schema (objeto)",
+                                 "items": [{"index": n, "error": e} for n, e in enumerate(invalid) if e]})
+                return
+            files_dir = service.ctx.files_dir
+            outside = [i["pdf_path"] for i in items if resolve_pdf_path(files_dir, i["pdf_path"]) is None]
+            if outside:
+                self._send(400, {"error": "pdf_path fora de files_dir", "pdf_path": outside})
+                return
+
+            try:
+                futures = service.submit(items)
+            except ValueError as e:
+                self._send(413, {"error": str(e)})
+                return
+            except queue.Full:
+                self._send(503, {"error": "fila cheia", **service.status()}, headers={"Retry-After": "1"})
+                return
+
+            done, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                self._send(504, {"error": f"sem resposta em {timeout:.0f}s"})
+                return
+            results = [item_response(i, f) for i, f in zip(items, futures)]
+            self._send(200, results if isinstance(body, list) else results[0])
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 128  # conexões pendentes; o limite real é a fila do serviço
+
+    server = Server((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="serve-http", daemon=True).start()
+    logger.info(f"🌐 POST http://{host}:{port}/extract  (GET /health, /metrics)")
+    return server
+
+def watch_intake(service: ExtractionService, watch_dir: str, interval_s: float, logger: logging.Logger):
+    """
+    Batches (.json/.jsonl) colocados em `watch_dir` entram na fila; as saídas
+    vão para a pasta de saída (um JSON por documento) e o batch é movido para
+    `watch_dir/processados/`. Batches ilegíveis ou com itens inválidos vão
+    para `watch_dir/failed/` sem processar nada. Copie para a pasta com um
+    nome temporário e renomeie no fim, para o watcher não ler um arquivo pela
+    metade.
+    """
+    done_dir = os.path.join(watch_dir, "processados")
+    failed_dir = os.path.join(watch_dir, "failed")
+    os.makedirs(done_dir, exist_ok=True)
+    os.makedirs(failed_dir, exist_ok=True)
+    logger.info(f"👀 Observando {watch_dir}")
+
+    while not service.stopping.is_set():
+        batches = sorted(p for p in Path(watch_dir).iterdir() if p.suffix in (".json", ".jsonl") and p.is_file())
+        for path in batches:
+            try:
+                total, items = open_batch(str(path))
+                items = list(items)
+            except Exception as e:
+                logger.error(f"❌ Batch ilegível {path.name}: {e}")
+                os.replace(path, os.path.join(failed_dir, path.name))
+                continue
+            invalid = next(((n, e) for n, e in enumerate(map(validate_item, items), 1) if e), None)
+            if invalid:
+                logger.error(f"❌ Batch inválido {path.name}: item {invalid[0]}: {invalid[1]}")
+                os.replace(path, os.path.join(failed_dir, path.name))
+                continue
+
+            logger.info(f"📥 {path.name}: {total} documentos")
+            futures = []
+            for item in items:
+                fut = service.submit_wait(item)
+                if fut is None:
+                    return  # serviço parando: o batch fica para a próxima execução
+                futures.append(fut)
+
+            for fut in futures:
+                if fut.exception():
+                    continue  # já registrado pelo serviço
+                summary = fut.result()
+                if summary["output"]:
+                    write_start = time.perf_counter()
+                    write_json_output(summary["output"], service.ctx.output_dir)
+                    service.metrics.observe("write", (time.perf_counter() - write_start) * 1000)
+            os.replace(path, os.path.join(done_dir, path.name))
+
+        service.stopping.wait(interval_s)
+
+def serve(files_dir: str, output_dir: str, config: Config):
+    logger = setup_logger(config)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if not config.quiet:
+        from rich.panel import Panel
+        get_console().print(Panel(
+            "[bold cyan]🛰️  SERVIÇO DE EXTRAÇÃO[/bold cyan]",
+            expand=False,
+            border_style="cyan"
+        ))
+
+    service = ExtractionService(config, files_dir, output_dir, logger)
+    server = watcher = None
+    # SIGTERM (ex: systemd/docker) encerra como Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: service.stopping.set())
+    try:
+        if config.serve_port:
+            server = serve_http(service, config.serve_port, logger, config.serve_host)
+        if config.watch_dir:
+            watcher = threading.Thread(target=watch_intake, name="watch",
+                                       args=(service, config.watch_dir, config.watch_interval_s, logger), daemon=True)
+            watcher.start()
+        logger.info(f"Fila: até {service.queue.maxsize} documentos; Ctrl+C encerra")
+
+        while not service.stopping.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("⏹️  Encerrando: terminando a fila...")
+        if server:
+            server.shutdown()
+            server.server_close()
+        service.close()
+        if watcher:
+            watcher.join(config.watch_interval_s + 1)
+        stop_logging()
+
+# ===== MAIN =====
+
+def process_batch(batch_file: str, files_dir: str, output_dir: str, config: Config):
+    if config.pipeline:
+        # Etapa de GPT do pipeline = GPT assíncrono
+        config = replace(config, gpt_async=True)
+    logger = setup_logger(config)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 🎨 Panel com título
+    if not config.quiet:
+        from rich.panel import Panel
+        get_console().print(Panel(
+            "[bold cyan]🚀 EXTRAÇÃO EM BATCH[/bold cyan]",
+            expand=False,
+            border_style="cyan"
+        ))
+
+    try:
+        total_files, batch = open_batch(batch_file)
+    except Exception as e:
+        if config.quiet:
+            print(f"Erro ao ler {batch_file}: {e}", file=sys.stderr)
+        else:
+            get_console().print(f"[bold red]❌ Erro ao ler batch.json: {e}[/bold red]")
+        return
+
+    extractor = ExtractorV2(config, logger)
+    metrics = StageMetrics()
+    metrics_server = (serve_metrics(metrics, config.metrics_port, logger, config.metrics_host)
+                      if config.metrics_port else None)
+    successful = 0
+    failed = 0
+    skipped = 0
+    cache_hits = 0
+
+    # Padrões: store persistido (execuções anteriores) + journal (execução interrompida)
+    store = PatternStore(config.pattern_store_path, logger) if config.pattern_store else None
+    if store:
+        extractor.merge_patterns(store.load())
+    store_baseline = extractor.pattern_counts()
+
+    journal = CheckpointJournal(journal_path(output_dir), config.resume, logger)
+    extractor.merge_patterns(journal.patterns)
+
+    logger.info(f"Total de arquivos: {total_files}")
+    if config.workers > 1:
+        logger.info(f"⚙️  Workers: {config.workers}")
+    if config.pipeline:
+        logger.info(f"🔀 Pipeline: {config.read_threads} threads de leitura, janela de {config.lookahead} "
+                    f"(maiores primeiro), {config.gpt_concurrency} requisições GPT, escrita em thread")
+
+    start_time = time.time()
+
+    # 🎨 Progress bar com Rich
+    if config.quiet:
+        progress_bar = NullProgress()
+    else:
+        from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
+        progress_bar = Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+            console=get_console()
+        )
+
+    with progress_bar as progress:
+        task = progress.add_task(f"Processando {total_files} arquivos...", total=total_files)
+
+        sink = make_output_sink(config, output_dir, journal.done)
+        # Pipeline com 1 processo: até o JSON por arquivo sai do caminho do parse (thread de escrita)
+        collect_output = not sink.in_worker or (config.pipeline and config.workers == 1)
+        if config.pipeline and collect_output:
+            sink = SinkThread(sink, config.lookahead)
+        typed = TypedColumnWriter(output_dir, config.typed_output, config.row_group_size,
+                                  config.resume, logger, journal.done) if config.typed_output else None
+        item_log = ItemLogSampler(logger, config.log_sample, total_files)
+        # pdf_path -> resumos concluídos esperando a saída (e a linha tipada) irem para o disco
+        unsaved: Dict[str, deque] = {}
+
+        def confirm(path: str, part: str):
+            waiting = unsaved.get(path)
+            if not waiting:
+                return
+            for entry in waiting:
+                if part in entry["waiting"]:
+                    entry["waiting"].discard(part)
+                    break
+            while waiting and not waiting[0]["waiting"]:
+                journal.record(waiting.popleft()["summary"])
+            if not waiting:
+                del unsaved[path]
+
+        def commit_written():
+            for path in sink.written():
+                confirm(path, "output")
+            for path in typed.written() if typed else ():
+                confirm(path, "typed")
+
+        def record(summary: Dict[str, Any]):
+            nonlocal successful, failed, skipped, cache_hits
+            buffered = bool(summary["output"])
+            if buffered:
+                write_start = time.perf_counter()
+                sink.write(summary.pop("output"))
+                metrics.observe("write", (time.perf_counter() - write_start) * 1000)
+            typed_row = bool(typed and summary["typed"])
+            if typed_row:
+                label, values = summary.pop("typed")
+                typed.add(label, summary["pdf_path"], values)
+            metrics.merge(summary.pop("metrics"))
+            item_log.log(summary)
+            if summary["metadata"].get("text_cache") == "hit":
+                cache_hits += 1
+            if summary["skipped"]:
+                skipped += 1
+                metrics.inc("skipped")
+            elif summary["ok"]:
+                successful += 1
+                metrics.inc("ok")
+                metrics.observe("total", summary["duration_ms"])
+                # Saída gravada pelo worker (sem buffer) e sem linha tipada: já pode ir para o journal
+                waiting = {"output"} if buffered else set()
+                if typed_row:
+                    waiting.add("typed")
+                if waiting:
+                    entry = {k: summary[k] for k in ("pdf_path", "sha256", "patterns")}
+                    unsaved.setdefault(summary["pdf_path"], deque()).append({"summary": entry, "waiting": waiting})
+                else:
+                    journal.record(summary)
+            else:
                 failed += 1
-                progress.update(task, advance=1)
+                metrics.inc("failed")
+            if buffered or typed_row:
+                commit_written()
+            progress.update(task, advance=1)
+
+        # GPT assíncrono: itens com fallback ficam em voo enquanto o regex segue
+        gpt_stage = AsyncGPTStage(extractor, config, logger) if config.gpt_async and extractor.gpt_enabled else None
+        defer_gpt = gpt_stage is not None
+        in_flight: Dict[Future, Dict[str, Any]] = {}
+        ctx = ItemContext(extractor, logger, files_dir, output_dir, defer_gpt,
+                          text_cache=make_text_cache(config, logger) if config.workers == 1 else None,
+                          collect_output=collect_output,
+                          resume_index=journal.done,
+                          lazy_pages=config.lazy_pages,
+                          dedup=make_dedup_index(config, logger),
+                          low_memory=config.low_memory,
+                          max_text_chars=config.max_text_chars if config.low_memory else 0,
+                          typed_rows=typed is not None)
+        max_in_flight = max(1, config.gpt_concurrency) * max(1, config.gpt_batch_size) * 4
+
+        def finish(futures):
+            for fut in futures:
+                record(finish_gpt_item(ctx, in_flight.pop(fut), fut.result()))
+
+        read_pool = None
+        if config.pipeline:
+            from concurrent.futures import ThreadPoolExecutor
+            read_pool = ThreadPoolExecutor(max(1, config.read_threads), thread_name_prefix="read")
+            batch = schedule_largest_first(batch, files_dir, max(1, config.lookahead), read_pool)
+
+        pool = None
+        if config.workers > 1:
+            chunksize = max(1, min(64, total_files // (config.workers * 4)))
+            # --low-memory: processos renovados a cada worker_max_docs documentos
+            max_docs = config.worker_max_docs if config.low_memory else 0
+            if max_docs:
+                chunksize = min(chunksize, max_docs)
+            if config.pipeline:
+                # Chunks pequenos espalham os maiores documentos da janela entre os workers
+                chunksize = min(chunksize, max(1, config.lookahead // (config.workers * 2)))
+            pool = RecyclingPool(
+                config.workers, max_docs, _init_worker,
+                lambda: (config, files_dir, output_dir, defer_gpt, collect_output,
+                         journal.done, extractor.pattern_delta({})),
+            )
+            # Resultados voltam na ordem do batch, com no máximo 4 chunks por worker em voo
+            summaries = bounded_map(pool, _worker_process_chunk, iter_chunks(batch, chunksize), config.workers * 4)
+        else:
+            summaries = (process_item(ctx, item) for item in batch)
+
+        try:
+            for summary in summaries:
+                # Padrões aprendidos nos workers voltam para o extractor principal
+                if pool:
+                    extractor.merge_patterns(summary["patterns"])
+                    if ctx.dedup:
+                        ctx.dedup.merge(summary["dedup"])
+
+                if summary["pending"] and route_pending(extractor, summary):
+                    pending = summary["pending"]
+                    in_flight[gpt_stage.submit(pending["item"]["label"], pending["fields"], pending["prompt_text"])] = summary
+                elif summary["pending"]:
+                    record(finish_gpt_item(ctx, summary, None))
+                else:
+                    record(summary)
+
+                # Backpressure: limita quantos documentos esperam resposta do GPT
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    finish(done)
+                else:
+                    finish([f for f in in_flight if f.done()])
+
+            if gpt_stage:
+                gpt_stage.flush()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                finish(done)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+            if read_pool:
+                read_pool.shutdown(cancel_futures=True)
+            if gpt_stage:
+                gpt_stage.close()
+            sink.close()
+            if typed:
+                typed.close()
+            commit_written()
+            if store:
+                store.save(extractor.pattern_delta(store_baseline))
+                journal.mark_store_saved()
+            if ctx.dedup:
+                ctx.dedup.save()
+            journal.close()
+
+            # Medições do processo principal (GPT assíncrono, saídas após o GPT)
+            metrics.merge(extractor.metrics.drain())
+            if metrics_server:
+                metrics_server.shutdown()
+                metrics_server.server_close()
 
     total_time = time.time() - start_time
 
+    report = {"batch": batch_file, "total_files": total_files, "total_time_s": round(total_time, 3),
+              "workers": config.workers, **metrics.report()}
+    if typed:
+        report["typed_columns"] = typed.report()
+    metrics_file = config.metrics_file or metrics_path(output_dir)
+    with open(metrics_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    flush_logging()
+    if not config.quiet:
+        print_batch_tables(config, extractor, report, successful, failed, skipped, cache_hits)
+    elif config.log_to_console:
+        print(f"sucesso={successful} falha={failed} concluidos={skipped} tempo={total_time:.2f}s", file=sys.stderr)
+
+    if report["gpt_usage"]:
+        usage = report["gpt_usage"]
+        logger.info(f"🤖 GPT: {usage['requests']} requisições, {usage['prompt_tokens']} + "
+                    f"{usage['completion_tokens']} tokens (prompt + resposta)")
+
+    logger.info(f"Métricas: {metrics_file}")
+    logger.info(f"Log completo: {config.log_file}")
+    stop_logging()
+
+def print_batch_tables(config: Config, extractor: ExtractorV2, report: Dict[str, Any],
+                       successful: int, failed: int, skipped: int, cache_hits: int):
+    from rich.table import Table
+    console = get_console()
+
     # 🎨 Tabela de resumo com Rich
     summary_table = Table(title="📊 RESUMO DA EXTRAÇÃO", expand=False)
     summary_table.add_column("Métrica", style="cyan")
@@ -551,8 +4023,12 @@ def process_batch(batch_file: str, files_dir: str, output_dir: str, config: Conf
 
     summary_table.add_row("✅ Sucesso", str(successful))
     summary_table.add_row("❌ Falha", str(failed))
-    summary_table.add_row("⏱️  Tempo Total", f"{total_time:.1f}s")
-    summary_table.add_row("📈 Taxa Sucesso", f"{100*successful/total_files:.1f}%")
+    if config.resume:
+        summary_table.add_row("⏭️  Já Concluídos", str(skipped))
+    summary_table.add_row("⏱️  Tempo Total", f"{report['total_time_s']:.1f}s")
+    summary_table.add_row("📈 Taxa Sucesso", f"{100*(successful + skipped)/report['total_files']:.1f}%")
+    if config.text_cache:
+        summary_table.add_row("💾 Cache de Texto", f"{cache_hits}/{report['total_files']}")
 
     console.print(summary_table)
 
@@ -562,24 +4038,246 @@ def process_batch(batch_file: str, files_dir: str, output_dir: str, config: Conf
         patterns_table.add_column("Campo", style="magenta")
         patterns_table.add_column("Padrão", style="yellow")
         patterns_table.add_column("Ocorrências", style="cyan")
+        patterns_table.add_column("Hits/Misses", style="cyan")
 
         for field, pattern_schema in sorted(extractor.global_patterns.items()):
             schema_dict = pattern_schema.to_dict()
             pattern_short = schema_dict['pattern'][:40] + "..." if len(schema_dict['pattern']) > 40 else schema_dict['pattern']
-            patterns_table.add_row(field, pattern_short, str(schema_dict['occurrences']))
+            patterns_table.add_row(field, pattern_short, str(schema_dict['occurrences']),
+                                   f"{schema_dict['hits']}/{schema_dict['misses']}")
 
         console.print(patterns_table)
 
-    logger.info(f"Log completo: {config.log_file}")
+    # ⏱️ Latência por etapa
+    if report["stages"]:
+        stages_table = Table(title="⏱️  LATÊNCIA POR ETAPA (ms/doc)", expand=False)
+        stages_table.add_column("Etapa", style="magenta")
+        stages_table.add_column("N", style="cyan", justify="right")
+        for col in ("p50", "p95", "p99"):
+            stages_table.add_column(col, style="green", justify="right")
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        console.print("[bold red]Uso:[/bold red] python cli.py batch.json [files_dir] [output_dir]")
-        sys.exit(1)
+        for stage, s in report["stages"].items():
+            stages_table.add_row(stage, str(s["count"]), f"{s['p50_ms']:.1f}", f"{s['p95_ms']:.1f}", f"{s['p99_ms']:.1f}")
 
-    batch = sys.argv[1]
-    files = sys.argv[2] if len(sys.argv) > 2 else "files"
-    out = sys.argv[3] if len(sys.argv) > 3 else "output"
+        console.print(stages_table)
 
-    config = Config()
-    process_batch(batch, files, out, config)
+    # 🧭 Decisões do roteamento GPT
+    routing = report["gpt_routing"]
+    if routing.get("fields"):
+        docs = ", ".join(f"{k}={n}" for k, n in routing["documents"].items())
+        routing_table = Table(title=f"🧭 ROTEAMENTO GPT ({config.gpt_routing}: {docs})", expand=False)
+        routing_table.add_column("Campo", style="magenta")
+        for col in ("Pedidos", "Reavaliados", "Preenchidos", "Pulados"):
+            routing_table.add_column(col, style="cyan", justify="right")
+
+        for name, f in routing["fields"].items():
+            routing_table.add_row(name, str(f.get("asked", 0)), str(f.get("verify", 0)),
+                                  str(f.get("filled", 0)), str(f.get("skipped", 0)))
+
+        console.print(routing_table)
+        budget = f" / {config.gpt_token_budget}" if config.gpt_token_budget else ""
+        console.print(f"[dim]Tokens estimados: {routing['estimated_tokens']}{budget}[/dim]")
+
+    # ✂️ Tamanho dos prompts enviados
+    prompts = report["gpt_prompts"]
+    if prompts:
+        limit = prompt_char_limit(config)
+        prompts_table = Table(title=f"✂️  PROMPTS GPT ({config.gpt_context}: até {limit} caracteres do documento)",
+                              expand=False)
+        prompts_table.add_column("Chamadas", style="cyan", justify="right")
+        for col in ("p50", "p95", "máx"):
+            prompts_table.add_column(f"{col} (chars)", style="green", justify="right")
+        prompts_table.add_column("Tokens estimados", style="yellow", justify="right")
+        prompts_table.add_row(str(prompts["calls"]), f"{prompts['p50_chars']:.0f}", f"{prompts['p95_chars']:.0f}",
+                              str(prompts["max_chars"]), str(prompts["estimated_tokens"]))
+        console.print(prompts_table)
+
+    # 🧾 Validação das colunas tipadas
+    typed = report.get("typed_columns")
+    if typed and typed["fields"]:
+        typed_table = Table(title=f"🧾 COLUNAS TIPADAS ({typed['format']}: {typed['dir']})", expand=False)
+        typed_table.add_column("Campo", style="magenta")
+        typed_table.add_column("Tipo", style="yellow")
+        typed_table.add_column("Válidos", style="green", justify="right")
+        typed_table.add_column("Inválidos", style="red", justify="right")
+
+        for name, f in typed["fields"].items():
+            if f["kind"] != "text":
+                typed_table.add_row(name, f["kind"], str(f["valid"]), str(f["invalid"]))
+
+        console.print(typed_table)
+
+def add_extraction_args(parser: argparse.ArgumentParser):
+    """Opções comuns ao batch e ao modo serviço"""
+    parser.add_argument("--async-gpt", action="store_true",
+                        help="fallback GPT assíncrono, sem bloquear os documentos resolvidos por regex")
+    parser.add_argument("--gpt-concurrency", type=int, default=Config.gpt_concurrency,
+                        help="máximo de requisições GPT simultâneas no modo assíncrono")
+    parser.add_argument("--gpt-rate-limit", type=float, default=Config.gpt_rate_limit,
+                        help="máximo de requisições GPT por segundo (0 = sem limite)")
+    parser.add_argument("--gpt-batch-size", type=int, default=Config.gpt_batch_size,
+                        help="agrupa até N documentos (mesmo label e campos) por requisição GPT no modo assíncrono")
+    parser.add_argument("--gpt-batch-wait-ms", type=float, default=Config.gpt_batch_wait_ms,
+                        help="espera máxima para completar um lote GPT (ms)")
+    parser.add_argument("--gpt-routing", choices=["threshold", "confidence"], default=Config.gpt_routing,
+                        help="threshold: todos os nulos quando >= 30%% do schema; confidence: só campos cujo ganho esperado compensa o custo")
+    parser.add_argument("--gpt-token-budget", type=int, default=Config.gpt_token_budget,
+                        help="tokens estimados para o GPT no batch; chamadas além disso são puladas (0 = sem limite)")
+    parser.add_argument("--gpt-min-field-gain", type=float, default=Config.gpt_min_field_gain,
+                        help="ganho esperado mínimo (0-1) para pedir um campo ao GPT no modo confidence")
+    parser.add_argument("--gpt-context", choices=["fields", "head"], default=Config.gpt_context,
+                        help="fields: só as linhas relevantes a cada campo nulo (descrições do schema); head: início do texto")
+    parser.add_argument("--gpt-context-tokens", type=int, default=Config.gpt_context_tokens,
+                        help="orçamento de tokens do documento no prompt no modo fields (~4 caracteres/token)")
+    parser.add_argument("--no-pattern-store", action="store_true",
+                        help="não carrega nem salva os padrões aprendidos entre execuções")
+    parser.add_argument("--no-text-cache", action="store_true",
+                        help="desativa o cache em disco do texto extraído dos PDFs")
+    parser.add_argument("--no-gpt-cache", action="store_true",
+                        help="desativa o cache local (SQLite) das respostas do GPT")
+    parser.add_argument("--no-lazy-pages", action="store_true",
+                        help="lê todas as páginas do PDF mesmo quando o regex já preencheu o schema")
+    parser.add_argument("--dedup", action="store_true",
+                        help="reaproveita resultados de PDFs idênticos já extraídos (mesmo label e schema)")
+    parser.add_argument("--dedup-similarity", type=float, default=Config.dedup_min_similarity,
+                        help="com --dedup: abaixo de 1, aceita documentos quase idênticos (Jaccard por MinHash); "
+                             "lê o documento inteiro")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="modo com memória limitada: texto por documento limitado, workers reciclados e pico de RSS por documento")
+    parser.add_argument("--max-text-chars", type=int, default=Config.max_text_chars,
+                        help="caracteres de texto lidos por documento no modo --low-memory")
+    parser.add_argument("--metrics-file", default=None,
+                        help="relatório JSON de latência/tokens/fontes (padrão: <output_dir>.metrics.json)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=Config.log_level,
+                        help="nível do log (arquivo; o console mostra no máximo INFO)")
+    parser.add_argument("--log-async", action="store_true",
+                        help="log assíncrono: console e arquivo gravados por uma thread, sem bloquear o processamento")
+    parser.add_argument("--log-format", choices=["text", "json"], default=Config.log_format,
+                        help="formato do arquivo de log: text ou json (uma linha JSON por registro)")
+    parser.add_argument("--log-sample", type=int, default=Config.log_sample,
+                        help="loga em INFO 1 a cada N documentos concluídos, com uma linha agregada a cada N "
+                             "(0 = automático: todos até 1.000 documentos, senão 1 a cada 100)")
+    parser.add_argument("--quiet", "-q", action="store_true",
+                        help="saída simples sem Rich (sem painel, barra ou tabelas): avisos/erros e uma linha de resumo no stderr")
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Extração estruturada de PDFs em batch",
+        usage="python cli.py batch.json [files_dir] [output_dir] [opções]\n       python cli.py serve [files_dir] [output_dir] [opções]",
+    )
+    parser.add_argument("batch", help="arquivo batch.json (ou .jsonl, lido em streaming) com schemas e caminhos")
+    parser.add_argument("files_dir", nargs="?", default="files", help="pasta dos PDFs (padrão: files)")
+    parser.add_argument("output_dir", nargs="?", default="output", help="pasta de saída (padrão: output)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processos paralelos para leitura + regex (padrão: 1)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="etapas sobrepostas com filas limitadas: leitura (threads, maiores primeiro) -> "
+                             "parse/regex (--workers) -> GPT assíncrono (--gpt-concurrency) -> escrita (thread)")
+    parser.add_argument("--read-threads", type=int, default=Config.read_threads,
+                        help="threads de leitura (stat + prefetch dos PDFs) no modo --pipeline")
+    parser.add_argument("--lookahead", type=int, default=Config.lookahead,
+                        help="janela do --pipeline: documentos ordenados por tamanho (maiores primeiro) e fila da escrita")
+    parser.add_argument("--output-format", choices=["json", "jsonl", "parquet"], default=Config.output_format,
+                        help="json: um arquivo por documento; jsonl: um único results.jsonl (acrescentado só com --resume); "
+                             "parquet: results/<label>/part-*.parquet com _metadata e _sources em colunas (requer pyarrow)")
+    parser.add_argument("--typed", choices=["parquet", "csv"], default=None,
+                        help="grava também colunas tipadas e normalizadas (datas, valores R$, telefones, UF) em <output_dir>/typed/")
+    parser.add_argument("--row-group-size", type=int, default=Config.row_group_size,
+                        help="documentos por row group do parquet, entre fsyncs do jsonl e por lote de normalização das colunas tipadas")
+    parser.add_argument("--resume", action="store_true",
+                        help="retoma o batch pelo journal (<output_dir>.journal.jsonl), pulando itens já concluídos")
+    parser.add_argument("--worker-max-docs", type=int, default=Config.worker_max_docs,
+                        help="documentos por worker antes de reciclar o processo no modo --low-memory (0 = nunca)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve /metrics no formato Prometheus nesta porta durante o batch")
+    parser.add_argument("--metrics-host", default=Config.metrics_host,
+                        help="interface do /metrics (padrão: só local; 0.0.0.0 para o Prometheus de outra máquina)")
+    add_extraction_args(parser)
+    args = parser.parse_args(argv)
+    if args.output_format == "parquet" and not HAS_PYARROW:
+        parser.error("--output-format parquet requer o pyarrow (pip install pyarrow)")
+    return args
+
+def parse_serve_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serviço de extração residente (HTTP e/ou pasta observada)",
+        usage="python cli.py serve [files_dir] [output_dir] [opções]",
+    )
+    parser.add_argument("files_dir", nargs="?", default="files", help="pasta base dos pdf_path (padrão: files)")
+    parser.add_argument("output_dir", nargs="?", default="output",
+                        help="pasta de saída dos batches da pasta observada (padrão: output)")
+    parser.add_argument("--port", type=int, default=Config.serve_port, help="porta HTTP (0 = sem HTTP)")
+    parser.add_argument("--host", default=Config.serve_host,
+                        help="interface do HTTP (padrão: só local; o serviço não tem autenticação)")
+    parser.add_argument("--watch", default=None, help="pasta observada: batches .json/.jsonl colocados nela são processados")
+    parser.add_argument("--watch-interval", type=float, default=Config.watch_interval_s,
+                        help="intervalo entre varreduras da pasta observada (s)")
+    parser.add_argument("--queue-size", type=int, default=Config.serve_queue_size,
+                        help="documentos aguardando extração antes de recusar pedidos (503)")
+    parser.add_argument("--request-timeout", type=float, default=Config.serve_timeout_s,
+                        help="espera máxima de um POST /extract (s)")
+    add_extraction_args(parser)
+    return parser.parse_args(argv)
+
+def config_from_args(args: argparse.Namespace) -> Config:
+    config = Config(
+        gpt_async=args.async_gpt,
+        gpt_concurrency=args.gpt_concurrency,
+        gpt_rate_limit=args.gpt_rate_limit,
+        gpt_batch_size=max(1, args.gpt_batch_size),
+        gpt_batch_wait_ms=args.gpt_batch_wait_ms,
+        gpt_routing=args.gpt_routing,
+        gpt_context=args.gpt_context,
+        gpt_context_tokens=max(1, args.gpt_context_tokens),
+        gpt_token_budget=max(0, args.gpt_token_budget),
+        gpt_min_field_gain=args.gpt_min_field_gain,
+        text_cache=not args.no_text_cache,
+        gpt_cache=not args.no_gpt_cache,
+        pattern_store=not args.no_pattern_store,
+        lazy_pages=not args.no_lazy_pages,
+        dedup=args.dedup,
+        dedup_min_similarity=args.dedup_similarity,
+        low_memory=args.low_memory,
+        max_text_chars=args.max_text_chars,
+        metrics_file=args.metrics_file,
+        log_level=args.log_level,
+        log_async=args.log_async,
+        log_format=args.log_format,
+        log_sample=max(0, args.log_sample),
+        quiet=args.quiet,
+    )
+    if hasattr(args, "batch"):
+        return replace(
+            config,
+            workers=max(1, args.workers),
+            pipeline=args.pipeline,
+            read_threads=max(1, args.read_threads),
+            lookahead=max(1, args.lookahead),
+            output_format=args.output_format,
+            typed_output=args.typed,
+            row_group_size=max(1, args.row_group_size),
+            resume=args.resume,
+            worker_max_docs=args.worker_max_docs,
+            metrics_port=args.metrics_port,
+            metrics_host=args.metrics_host,
+        )
+    return replace(
+        config,
+        serve_port=args.port,
+        serve_host=args.host,
+        serve_queue_size=max(1, args.queue_size),
+        serve_timeout_s=args.request_timeout,
+        watch_dir=args.watch,
+        watch_interval_s=args.watch_interval,
+    )
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        args = parse_serve_args(sys.argv[2:])
+        config = config_from_args(args)
+        if not config.serve_port and not config.watch_dir:
+            sys.exit("serve: informe --port e/ou --watch")
+        serve(args.files_dir, args.output_dir, config)
+    else:
+        args = parse_args()
+        process_batch(args.batch, args.files_dir, args.output_dir, config_from_args(args))